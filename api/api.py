@@ -9,22 +9,60 @@ if __package__ in (None, ""):
     import pathlib, sys
     sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
 
-from fastapi import FastAPI, HTTPException
-from typing import Optional, List, Dict
+from fastapi import FastAPI, HTTPException, Query, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from typing import Optional, List, Dict, Iterator
 from .database_handler import add_intune_app, search_apps, deploy_app
-from .functions.winget import search_winget_packages
+from .functions.winget import (
+    WingetSearchError, iter_winget_packages, resolve_winget_packages, search_winget_packages,
+)
+from .functions.winget_index import IndexNotConfiguredError, get_winget_index, refresh_winget_index
+from .functions.search_cache import normalize_search_term, search_cache
 from pydantic import BaseModel
-from .functions.intune_win32_uploader import upload_intunewin
-from .functions.ai_detection import generate_detection_script
+from .functions.intune_win32_uploader import upload_intunewin, upload_intunewin_async
+from .functions.deploy_jobs import job_manager
+from .functions import async_uploader, deploy_jobs
+from .functions.app_inventory import IF_EXISTS_POLICIES, get_app_inventory
+from .functions.graph_batch import assign_apps, delete_apps, get_app_statuses
+from .functions.graph_client import get_graph_metrics
+from .functions.metrics import render_metrics
+from .functions.polling import get_poll_stats
+from .functions.tenants import UnknownTenantError, get_current_tenant, list_tenants, use_tenant
+from .functions.ai_detection import cached_detection_script, generate_detection_scripts
+from .functions.detection_cache import get_detection_cache
+from .functions import backblaze_utils
 from .app_library_endpoint import router as app_library_router # Add this import
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
+import asyncio
+import itertools
+import json
+import logging
 import os
 from dotenv import load_dotenv
 load_dotenv()  # Loads variables from a .env file into the environment
 
-app = FastAPI(title="Intune Deployment API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Shared pooled clients live for the lifetime of the process
+    await backblaze_utils.open_session()
+    await async_uploader.open_session()
+    try:
+        yield
+    finally:
+        job_manager.shutdown()
+        await async_uploader.close_session()
+        await backblaze_utils.close_session()
+
+app = FastAPI(title="Intune Deployment API", lifespan=lifespan)
+logger = logging.getLogger(__name__)
 
 # Get environment variables or set defaults
+SEARCH_PAGE_SIZE = int(os.environ.get("SEARCH_PAGE_SIZE", 50))
+SEARCH_MAX_PAGE_SIZE = 1000
+RESOLVE_MAX_IDS = 1000
+BULK_MAX_APPS = 1000
+DETECTION_BATCH_MAX_APPS = 500
 debug_mode = os.environ.get("DEBUG", "true").lower() == "true"
 
 # Make CORS configuration more dynamic
@@ -49,6 +87,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count"],  # /search pagination
 )
 
 # Include the App Library router
@@ -58,22 +97,123 @@ app.include_router(app_library_router, prefix="/app-library", tags=["App Library
 async def root():
     return {"message": "Welcome to the Intune Deployment API"}
 
+def _parse_cursor(cursor: Optional[str]) -> int:
+    # Cursors are opaque to clients; today they are the offset of the next row
+    if cursor is None:
+        return 0
+    if not cursor.isdigit():
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return int(cursor)
+
+def _stream_search(key: str, search_term: str, offset: int, limit: Optional[int],
+                   loop: asyncio.AbstractEventLoop) -> Iterator[str]:
+    """Yield NDJSON rows as winget produces them (runs in the threadpool)."""
+    cached = [] if offset == 0 and limit is None else None
+    rows = itertools.islice(iter_winget_packages(search_term), offset,
+                            None if limit is None else offset + limit)
+    try:
+        for row in rows:
+            if cached is not None:
+                cached.append(row)
+            yield json.dumps(row) + "\n"
+    except WingetSearchError as e:
+        # Rows already sent cannot be withdrawn; just never cache a failed search
+        logger.warning("winget search for '%s' failed part-way; not caching it: %s", search_term, e)
+        return
+    if cached is not None:
+        # Complete result sets also serve later non-streamed searches
+        loop.call_soon_threadsafe(search_cache.put, key, cached)
+
 @app.get("/search", response_model=List[Dict[str, str]])
-async def search_applications_json(search_term: str):
+async def search_applications_json(
+    search_term: str,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=SEARCH_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    stream: bool = False,
+):
     """
     Search for applications using winget and return structured JSON data.
     Pass the search term as a query parameter, e.g., /search?search_term=vscode
     
     Returns a list of applications with Name, Id, Version, and Source fields.
+    Results are cached per normalised term and concurrent identical searches
+    share one lookup, which runs off the event loop.
+
+    Pagination: pass ``limit`` (and the ``X-Next-Cursor`` response header of
+    the previous page as ``cursor``) to get one page at a time;
+    ``X-Total-Count`` holds the number of matches.  With ``stream=true`` the
+    results are sent as NDJSON (one JSON object per line) as soon as winget
+    prints them.
     """
+    key = normalize_search_term(search_term)
+    offset = _parse_cursor(cursor)
     try:
-        apps = search_winget_packages(search_term)
+        if stream:
+            cached = search_cache.peek(key)
+            if cached is not None:
+                page = cached[offset:None if limit is None else offset + limit]
+                body = (json.dumps(row) + "\n" for row in page)
+            else:
+                body = _stream_search(key, search_term, offset, limit, asyncio.get_running_loop())
+            return StreamingResponse(body, media_type="application/x-ndjson")
+
+        apps = await search_cache.get_or_load(
+            key,
+            lambda: asyncio.to_thread(search_winget_packages, search_term),
+        )
         if not apps:
             raise HTTPException(status_code=404, detail="No applications found matching the search term")
-        return apps
+        if limit is None and cursor is None:
+            return apps
+
+        page = apps[offset:offset + (limit or SEARCH_PAGE_SIZE)]
+        response.headers["X-Total-Count"] = str(len(apps))
+        if offset + len(page) < len(apps):
+            response.headers["X-Next-Cursor"] = str(offset + len(page))
+        return page
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+class ResolvePackagesRequest(BaseModel):
+    ids: List[str]
+
+@app.post("/packages/resolve", response_model=dict)
+async def resolve_packages(body: ResolvePackagesRequest):
+    """
+    Resolve the latest version, publisher and installer URLs of many winget
+    package IDs in one request.
+
+    Returns ``{"resolved": {id: {...}}, "failed": {id: "reason"}}``; unknown
+    IDs are reported under ``failed`` without failing the batch.  Uses the
+    local winget index when configured, otherwise ``winget show`` with at most
+    WINGET_RESOLVE_CONCURRENCY processes at once.
+    """
+    if len(body.ids) > RESOLVE_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {RESOLVE_MAX_IDS} IDs per request")
+    return await resolve_winget_packages(body.ids)
+
+@app.get("/search/index", response_model=dict)
+async def winget_index_stats():
+    """Size and age of the local winget catalog index used by /search."""
+    # The first call may build the index from manifests; keep that off the event loop
+    index = await asyncio.to_thread(get_winget_index)
+    if index is None:
+        return {"enabled": False}
+    return {"enabled": True, **index.stats()}
+
+@app.post("/search/index/refresh", response_model=dict)
+async def refresh_search_index():
+    """Re-read changed winget manifests into the local index and drop cached searches."""
+    try:
+        stats = await asyncio.to_thread(refresh_winget_index)
+        search_cache.invalidate()
+        return stats
+    except IndexNotConfiguredError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
 
 # Request model for /apps endpoint
 class UploadRequest(BaseModel):
@@ -83,13 +223,25 @@ class UploadRequest(BaseModel):
     publisher: Optional[str] = None
     description: Optional[str] = None
     detection_script: Optional[str] = None
+    # create | skip | update | fail when the tenant already has the package; defaults to DEPLOY_IF_EXISTS
+    if_exists: Optional[str] = None
+
+
+def _check_if_exists(if_exists: Optional[str]) -> None:
+    if if_exists is not None and if_exists.lower() not in IF_EXISTS_POLICIES:
+        raise HTTPException(status_code=400,
+                            detail=f"if_exists must be one of {', '.join(IF_EXISTS_POLICIES)}")
 
 
 # Endpoint to upload Win32 .intunewin package to Intune
-@app.post("/apps", response_model=dict, status_code=201)
+@app.post("/apps", response_model=dict, status_code=202)
 async def upload_win32_app(body: UploadRequest):
     """
-    Upload a Win32 `.intunewin` package to Intune.
+    Queue the upload of a Win32 `.intunewin` package to Intune.
+
+    The deployment runs in the background; the response contains a job ID
+    that can be polled via ``GET /jobs/{job_id}``. The Intune app ID is
+    available as the job ``result`` once the job has succeeded.
 
     Body parameters
     ---------------
@@ -105,19 +257,182 @@ async def upload_win32_app(body: UploadRequest):
         Descriptive text shown in Intune. Defaults to display_name if omitted.
     detection_script : str, optional
         A PowerShell detection script (Base64‑encoded by the uploader). Defaults to "exit 0" when omitted.
+    if_exists : str, optional
+        ``create`` (default, see DEPLOY_IF_EXISTS), ``skip`` (the job returns the
+        existing app's ID without uploading), ``update`` (upload the package as a
+        new content version of the existing app, unless that app already has
+        it committed) or ``fail`` when the tenant already has an app for ``package_id``.
+    """
+    _check_if_exists(body.if_exists)
+    # With DEPLOY_ASYNC the deploy is a task on this event loop instead of a pool thread
+    submit, upload = ((job_manager.submit_async, upload_intunewin_async) if deploy_jobs.DEPLOY_ASYNC
+                      else (job_manager.submit, upload_intunewin))
+    job = submit(
+        "win32",
+        upload,
+        label=body.display_name,
+        path=body.path,
+        display_name=body.display_name,
+        package_id=body.package_id,
+        description=body.description,
+        publisher=body.publisher or "",
+        detection_script=body.detection_script,
+        if_exists=body.if_exists,
+    )
+    return job.to_dict()
+
+
+class BulkAppsRequest(BaseModel):
+    app_ids: List[str]
+
+
+class BulkAssignRequest(BulkAppsRequest):
+    targets: List[str]
+    intent: str = "required"
+
+
+def _check_bulk_size(app_ids: List[str]) -> None:
+    if len(app_ids) > BULK_MAX_APPS:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_MAX_APPS} apps per request")
+
+
+@app.post("/apps/status", response_model=dict)
+async def bulk_app_status(body: BulkAppsRequest):
+    """
+    Publishing state of many Intune apps, fetched 20 per Graph ``$batch`` call.
+
+    Returns ``{"apps": {id: {...}}, "failed": {id: "reason"}}``.
+    """
+    _check_bulk_size(body.app_ids)
+    return await asyncio.to_thread(get_app_statuses, body.app_ids)
+
+
+@app.post("/apps/assign", response_model=dict)
+async def bulk_assign_apps(body: BulkAssignRequest):
+    """
+    Assign many Intune apps at once (Graph ``$batch``).
+
+    Body parameters
+    ---------------
+    app_ids : list of str
+        Intune app IDs.
+    targets : list of str
+        ``"allDevices"``, ``"allUsers"`` or Entra group IDs; replaces the apps' current assignments.
+    intent : str, optional
+        ``required`` (default), ``available`` or ``uninstall``.
+
+    Returns ``{"assigned": [ids], "failed": {id: "reason"}}``.
+    """
+    _check_bulk_size(body.app_ids)
+    return await asyncio.to_thread(assign_apps, body.app_ids, body.targets, body.intent)
+
+
+@app.post("/apps/delete", response_model=dict)
+async def bulk_delete_apps(body: BulkAppsRequest):
+    """Delete many Intune apps (Graph ``$batch``); returns ``{"deleted": [ids], "failed": {id: "reason"}}``."""
+    _check_bulk_size(body.app_ids)
+    return await asyncio.to_thread(delete_apps, body.app_ids)
+
+
+@app.get("/inventory/apps", response_model=dict)
+async def find_inventory_apps(
+    package_id: Optional[str] = Query(None),
+    display_name: Optional[str] = Query(None),
+    tenant: Optional[str] = Query(None, description="Tenant profile; defaults to the default tenant"),
+):
+    """
+    Look up apps in the local tenant inventory (see ``app_inventory``).
+
+    The tenant's inventory is synced first when it is stale.  Returns
+    ``{"apps": [...]}`` with the ID, display name, notes, package ID,
+    publishing state and last modification of every matching app.
     """
+    inventory = _require_inventory()
+    apps = await asyncio.to_thread(_in_tenant, tenant, inventory.find,
+                                   package_id=package_id, display_name=display_name)
+    return {"apps": apps}
+
+
+@app.post("/inventory/sync", response_model=dict)
+async def sync_inventory(tenant: Optional[str] = Query(None), full: bool = Query(False)):
+    """Sync a tenant's inventory now (incrementally unless ``full``); returns the apps fetched and removed."""
+    inventory = _require_inventory()
+    return await asyncio.to_thread(_in_tenant, tenant, inventory.sync, full=full)
+
+
+@app.get("/inventory", response_model=dict)
+async def inventory_stats():
+    """Apps and last sync times per tenant in the local inventory."""
+    inventory = get_app_inventory()
+    if inventory is None:
+        return {"enabled": False}
+    return {"enabled": True, "tenants": inventory.stats()}
+
+
+def _require_inventory():
+    inventory = get_app_inventory()
+    if inventory is None:
+        raise HTTPException(status_code=404, detail="The app inventory is disabled (APP_INVENTORY_PATH)")
+    return inventory
+
+
+def _in_tenant(tenant: Optional[str], func, **kwargs):
+    """Call ``func(tenant, **kwargs)`` with Graph calls routed to *tenant* (a profile name)."""
     try:
-        app_id = upload_intunewin(
-            path=body.path,
-            display_name=body.display_name,
-            package_id=body.package_id,
-            description=body.description,
-            publisher=body.publisher or "",
-            detection_script=body.detection_script,
-        )
-        return {"app_id": app_id}
-    except Exception as exc:
-        raise HTTPException(status_code=500, detail=str(exc))
+        with use_tenant(tenant):
+            return func(get_current_tenant(), **kwargs)
+    except UnknownTenantError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+
+@app.get("/jobs", response_model=List[dict])
+async def list_jobs():
+    """List known deployment jobs, newest first."""
+    return [job.to_dict() for job in job_manager.list()]
+
+
+@app.get("/jobs/{job_id}", response_model=dict)
+async def get_job(job_id: str):
+    """
+    Return the status of a background deployment job.
+
+    ``status`` is one of queued, running, succeeded or failed; ``stage`` tracks
+    progress through the upload (shell_created, uploading, committing,
+    publishing). On success ``result`` holds the Intune app ID.
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return job.to_dict()
+
+@app.get("/tenants", response_model=List[str])
+async def get_tenants():
+    """Names of the configured Graph tenant profiles (targets for fan-out deploys)."""
+    return list_tenants()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """
+    Deploy stage timings, Graph/B2/Azure Blob request counts and latencies and
+    bytes moved, in the Prometheus text format (see ``functions/metrics.py``).
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/metrics/graph", response_model=dict)
+async def graph_metrics():
+    """Per-endpoint Microsoft Graph request counts and latencies (seconds)."""
+    return get_graph_metrics()
+
+
+@app.get("/metrics/search", response_model=dict)
+async def search_cache_metrics():
+    """Hit/miss/coalesced counters of the /search result cache."""
+    return search_cache.stats()
+
+@app.get("/metrics/polling", response_model=dict)
+async def polling_metrics():
+    """How many Graph polls each Intune wait stage (storage_uri, commit, publish) took."""
+    return get_poll_stats()
 
 # Response model for detection script endpoint
 class DetectionScriptResponse(BaseModel):
@@ -126,7 +441,7 @@ class DetectionScriptResponse(BaseModel):
 
 # Endpoint to generate a detection script for an application
 @app.get("/detection-script", response_model=DetectionScriptResponse)
-async def get_detection_script(app_name: str):
+async def get_detection_script(app_name: str, package_id: Optional[str] = None):
     """
     Generate a PowerShell detection script for an application.
     
@@ -134,6 +449,9 @@ async def get_detection_script(app_name: str):
     ---------------
     app_name : str
         The name of the application (e.g., "Google Chrome", "7-Zip").
+    package_id : str, optional
+        Winget package identifier; lets the script be built from the app's
+        manifest data when the name alone is ambiguous.
         
     Returns
     -------
@@ -144,13 +462,56 @@ async def get_detection_script(app_name: str):
     The script will detect if the application is installed and output a message
     to STDOUT when detected, with exit code 0 for success (detected) or non-zero
     for failure (not detected).
+
+    Apps found in the local winget index are answered from templates built
+    from their manifests (see ``detection_templates``).  Other scripts come
+    from the LLM and are cached persistently (see ``detection_cache``);
+    repeated requests for the same app are answered without calling the LLM.
     """
     try:
-        script = generate_detection_script(app_name)
+        script = await asyncio.to_thread(cached_detection_script, app_name, package_id=package_id)
         return {"script": script, "app_name": app_name}
     except Exception as exc:
         raise HTTPException(status_code=500, detail=str(exc))
 
+class DetectionScriptBatchRequest(BaseModel):
+    app_names: List[str]
+
+@app.post("/detection-scripts/batch")
+async def generate_detection_scripts_batch(body: DetectionScriptBatchRequest):
+    """
+    Generate detection scripts for many applications in one request.
+
+    Results are streamed as NDJSON, one line per app in order of completion:
+    ``{"app_name", "script", "cached"}`` or ``{"app_name", "error"}``.
+    Requests to the LLM run concurrently under DETECTION_MAX_CONCURRENCY and
+    DETECTION_REQUESTS_PER_MINUTE and are retried when rate limited.
+    """
+    if len(body.app_names) > DETECTION_BATCH_MAX_APPS:
+        raise HTTPException(status_code=400, detail=f"At most {DETECTION_BATCH_MAX_APPS} apps per request")
+
+    async def _ndjson():
+        async for result in generate_detection_scripts(body.app_names):
+            yield json.dumps(result) + "\n"
+
+    return StreamingResponse(_ndjson(), media_type="application/x-ndjson")
+
+@app.delete("/detection-script/cache", response_model=dict)
+async def invalidate_detection_scripts(app_name: Optional[str] = None):
+    """Drop cached detection scripts for *app_name*, or for every app when omitted."""
+    cache = get_detection_cache()
+    if cache is None:
+        return {"enabled": False, "removed": 0}
+    return {"enabled": True, "removed": cache.invalidate(app_name)}
+
+@app.get("/metrics/detection-cache", response_model=dict)
+async def detection_cache_metrics():
+    """Entry count and hit/miss counters of the detection-script cache."""
+    cache = get_detection_cache()
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **cache.stats()}
+
 
 if __name__ == "__main__":
     import uvicorn
@@ -3,23 +3,42 @@ API endpoint for app library deployments
 This module handles the deployment of app library applications to Intune
 """
 
+import asyncio
 import os
 import tempfile
 import logging
+import time
+from contextlib import ExitStack, contextmanager
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-from typing import Optional
-import aiohttp
+from typing import Any, Callable, Dict, Iterator, List, Optional
+import requests
 
 # Import the new app library uploader
-from .functions.app_library_intune_uploader import upload_app_library_intunewin
+from .functions.app_library_intune_uploader import (
+    fan_out_app_library_intunewin,
+    stream_app_library_intunewin,
+    upload_app_library_intunewin,
+    upload_app_library_intunewin_async,
+)
+
+from .functions.app_inventory import IF_EXISTS_POLICIES
 
 # Import BackBlaze utilities from its new location
-from .functions.backblaze_utils import get_file_download_url
+from .functions.backblaze_utils import get_file_download_info
+from .functions import deploy_jobs
+from .functions.deploy_jobs import STAGE_DOWNLOADING, job_manager
+from .functions.metrics import B2_REQUEST_SECONDS, B2_REQUESTS, PACKAGE_DOWNLOAD_BYTES, status_label
+from .functions.package_cache import cache_key, get_package_cache
+from .functions.remote_intunewin import _TRANSIENT_ERRORS, _retry_wait, _timeout
+from .functions.tenants import UnknownTenantError, get_tenant_profile
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# Pipelined BackBlaze → Azure deploys are the default; set to "false" to download first
+APP_LIBRARY_STREAMING = os.environ.get("APP_LIBRARY_STREAMING", "true").lower() == "true"
+
 class AppLibraryDeployRequest(BaseModel):
     """Request model for app library deployments"""
     backblaze_path: str
@@ -30,18 +49,172 @@ class AppLibraryDeployRequest(BaseModel):
     detection_script: Optional[str] = None
     install_command: Optional[str] = None
     uninstall_command: Optional[str] = None
+    # Stream BackBlaze → Azure without a temp file; defaults to APP_LIBRARY_STREAMING
+    streaming: Optional[bool] = None
+    # create | skip | update | fail when the tenant already has the package; defaults to DEPLOY_IF_EXISTS
+    if_exists: Optional[str] = None
+
+class AppLibraryFanOutRequest(AppLibraryDeployRequest):
+    """Request model for deploying one app library package to several tenants"""
+    tenants: List[str]
+    # Tenants deployed to at once; defaults to FANOUT_MAX_PARALLEL
+    max_parallel: Optional[int] = None
+
+def _check_if_exists(if_exists: Optional[str]) -> None:
+    if if_exists is not None and if_exists.lower() not in IF_EXISTS_POLICIES:
+        raise HTTPException(status_code=400,
+                            detail=f"if_exists must be one of {', '.join(IF_EXISTS_POLICIES)}")
+
+def _download_to(download_url: str, fh) -> None:
+    """
+    Stream the file at *download_url* into the writable binary *fh*.
+
+    Every GET carries the (connect, read) timeout of ``remote_intunewin``; a
+    download that stalls or breaks part-way is resumed with a ``Range``
+    request from the last byte written, retried like a remote payload stream.
+    """
+    start = time.perf_counter()
+    status = None
+    received = 0
+    total = None
+    attempt = 0
+    try:
+        while total is None or received < total:
+            headers = {"Range": f"bytes={received}-"} if received else {}
+            try:
+                with requests.get(download_url, headers=headers, stream=True, timeout=_timeout()) as response:
+                    status = response.status_code
+                    if received and response.status_code != 206:
+                        raise RuntimeError(
+                            f"BackBlaze did not resume the download at byte {received} (status {status})")
+                    if not received and response.status_code != 200:
+                        raise RuntimeError(f"Failed to download file from BackBlaze: {response.text}")
+                    if total is None and "Content-Length" in response.headers:
+                        total = int(response.headers["Content-Length"])
+                    for chunk in response.iter_content(chunk_size=1024 * 1024):  # 1MB chunks
+                        fh.write(chunk)
+                        received += len(chunk)
+                        attempt = 0
+                        PACKAGE_DOWNLOAD_BYTES.inc(len(chunk), mode="full")
+                if total is None:
+                    return  # no length to check against; the stream ended cleanly
+                if received < total:
+                    raise requests.exceptions.ChunkedEncodingError(
+                        f"Download ended after {received} of {total} bytes")
+            except _TRANSIENT_ERRORS as exc:
+                attempt += 1
+                _retry_wait(attempt, f"BackBlaze download from byte {received}", exc)
+    finally:
+        B2_REQUESTS.inc(api="download_file", status=status_label(status))
+        B2_REQUEST_SECONDS.observe(time.perf_counter() - start, api="download_file")
+
+@contextmanager
+def _local_package(file_info: Dict[str, Any], backblaze_path: str) -> Iterator[str]:
+    """Yield a local copy of the package: from the package cache if enabled, else a temp file."""
+    download_url = file_info["download_url"]
+    cache = get_package_cache()
+    if cache is not None:
+        # Repeat deploys of the same package are served from the local cache
+        key = cache_key(file_info["file_id"], file_info.get("content_sha1"))
+        with cache.package(
+            key,
+            lambda fh: _download_to(download_url, fh),
+            expected_size=file_info.get("content_length"),
+            expected_sha1=file_info.get("content_sha1"),
+        ) as cached_path:
+            yield str(cached_path)
+        return
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        temp_file_path = os.path.join(temp_dir, os.path.basename(backblaze_path))
+
+        logger.info(f"Downloading file from BackBlaze: {backblaze_path} to {temp_file_path}")
+        with open(temp_file_path, 'wb') as f:
+            _download_to(download_url, f)
+        logger.info(f"File downloaded successfully to {temp_file_path}")
+        yield temp_file_path
+
+def _deploy_from_backblaze(
+    file_info: Dict[str, Any],
+    body: AppLibraryDeployRequest,
+    on_stage: Optional[Callable[[str], None]] = None,
+) -> str:
+    """Download the package from BackBlaze and upload it to Intune (runs in a job worker)."""
+    download_url = file_info["download_url"]
+    upload_kwargs = dict(
+        display_name=body.display_name,
+        package_id=body.package_id,
+        description=body.description,
+        publisher=body.publisher or "",
+        detection_script=body.detection_script,
+        install_command=body.install_command, # Will be passed to new uploader
+        uninstall_command=body.uninstall_command, # Will be passed to new uploader
+        on_stage=on_stage,
+        if_exists=body.if_exists,
+    )
+    if on_stage:
+        on_stage(STAGE_DOWNLOADING)
+
+    cache = get_package_cache()
+    if cache is None and (body.streaming if body.streaming is not None else APP_LIBRARY_STREAMING):
+        # Download and upload overlap; nothing touches the local disk
+        app_id = stream_app_library_intunewin(download_url=download_url, **upload_kwargs)
+    else:
+        with _local_package(file_info, body.backblaze_path) as local_path:
+            app_id = upload_app_library_intunewin(path=local_path, **upload_kwargs)
+
+    logger.info(f"App deployed successfully to Intune. App ID: {app_id}")
+    return app_id
+
+async def _deploy_from_backblaze_async(
+    file_info: Dict[str, Any],
+    body: AppLibraryDeployRequest,
+    on_stage: Optional[Callable[[str], None]] = None,
+) -> str:
+    """
+    Coroutine variant of :func:`_deploy_from_backblaze` for DEPLOY_ASYNC.
+
+    The package is downloaded (or taken from the package cache) in a worker
+    thread and then uploaded by the asyncio engine; ``streaming`` is not
+    supported on this path.
+    """
+    if on_stage:
+        on_stage(STAGE_DOWNLOADING)
+    # Entering and leaving the package (download, temp dir removal, cache pin
+    # release and eviction) is disk and network I/O: both happen in a worker thread
+    stack = ExitStack()
+    try:
+        local_path = await asyncio.to_thread(
+            stack.enter_context, _local_package(file_info, body.backblaze_path))
+        app_id = await upload_app_library_intunewin_async(
+            path=local_path,
+            display_name=body.display_name,
+            package_id=body.package_id,
+            description=body.description,
+            publisher=body.publisher or "",
+            detection_script=body.detection_script,
+            install_command=body.install_command,
+            uninstall_command=body.uninstall_command,
+            on_stage=on_stage,
+            if_exists=body.if_exists,
+        )
+    finally:
+        await asyncio.to_thread(stack.close)
+    logger.info(f"App deployed successfully to Intune. App ID: {app_id}")
+    return app_id
 
 # The path here will be relative to the prefix defined in api/api.py (e.g. /app-library)
 # So if prefix is /app-library, this endpoint becomes /app-library/deploy
-@router.post("/deploy", response_model=dict, status_code=201)
+@router.post("/deploy", response_model=dict, status_code=202)
 async def deploy_app_library_app(body: AppLibraryDeployRequest):
     """
     Deploy an application from the app library to Intune.
     
     This endpoint:
-    1. Downloads the .intunewin file from BackBlaze
-    2. Uploads it to Intune using custom install/uninstall commands
-    3. Returns the Intune app ID
+    1. Resolves a download URL for the .intunewin file in BackBlaze
+    2. Queues a background job that downloads the file and uploads it to
+       Intune using custom install/uninstall commands
+    3. Returns the job immediately; poll ``GET /jobs/{job_id}`` for progress
     
     Parameters
     ----------
@@ -61,58 +234,109 @@ async def deploy_app_library_app(body: AppLibraryDeployRequest):
         Custom install command
     uninstall_command : str, optional
         Custom uninstall command
+    streaming : bool, optional
+        Stream the package from BackBlaze straight into Azure Blob (no temp
+        file, download and upload overlap). Defaults to APP_LIBRARY_STREAMING.
+        Ignored when the package cache (PACKAGE_CACHE_DIR) is enabled or
+        deploys run on the asyncio engine (DEPLOY_ASYNC).
+    if_exists : str, optional
+        ``create``, ``skip``, ``update`` (new content version of the existing
+        app) or ``fail`` when the tenant already has an app for ``package_id``
+        (see ``app_inventory``). Defaults to DEPLOY_IF_EXISTS.
     
     Returns
     -------
     dict
-        A dictionary containing the Intune app ID
+        The queued deployment job; its ``result`` becomes the Intune app ID
     """
+    _check_if_exists(body.if_exists)
     try:
-        download_url = await get_file_download_url(body.backblaze_path)
-        if not download_url:
+        file_info = await get_file_download_info(body.backblaze_path)
+        if not file_info:
             raise HTTPException(status_code=404, detail=f"File not found in BackBlaze: {body.backblaze_path}")
-        
-        with tempfile.TemporaryDirectory() as temp_dir:
-            temp_file_path = os.path.join(temp_dir, os.path.basename(body.backblaze_path))
-            
-            logger.info(f"Downloading file from BackBlaze: {body.backblaze_path} to {temp_file_path}")
-            
-            async with aiohttp.ClientSession() as session:
-                async with session.get(download_url) as response:
-                    if response.status != 200:
-                        error_detail = f"Failed to download file from BackBlaze: {await response.text()}"
-                        logger.error(error_detail)
-                        raise HTTPException(
-                            status_code=response.status,
-                            detail=error_detail
-                        )
-                    
-                    with open(temp_file_path, 'wb') as f:
-                        while True:
-                            chunk = await response.content.read(1024 * 1024)  # 1MB chunks
-                            if not chunk:
-                                break
-                            f.write(chunk)
-            
-            logger.info(f"File downloaded successfully to {temp_file_path}")
-            
-            # Use the new app library uploader
-            app_id = upload_app_library_intunewin(
-                path=temp_file_path,
-                display_name=body.display_name,
-                package_id=body.package_id,
-                description=body.description,
-                publisher=body.publisher or "",
-                detection_script=body.detection_script,
-                install_command=body.install_command, # Will be passed to new uploader
-                uninstall_command=body.uninstall_command # Will be passed to new uploader
-            )
-            
-            logger.info(f"App deployed successfully to Intune. App ID: {app_id}")
-            return {"app_id": app_id}
+
+        if deploy_jobs.DEPLOY_ASYNC:
+            submit, deploy = job_manager.submit_async, _deploy_from_backblaze_async
+        else:
+            submit, deploy = job_manager.submit, _deploy_from_backblaze
+        job = submit(
+            "app-library",
+            deploy,
+            label=body.display_name,
+            file_info=file_info,
+            body=body,
+        )
+        return job.to_dict()
 
     except HTTPException: # Re-raise HTTPExceptions directly to preserve status code and details
         raise
     except Exception as exc:
         logger.error(f"Error deploying app: {str(exc)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred during app deployment: {str(exc)}")
+
+def _fan_out_from_backblaze(
+    file_info: Dict[str, Any],
+    body: AppLibraryFanOutRequest,
+    on_stage: Optional[Callable[[str], None]] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """Download the package once and upload it to every requested tenant (runs in a job worker)."""
+    if on_stage:
+        on_stage(STAGE_DOWNLOADING)
+    with _local_package(file_info, body.backblaze_path) as local_path:
+        return fan_out_app_library_intunewin(
+            path=local_path,
+            tenants=body.tenants,
+            display_name=body.display_name,
+            package_id=body.package_id,
+            description=body.description,
+            publisher=body.publisher or "",
+            detection_script=body.detection_script,
+            install_command=body.install_command,
+            uninstall_command=body.uninstall_command,
+            max_parallel=body.max_parallel,
+            on_stage=on_stage,
+            if_exists=body.if_exists,
+        )
+
+@router.post("/deploy/fan-out", response_model=dict, status_code=202)
+async def fan_out_app_library_app(body: AppLibraryFanOutRequest):
+    """
+    Deploy one app library package to several tenants in parallel.
+
+    Takes the same fields as ``POST /app-library/deploy`` plus ``tenants``
+    (credential profile names, see ``GET /tenants``) and an optional
+    ``max_parallel``.  The package is downloaded and parsed once, then
+    uploaded to each tenant concurrently.  The job ``result`` maps each
+    tenant to ``{"status": "succeeded", "result": <app id>}`` or
+    ``{"status": "failed", "error": ...}``; the job itself only fails when
+    every tenant failed.
+    """
+    if not body.tenants:
+        raise HTTPException(status_code=400, detail="At least one tenant is required")
+    _check_if_exists(body.if_exists)
+    try:
+        for tenant in body.tenants:
+            get_tenant_profile(tenant)
+    except UnknownTenantError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    file_info = await get_file_download_info(body.backblaze_path)
+    if not file_info:
+        raise HTTPException(status_code=404, detail=f"File not found in BackBlaze: {body.backblaze_path}")
+
+    job = job_manager.submit(
+        "app-library-fan-out",
+        _fan_out_from_backblaze,
+        label=f"{body.display_name} → {len(set(body.tenants))} tenant(s)",
+        file_info=file_info,
+        body=body,
+    )
+    return job.to_dict()
+
+@router.get("/cache", response_model=dict)
+async def package_cache_stats():
+    """Size, entry count and hit/miss counters of the local package cache."""
+    cache = get_package_cache()
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **cache.stats()}
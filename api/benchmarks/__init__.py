@@ -0,0 +1,3 @@
+"""
+Local benchmarks and fake service endpoints for the Intune Deployment API
+"""
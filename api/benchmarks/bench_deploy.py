@@ -0,0 +1,169 @@
+"""
+End-to-end deploy benchmark against a local Graph / Azure Blob / B2 emulator.
+
+Usage (from the project root):
+    python -m api.benchmarks.bench_deploy [--deploys 20] [--concurrency 4] [--size-mb 16]
+        [--latency-ms 20] [--bandwidth-mbps 0] [--storage-uri-delay 1] [--commit-delay 2]
+        [--publish-delay 2] [--mode win32 app-library] [--async] [--no-streaming]
+
+A :class:`FakeIntuneServer` stands in for every remote service; the API is
+configured to use it (GRAPH_BASE, GRAPH_STATIC_TOKEN, BACKBLAZE_*) before it
+is imported and is driven in-process.  Each mode queues ``--deploys`` jobs on
+``/apps`` (a synthetic package on disk) or ``/app-library/deploy`` (the same
+package served from the fake bucket), waits for them via ``/jobs/{id}`` and
+reports p50/p95 deploy time, upload throughput and the requests each service
+received.  Upload checkpoints, the app inventory and the package cache are
+disabled.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+from typing import Dict, List
+
+import httpx
+
+from ..functions.intunewin import CONTENTS_DIR, DETECTION_XML
+from .fake_intune_server import FakeIntuneServer
+
+SAMPLE = Path(__file__).resolve().parent.parent / "files" / "Winget-InstallPackage.intunewin"
+B2_PATH = "bench/package.intunewin"
+
+
+def _make_package(directory: str, size_mb: int) -> Path:
+    """Write a .intunewin with the sample's metadata and a random stored payload of *size_mb* MiB."""
+    with zipfile.ZipFile(SAMPLE) as src:
+        detection = src.read(DETECTION_XML)
+        file_name = src.namelist()[0][len(CONTENTS_DIR):]
+    path = Path(directory) / "package.intunewin"
+    with zipfile.ZipFile(path, "w") as zf:
+        zf.writestr(zipfile.ZipInfo(CONTENTS_DIR + file_name), os.urandom(size_mb * 1024 * 1024))
+        zf.writestr(DETECTION_XML, detection)
+    return path
+
+
+def _configure(server: FakeIntuneServer, args: argparse.Namespace) -> None:
+    """Point the API at the emulator; must run before the API modules are imported."""
+    os.environ.update({
+        "GRAPH_BASE": server.graph_base,
+        "GRAPH_STATIC_TOKEN": "bench-token",
+        "BACKBLAZE_ENDPOINT": server.url,
+        "BACKBLAZE_BUCKET_ID": "bench-bucket-id",
+        "BACKBLAZE_BUCKET_NAME": server.bucket_name,
+        "BACKBLAZE_APPLICATION_KEY_ID": "bench",
+        "BACKBLAZE_APPLICATION_KEY": "bench",
+        "UPLOAD_CHECKPOINT_PATH": "",
+        "APP_INVENTORY_PATH": "",
+        "DEPLOY_MAX_WORKERS": str(args.concurrency),
+        "DEPLOY_MAX_ASYNC": str(args.concurrency),
+        "DEPLOY_ASYNC": "true" if args.use_async else "false",
+        "APP_LIBRARY_STREAMING": "false" if args.no_streaming else "true",
+    })
+    os.environ.pop("PACKAGE_CACHE_DIR", None)
+
+
+async def _deploy_all(client: httpx.AsyncClient, mode: str, package: Path, count: int) -> List[Dict]:
+    jobs = []
+    for i in range(count):
+        if mode == "win32":
+            response = await client.post("/apps", json={
+                "path": str(package), "display_name": f"Bench App {i}", "package_id": f"Bench.App{i}"})
+        else:
+            response = await client.post("/app-library/deploy", json={
+                "backblaze_path": B2_PATH, "display_name": f"Bench Library App {i}",
+                "package_id": f"Bench.Library{i}"})
+        response.raise_for_status()
+        jobs.append(response.json()["job_id"])
+
+    finished: Dict[str, Dict] = {}
+    while len(finished) < len(jobs):
+        await asyncio.sleep(0.05)
+        for job_id in jobs:
+            if job_id not in finished:
+                job = (await client.get(f"/jobs/{job_id}")).json()
+                if job["status"] in ("succeeded", "failed"):
+                    finished[job_id] = job
+    return list(finished.values())
+
+
+def _report(mode: str, jobs: List[Dict], elapsed: float, payload_bytes: int,
+            before: Dict[str, int], after: Dict[str, int]) -> None:
+    durations = sorted(job["finished_at"] - job["started_at"] for job in jobs)
+    p95 = durations[max(int(len(durations) * 0.95) - 1, 0)]
+    failed = [job for job in jobs if job["status"] != "succeeded"]
+    uploaded = payload_bytes * (len(jobs) - len(failed))
+    print(f"{mode:<12} {len(jobs)} deploys in {elapsed:6.2f} s  "
+          f"p50={statistics.median(durations):6.2f} s  p95={p95:6.2f} s  "
+          f"{uploaded / elapsed / 1024 ** 2:7.1f} MiB/s  failed={len(failed)}")
+    counts = {kind: after[kind] - before[kind] for kind in after}
+    print(f"{'':<12} requests: graph={counts['graph']} (carrying {counts['graph_batched']} batched) "
+          f"blob={counts['blob']} b2={counts['b2']}  ({counts['graph'] / len(jobs):.1f} Graph calls per deploy)")
+    for job in failed[:3]:
+        print(f"{'':<12} {job['label']}: {job['error']}")
+
+
+async def _run(args: argparse.Namespace, server: FakeIntuneServer, package: Path) -> None:
+    # Imported after _configure so module-level settings pick up the emulator
+    from ..api import app
+    from ..functions import async_uploader, backblaze_utils
+    from ..functions.intunewin import read_intunewin
+
+    payload_bytes = read_intunewin(package)[1].size
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            for mode in args.mode:
+                before = server.request_counts()
+                start = time.perf_counter()
+                jobs = await _deploy_all(client, mode, package, args.deploys)
+                _report(mode, jobs, time.perf_counter() - start, payload_bytes, before,
+                        server.request_counts())
+    finally:
+        await async_uploader.close_session()
+        await backblaze_utils.close_session()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="End-to-end deploy benchmark against a local emulator")
+    parser.add_argument("--deploys", type=int, default=20, help="deploys per mode")
+    parser.add_argument("--concurrency", type=int, default=4, help="deploy workers (DEPLOY_MAX_WORKERS)")
+    parser.add_argument("--size-mb", type=int, default=16, help="package payload size in MiB")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="round-trip latency per request")
+    parser.add_argument("--bandwidth-mbps", type=float, default=0.0,
+                        help="per-request upload/download bandwidth in Mbit/s (0 = unlimited)")
+    parser.add_argument("--storage-uri-delay", type=float, default=1.0,
+                        help="seconds before Intune hands out a file's SAS URI")
+    parser.add_argument("--commit-delay", type=float, default=2.0, help="seconds Intune takes to commit a file")
+    parser.add_argument("--publish-delay", type=float, default=2.0, help="seconds Intune takes to publish an app")
+    parser.add_argument("--mode", nargs="+", choices=["win32", "app-library"], default=["win32", "app-library"])
+    parser.add_argument("--async", dest="use_async", action="store_true", help="run deploys with DEPLOY_ASYNC")
+    parser.add_argument("--no-streaming", action="store_true",
+                        help="download app library packages before uploading")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)  # per-request uploader logs drown the results
+
+    with tempfile.TemporaryDirectory() as tmp, FakeIntuneServer(
+        latency=args.latency_ms / 1000,
+        bandwidth=args.bandwidth_mbps * 1000 ** 2 / 8,
+        storage_uri_delay=args.storage_uri_delay,
+        commit_delay=args.commit_delay,
+        publish_delay=args.publish_delay,
+    ) as server:
+        package = _make_package(tmp, args.size_mb)
+        server.add_b2_file(B2_PATH, package.read_bytes())
+        _configure(server, args)
+        print(f"deploys={args.deploys} concurrency={args.concurrency} size={args.size_mb} MiB "
+              f"latency={args.latency_ms} ms async={args.use_async} emulator={server.url}")
+        asyncio.run(_run(args, server, package))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Load-test ``/detection-script`` against a local fake LLM endpoint.
+
+Usage (from the project root):
+    python -m api.benchmarks.bench_detection_scripts [--requests 200] [--concurrency 32]
+        [--latency-ms 500] [--apps 50]
+
+Three passes are reported: cold (every request reaches the fake LLM), warm
+(answered from the detection-script cache) and ``/detection-scripts/batch``
+for the same apps with an empty cache.  Templates are disabled so every app
+goes through the LLM path.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import tempfile
+import time
+from typing import List
+
+import httpx
+
+from ..functions import ai_detection, detection_cache, detection_templates
+from .fake_llm_server import FakeLLMServer
+
+
+async def _hammer(client: httpx.AsyncClient, names: List[str], concurrency: int) -> List[float]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+
+    async def _one(name: str) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.get("/detection-script", params={"app_name": name})
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(_one(name) for name in names))
+    return latencies
+
+
+def _report(label: str, latencies: List[float], elapsed: float) -> None:
+    ordered = sorted(latencies)
+    p95 = ordered[int(len(ordered) * 0.95) - 1] if ordered else 0.0
+    print(f"{label:<6} {len(latencies) / elapsed:8.1f} req/s  "
+          f"p50={statistics.median(ordered) * 1000:7.1f} ms  p95={p95 * 1000:7.1f} ms")
+
+
+async def _run(args: argparse.Namespace, server: FakeLLMServer) -> None:
+    from ..api import app  # imported after the LLM settings below are in place
+
+    names = [f"Benchmark App {i % args.apps}" for i in range(args.requests)]
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for label in ("cold", "warm"):
+            start = time.perf_counter()
+            latencies = await _hammer(client, names, args.concurrency)
+            _report(label, latencies, time.perf_counter() - start)
+            print(f"       fake LLM requests so far: {server.requests}")
+
+        detection_cache.get_detection_cache().invalidate()
+        start = time.perf_counter()
+        response = await client.post("/detection-scripts/batch",
+                                     json={"app_names": sorted(set(names))})
+        lines = response.text.splitlines()
+        elapsed = time.perf_counter() - start
+        print(f"batch  {len(lines) / elapsed:8.1f} apps/s  ({len(lines)} apps in {elapsed:.2f} s, "
+              f"peak in flight at the LLM: {server.peak_in_flight})")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Detection script throughput benchmark")
+    parser.add_argument("--requests", type=int, default=200, help="requests per pass")
+    parser.add_argument("--concurrency", type=int, default=32, help="concurrent clients")
+    parser.add_argument("--apps", type=int, default=50, help="distinct app names")
+    parser.add_argument("--latency-ms", type=float, default=500.0,
+                        help="simulated completion latency of the fake LLM")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)  # per-request client logs drown the results
+
+    with tempfile.TemporaryDirectory() as tmp, \
+            FakeLLMServer(latency=args.latency_ms / 1000) as server:
+        ai_detection.DETECTION_LLM_BASE_URL = server.url
+        detection_templates.DETECTION_TEMPLATES = False
+        detection_cache.DETECTION_CACHE_PATH = os.path.join(tmp, "detection_cache.sqlite")
+        print(f"requests={args.requests} concurrency={args.concurrency} apps={args.apps} "
+              f"latency={args.latency_ms} ms")
+        asyncio.run(_run(args, server))
+        detection_cache.get_detection_cache().close()
+
+
+if __name__ == "__main__":
+    main()
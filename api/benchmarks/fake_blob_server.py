@@ -0,0 +1,129 @@
+"""
+Minimal in-process stand-in for an Azure BlockBlob SAS endpoint.
+
+Only the operations the uploader uses are implemented:
+
+* ``PUT ?comp=block&blockid=<id>``  – stage a block (body is counted, not kept)
+* ``PUT ?comp=blocklist``           – commit the staged blocks in list order
+* ``GET ?comp=blocklist&blocklisttype=uncommitted`` – list staged, uncommitted blocks
+
+An optional per-request latency simulates the round trip to a real storage
+account so that concurrency effects show up on a loopback interface, and an
+optional ``bandwidth`` (bytes/s per request) slows down large block bodies.  Setting
+``fail_block_puts`` makes that many of the following block PUTs answer
+``503 ServerBusy`` to exercise retries.
+"""
+
+from __future__ import annotations
+
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeBlobServer:
+    """Threaded fake blob endpoint. Use as a context manager or call start()/stop()."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 bandwidth: float = 0.0):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.staged: Dict[str, Dict[str, int]] = {}
+        self.committed: Dict[str, List[str]] = {}
+        self.requests = 0
+        self.fail_block_puts = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def sas_uri(self, blob: str = "payload") -> str:
+        """Return a SAS-style URI (with a dummy signature) for *blob*."""
+        return f"{self.url}/container/{blob}?sv=2020-01-01&sig=fake"
+
+    def start(self) -> "FakeBlobServer":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "FakeBlobServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _make_handler(self):
+        server = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):  # keep benchmark output clean
+                pass
+
+            def _reply(self, status: int, body: bytes = b"") -> None:
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if body:
+                    self.wfile.write(body)
+
+            def do_PUT(self):
+                url = urlparse(self.path)
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if server.latency:
+                    time.sleep(server.latency)
+                if server.bandwidth:
+                    time.sleep(len(body) / server.bandwidth)
+                with server._lock:
+                    server.requests += 1
+                    staged = server.staged.setdefault(url.path, {})
+                    if query.get("comp") == "block" and server.fail_block_puts > 0:
+                        server.fail_block_puts -= 1
+                        self._reply(503, b"ServerBusy")
+                        return
+                    if query.get("comp") == "block":
+                        staged[query["blockid"]] = len(body)
+                    elif query.get("comp") == "blocklist":
+                        ids = re.findall(r"<Latest>([^<]+)</Latest>", body.decode())
+                        missing = [b for b in ids if b not in staged]
+                        if missing:
+                            self._reply(400, b"InvalidBlockList")
+                            return
+                        server.committed[url.path] = ids
+                    else:
+                        self._reply(400, b"UnsupportedOperation")
+                        return
+                self._reply(201)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                if query.get("comp") != "blocklist":
+                    self._reply(400, b"UnsupportedOperation")
+                    return
+                with server._lock:
+                    server.requests += 1
+                    if url.path not in server.staged:
+                        self._reply(404, b"BlobNotFound")
+                        return
+                    # Committing discards the blocks that were not part of the list
+                    staged = {} if url.path in server.committed else dict(server.staged[url.path])
+                blocks = "".join(f"<Block><Name>{name}</Name><Size>{size}</Size></Block>"
+                                 for name, size in staged.items())
+                self._reply(200, ('<?xml version="1.0" encoding="utf-8"?><BlockList>'
+                                  f"<UncommittedBlocks>{blocks}</UncommittedBlocks></BlockList>").encode())
+
+        return _Handler
@@ -0,0 +1,398 @@
+"""
+Local stand-in for Microsoft Graph (Intune), Azure Blob and BackBlaze B2.
+
+One threaded HTTP server answers everything a deploy talks to, so ``/apps``
+and ``/app-library/deploy`` can run end to end on a laptop:
+
+* Graph under ``/beta`` (point GRAPH_BASE at :attr:`FakeIntuneServer.graph_base`):
+  ``mobileApps`` list (``$filter`` on ``lastModifiedDateTime`` and ``startswith(notes, …)``, ``$select``,
+  ``$top`` paging via ``@odata.nextLink``), create/get/patch/delete, ``contentVersions``, ``files``
+  (placeholder, get, ``commit``, ``renewUpload``), ``assign`` and JSON
+  ``$batch`` (at most 20 requests, ``dependsOn`` honoured).  Files get a SAS URI on
+  this server after ``storage_uri_delay``; a commit finishes after
+  ``commit_delay`` and fails unless the committed blob has exactly
+  ``sizeEncrypted`` bytes; an app is published ``publish_delay`` after its
+  content version is committed.
+* Azure block blobs under ``/container`` (see :class:`FakeBlobServer`).
+* B2 ``b2_authorize_account``, ``b2_list_file_names``,
+  ``b2_get_download_authorization`` and ``/file/<bucket>/<path>`` downloads
+  with ``Range`` support, for files added with :meth:`FakeIntuneServer.add_b2_file`.
+
+``latency`` is added to every request and ``bandwidth`` (bytes/s, per
+request) throttles block uploads and downloads.  Request counts per service
+are available from :meth:`FakeIntuneServer.request_counts`.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import re
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+from urllib.parse import parse_qsl, unquote, urlencode, urlparse
+
+from .fake_blob_server import FakeBlobServer
+
+_APPS = r"^/beta/deviceAppManagement/mobileApps"
+_VERSIONS = _APPS + r"/([^/]+)/microsoft\.graph\.win32LobApp/contentVersions"
+# For GETs a handler's *body* holds the query parameters
+_ROUTES = [
+    ("GET", re.compile(_APPS + r"$"), "_list_apps"),
+    ("POST", re.compile(_APPS + r"$"), "_create_app"),
+    ("GET", re.compile(_APPS + r"/([^/]+)$"), "_get_app"),
+    ("PATCH", re.compile(_APPS + r"/([^/]+)$"), "_patch_app"),
+    ("DELETE", re.compile(_APPS + r"/([^/]+)$"), "_delete_app"),
+    ("POST", re.compile(_APPS + r"/([^/]+)/assign$"), "_assign_app"),
+    ("POST", re.compile(_VERSIONS + r"$"), "_create_version"),
+    ("POST", re.compile(_VERSIONS + r"/([^/]+)/files$"), "_create_file"),
+    ("GET", re.compile(_VERSIONS + r"/([^/]+)/files/([^/]+)$"), "_get_file"),
+    ("POST", re.compile(_VERSIONS + r"/([^/]+)/files/([^/]+)/commit$"), "_commit_file"),
+    ("POST", re.compile(_VERSIONS + r"/([^/]+)/files/([^/]+)/renewUpload$"), "_renew_upload"),
+]
+
+_BATCH_MAX = 20
+_PAGE_MAX = 100
+_MODIFIED_FILTER = re.compile(r"lastModifiedDateTime (ge|gt) (\S+)")
+_NOTES_FILTER = re.compile(r"startswith\(notes,\s*'((?:[^']|'')*)'\)")
+_RANGE = re.compile(r"bytes=(\d+)-(\d*)$")
+# Downloads are written (and throttled) in chunks of this size
+_CHUNK = 64 * 1024
+
+
+def _status(method: str, path: str, result: Optional[Dict[str, Any]]) -> int:
+    if result is None:
+        return 204
+    return 201 if method == "POST" and path.endswith(("mobileApps", "contentVersions", "files")) else 200
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+class GraphError(Exception):
+    def __init__(self, status: int, code: str, message: str):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+
+
+class FakeIntuneServer(FakeBlobServer):
+    """Threaded Graph + Azure Blob + B2 emulator. Use as a context manager or call start()/stop()."""
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        bandwidth: float = 0.0,
+        storage_uri_delay: float = 0.0,
+        commit_delay: float = 0.0,
+        publish_delay: float = 0.0,
+        bucket_name: str = "bench-bucket",
+    ):
+        self.storage_uri_delay = storage_uri_delay
+        self.commit_delay = commit_delay
+        self.publish_delay = publish_delay
+        self.bucket_name = bucket_name
+        self.apps: Dict[str, Dict[str, Any]] = {}
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.b2_files: Dict[str, bytes] = {}
+        self.counts: Counter = Counter()
+        self.bytes_downloaded = 0
+        super().__init__(host, port, latency, bandwidth)
+
+    @property
+    def graph_base(self) -> str:
+        return f"{self.url}/beta"
+
+    def add_b2_file(self, name: str, data: bytes) -> None:
+        """Make *data* downloadable from the fake bucket as *name*."""
+        with self._lock:
+            self.b2_files[name] = data
+
+    def request_counts(self) -> Dict[str, int]:
+        """Requests served so far per service (``graph``, ``blob``, ``b2``); ``graph_batched``
+        counts the sub-requests that arrived inside ``$batch`` calls."""
+        with self._lock:
+            return {"graph": self.counts["graph"], "graph_batched": self.counts["graph_batched"],
+                    "blob": self.requests, "b2": self.counts["b2"]}
+
+    # ------------------------------------------------------------------ Graph
+
+    def _graph(self, method: str, path: str, body: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self.counts["graph"] += 1
+            if method == "POST" and path == "/beta/$batch":
+                return self._batch(body or {})
+            return self._dispatch(method, path, body)
+
+    def _dispatch(self, method: str, path: str, body: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        for route_method, pattern, handler in _ROUTES:
+            match = pattern.match(path)
+            if match and route_method == method:
+                return getattr(self, handler)(*match.groups(), body=body or {})
+        raise GraphError(400, "BadRequest", f"Unsupported request {method} {path}")
+
+    def _batch(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        requests = body.get("requests") or []
+        if len(requests) > _BATCH_MAX:
+            raise GraphError(400, "BadRequest", f"A batch may hold at most {_BATCH_MAX} requests")
+        statuses: Dict[str, int] = {}
+        responses = []
+        for request in requests:
+            self.counts["graph_batched"] += 1
+            method, url = request["method"].upper(), urlparse(request["url"])
+            if any(statuses.get(dep, 424) >= 400 for dep in request.get("dependsOn", [])):
+                status, result = 424, {"error": {"code": "FailedDependency", "message": "Dependency failed"}}
+            else:
+                try:
+                    body = dict(parse_qsl(url.query)) if method == "GET" else request.get("body")
+                    result = self._dispatch(method, f"/beta{url.path}", body)
+                    status = _status(method, url.path, result)
+                except GraphError as exc:
+                    status, result = exc.status, {"error": {"code": exc.code, "message": str(exc)}}
+            statuses[request["id"]] = status
+            responses.append({"id": request["id"], "status": status, "headers": {}, "body": result})
+        return {"responses": responses}
+
+    def _app(self, app_id: str) -> Dict[str, Any]:
+        if app_id not in self.apps:
+            raise GraphError(404, "ResourceNotFound", f"mobileApp {app_id} not found")
+        return self.apps[app_id]
+
+    def _file(self, app_id: str, version_id: str, file_id: str) -> Dict[str, Any]:
+        self._app(app_id)
+        entry = self.files.get(file_id)
+        if entry is None or entry["app_id"] != app_id or entry["version_id"] != version_id:
+            raise GraphError(404, "ResourceNotFound", f"file {file_id} not found")
+        return entry
+
+    def _list_apps(self, body):
+        apps = [self._app_view(app_id) for app_id in self.apps]
+        match = _MODIFIED_FILTER.search(body.get("$filter", ""))
+        if match:
+            op, since = match.groups()
+            apps = [a for a in apps if a["lastModifiedDateTime"] > since
+                    or (op == "ge" and a["lastModifiedDateTime"] == since)]
+        match = _NOTES_FILTER.search(body.get("$filter", ""))
+        if match:
+            prefix = match.group(1).replace("''", "'")
+            apps = [a for a in apps if (a.get("notes") or "").startswith(prefix)]
+        if body.get("$select"):
+            fields = body["$select"].split(",")
+            apps = [{k: v for k, v in a.items() if k in fields} for a in apps]
+        top = min(int(body.get("$top", _PAGE_MAX)), _PAGE_MAX)
+        skip = int(body.get("$skiptoken", 0))
+        page = {"value": apps[skip:skip + top]}
+        if skip + top < len(apps):
+            query = {k: v for k, v in body.items() if k != "$skiptoken"}
+            page["@odata.nextLink"] = (f"{self.graph_base}/deviceAppManagement/mobileApps?"
+                                       f"{urlencode(dict(query, **{'$skiptoken': skip + top}))}")
+        return page
+
+    def _create_app(self, body):
+        app_id = str(uuid.uuid4())
+        now = _now()
+        self.apps[app_id] = dict(body, id=app_id, publishingState="notPublished", createdDateTime=now,
+                                 lastModifiedDateTime=now, versions=0, published_at=None)
+        return self._app_view(app_id)
+
+    def _app_view(self, app_id: str) -> Dict[str, Any]:
+        app = self.apps[app_id]
+        if app["published_at"] is not None and time.time() >= app["published_at"]:
+            app["publishingState"] = "published"
+        return {k: v for k, v in app.items() if k not in ("versions", "published_at")}
+
+    def _get_app(self, app_id, body):
+        self._app(app_id)
+        return self._app_view(app_id)
+
+    def _patch_app(self, app_id, body):
+        app = self._app(app_id)
+        app.update({k: v for k, v in body.items() if k != "@odata.type"}, lastModifiedDateTime=_now())
+        if "committedContentVersion" in body:
+            app["publishingState"] = "processing"
+            app["published_at"] = time.time() + self.publish_delay
+        return None
+
+    def _delete_app(self, app_id, body):
+        self._app(app_id)
+        del self.apps[app_id]
+        return None
+
+    def _assign_app(self, app_id, body):
+        app = self._app(app_id)
+        app["assignments"] = body.get("mobileAppAssignments", [])
+        app["lastModifiedDateTime"] = _now()
+        return None
+
+    def _create_version(self, app_id, body):
+        app = self._app(app_id)
+        app["versions"] += 1
+        return {"id": str(app["versions"])}
+
+    def _create_file(self, app_id, version_id, body):
+        self._app(app_id)
+        file_id = str(uuid.uuid4())
+        self.files[file_id] = {
+            "app_id": app_id, "version_id": version_id, "body": body,
+            "uri_at": time.time() + self.storage_uri_delay,
+            "commit_at": None, "committed": None,
+        }
+        return {"id": file_id, "uploadState": "azureStorageUriRequestPending", "isCommitted": False}
+
+    def _get_file(self, app_id, version_id, file_id, body):
+        entry = self._file(app_id, version_id, file_id)
+        now = time.time()
+        view = {"id": file_id, "size": entry["body"].get("size"), "isCommitted": False,
+                "uploadState": "azureStorageUriRequestPending", "azureStorageUri": None}
+        if now >= entry["uri_at"]:
+            view["azureStorageUri"] = self.sas_uri(file_id)
+            view["uploadState"] = entry.get("uri_state", "azureStorageUriRequestSuccess")
+        if entry["commit_at"] is not None:
+            view["uploadState"] = "commitFilePending"
+            if now >= entry["commit_at"]:
+                if entry["committed"] is None:
+                    entry["committed"] = self._committed_size(file_id) == entry["body"].get("sizeEncrypted")
+                view["isCommitted"] = entry["committed"]
+                view["uploadState"] = "commitFileSuccess" if entry["committed"] else "commitFileFailed"
+        return view
+
+    def _committed_size(self, file_id: str) -> Optional[int]:
+        path = f"/container/{file_id}"
+        if path not in self.committed:
+            return None
+        staged = self.staged.get(path, {})
+        return sum(staged.get(block, 0) for block in self.committed[path])
+
+    def _commit_file(self, app_id, version_id, file_id, body):
+        entry = self._file(app_id, version_id, file_id)
+        if not body.get("fileEncryptionInfo"):
+            raise GraphError(400, "BadRequest", "fileEncryptionInfo is required")
+        entry["commit_at"] = time.time() + self.commit_delay
+        entry["committed"] = None
+        return None
+
+    def _renew_upload(self, app_id, version_id, file_id, body):
+        entry = self._file(app_id, version_id, file_id)
+        entry["uri_at"] = time.time() + self.storage_uri_delay
+        entry["uri_state"] = "azureStorageUriRenewalSuccess"
+        return None
+
+    # --------------------------------------------------------------------- B2
+
+    def _b2(self, api_name: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            self.counts["b2"] += 1
+            if api_name == "b2_list_file_names":
+                prefix = body.get("prefix", "")
+                names = sorted(n for n in self.b2_files if n.startswith(prefix))
+                return {"files": [self._b2_entry(n) for n in names[:body.get("maxFileCount", 100)]],
+                        "nextFileName": None}
+            if api_name == "b2_get_download_authorization":
+                return {"authorizationToken": "fake-download-token",
+                        "bucketId": body.get("bucketId"), "fileNamePrefix": body.get("fileNamePrefix")}
+        raise GraphError(400, "bad_request", f"Unsupported B2 call {api_name}")
+
+    def _b2_entry(self, name: str) -> Dict[str, Any]:
+        data = self.b2_files[name]
+        return {"fileId": hashlib.md5(name.encode()).hexdigest(), "fileName": name,
+                "contentLength": len(data), "contentSha1": hashlib.sha1(data).hexdigest()}
+
+    # ---------------------------------------------------------------- handler
+
+    def _make_handler(self):
+        server = self
+        blob_handler = super()._make_handler()
+
+        class _Handler(blob_handler):
+            def _reply_json(self, status: int, data: Optional[Dict[str, Any]]) -> None:
+                body = json.dumps(data).encode() if data is not None else b""
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if body:
+                    self.wfile.write(body)
+
+            def _read_json(self) -> Dict[str, Any]:
+                raw = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                return json.loads(raw) if raw else {}
+
+            def _api(self, method: str) -> None:
+                url = urlparse(self.path)
+                path = url.path
+                body = self._read_json() if method in ("POST", "PATCH") else dict(parse_qsl(url.query))
+                if server.latency:
+                    time.sleep(server.latency)
+                try:
+                    if path.startswith("/beta/"):
+                        if not self.headers.get("Authorization", "").startswith("Bearer "):
+                            raise GraphError(401, "InvalidAuthenticationToken", "Missing bearer token")
+                        result = server._graph(method, path, body)
+                        self._reply_json(_status(method, path, result), result)
+                    elif path == "/b2api/v2/b2_authorize_account" and method == "GET":
+                        with server._lock:
+                            server.counts["b2"] += 1
+                        self._reply_json(200, {"accountId": "fake-account",
+                                               "authorizationToken": "fake-account-token",
+                                               "apiUrl": server.url, "downloadUrl": server.url})
+                    elif path.startswith("/b2api/v2/") and method == "POST":
+                        self._reply_json(200, server._b2(path.rsplit("/", 1)[1], body))
+                    else:
+                        raise GraphError(404, "NotFound", f"No route for {method} {path}")
+                except GraphError as exc:
+                    self._reply_json(exc.status, {"error": {"code": exc.code, "message": str(exc)}})
+
+            def _download(self) -> None:
+                path = urlparse(self.path).path
+                name = unquote(path[len(f"/file/{server.bucket_name}/"):])
+                if server.latency:
+                    time.sleep(server.latency)
+                with server._lock:
+                    server.counts["b2"] += 1
+                    data = server.b2_files.get(name)
+                if data is None or not path.startswith(f"/file/{server.bucket_name}/"):
+                    self._reply(404, b"not_found")
+                    return
+                status, start, end = 200, 0, len(data) - 1
+                match = _RANGE.match(self.headers.get("Range", ""))
+                if match:
+                    status, start = 206, int(match.group(1))
+                    end = min(int(match.group(2)) if match.group(2) else end, len(data) - 1)
+                self.send_response(status)
+                self.send_header("Content-Length", str(end - start + 1))
+                if status == 206:
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+                self.end_headers()
+                for offset in range(start, end + 1, _CHUNK):
+                    chunk = data[offset:min(offset + _CHUNK, end + 1)]
+                    if server.bandwidth:
+                        time.sleep(len(chunk) / server.bandwidth)
+                    self.wfile.write(chunk)
+                    with server._lock:
+                        server.bytes_downloaded += len(chunk)
+
+            def do_GET(self):
+                path = urlparse(self.path).path
+                if path.startswith("/container/"):
+                    super().do_GET()
+                elif path.startswith("/file/"):
+                    self._download()
+                else:
+                    self._api("GET")
+
+            def do_POST(self):
+                self._api("POST")
+
+            def do_PATCH(self):
+                self._api("PATCH")
+
+            def do_DELETE(self):
+                self._api("DELETE")
+
+        return _Handler
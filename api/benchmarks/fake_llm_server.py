@@ -0,0 +1,166 @@
+"""
+Minimal in-process stand-in for an OpenAI-compatible chat-completions API.
+
+Only ``POST /v1/chat/completions`` is implemented.  Every request is answered
+with a canned ``{"script": ...}`` JSON message for the app named in the user
+prompt, after an optional latency, so detection-script throughput, caching
+and concurrency can be measured without network access or an API key.
+``rate_limit_every=N`` answers every Nth request with ``429`` and a
+``Retry-After`` header to exercise the retry path.
+
+Point the API at it with ``DETECTION_LLM_BASE_URL=<server.url>``, or run it
+standalone::
+
+    python -m api.benchmarks.fake_llm_server [--port 8001] [--latency-ms 500]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+_APP_NAME = re.compile(r'"([^"]+)"')
+
+CANNED_SCRIPT = (
+    "$entry = Get-ItemProperty 'HKLM:\\Software\\Microsoft\\Windows\\CurrentVersion\\Uninstall\\*' "
+    "-ErrorAction SilentlyContinue | Where-Object {{ $_.DisplayName -like '{app_name}*' }}\n"
+    "if ($entry) {{ Write-Output \"$($entry.DisplayName) detected\"; exit 0 }}\n"
+    "exit 1"
+)
+
+
+class FakeLLMServer:
+    """Threaded fake LLM endpoint. Use as a context manager or call start()/stop()."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 rate_limit_every: int = 0, retry_after: float = 0.0):
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.requests = 0
+        self.rate_limited = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.app_names: List[str] = []
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        """Base URL for the OpenAI client (``DETECTION_LLM_BASE_URL``)."""
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "FakeLLMServer":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "FakeLLMServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _make_handler(self):
+        server = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):  # keep benchmark output clean
+                pass
+
+            def _reply(self, status: int, payload: dict, headers: dict = None) -> None:
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.path.rstrip("/") != "/v1/chat/completions":
+                    self._reply(404, {"error": {"message": f"Unknown path {self.path}"}})
+                    return
+                request = json.loads(body or b"{}")
+                with server._lock:
+                    server.requests += 1
+                    limited = bool(server.rate_limit_every) and server.requests % server.rate_limit_every == 0
+                    if limited:
+                        server.rate_limited += 1
+                    else:
+                        server.in_flight += 1
+                        server.peak_in_flight = max(server.peak_in_flight, server.in_flight)
+                if limited:
+                    self._reply(429, {"error": {"message": "Rate limit reached", "type": "requests"}},
+                                {"Retry-After": str(server.retry_after)})
+                    return
+                try:
+                    if server.latency:
+                        time.sleep(server.latency)
+                    prompt = request.get("messages", [{}])[-1].get("content", "")
+                    match = _APP_NAME.search(prompt)
+                    app_name = match.group(1) if match else "App"
+                    with server._lock:
+                        server.app_names.append(app_name)
+                    script = CANNED_SCRIPT.format(app_name=app_name.replace("'", "''"))
+                    self._reply(200, _completion(request.get("model", "fake"), json.dumps({"script": script})))
+                finally:
+                    with server._lock:
+                        server.in_flight -= 1
+
+        return _Handler
+
+
+def _completion(model: str, content: str) -> dict:
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency-ms", type=float, default=500.0,
+                        help="simulated completion latency per request")
+    parser.add_argument("--rate-limit-every", type=int, default=0,
+                        help="answer every Nth request with 429 (0 = never)")
+    args = parser.parse_args()
+
+    server = FakeLLMServer(args.host, args.port, latency=args.latency_ms / 1000,
+                           rate_limit_every=args.rate_limit_every)
+    print(f"Serving fake chat completions on {server.url} (Ctrl+C to stop)")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,464 @@
+"""
+Local, per-tenant inventory of the Win32 apps in Intune.
+
+Nothing used to stop a deploy from creating a second app for a package that
+is already in the tenant, and checking would have meant listing every
+mobileApp first.  This module keeps a SQLite copy of each tenant's
+``win32LobApp`` list (ID, display name, notes, publishing state, last
+modified) with indexes on the display name, the notes and the package ID.
+The package ID is read from the tag the uploaders write into ``notes``
+(``Winget Package ID: …`` / ``App Library ID: …``); the tag is stored too,
+so a Winget package and an App Library item with the same ID are never
+mistaken for each other.
+
+A tenant is listed in full (paged) on first use and every
+APP_INVENTORY_FULL_SYNC_INTERVAL seconds, which also drops apps deleted in
+Intune.  In between, a lookup on an inventory older than
+APP_INVENTORY_SYNC_INTERVAL first fetches only the apps whose
+``lastModifiedDateTime`` is at or after the newest one already known.  Apps
+created or deleted by this service are recorded immediately, so a duplicate
+check is a local index lookup.
+
+Before an app shell is created the uploaders apply an *if_exists* policy
+(:func:`check_duplicate`): ``create`` (always create, the old behaviour),
+``skip`` (return the existing app without uploading), ``update`` (upload a
+new content version to the existing app) or ``fail``.  With the inventory
+disabled, the other policies look the package up in Graph instead.
+
+Every content version an uploader commits is recorded in the app's
+``notes`` (``Package Digest: …``, the SHA-256 from Detection.xml), so an
+``update`` of an app that already holds the same package uploads nothing.
+
+Configuration
+-------------
+APP_INVENTORY_PATH                  SQLite file (default ``~/.intune-deployment/app_inventory.sqlite``);
+                                    set to an empty string to disable the inventory (duplicate checks
+                                    then query Graph on every deploy).
+APP_INVENTORY_SYNC_INTERVAL         Seconds an inventory is trusted before an incremental sync (default 300).
+APP_INVENTORY_FULL_SYNC_INTERVAL    Seconds between full listings (default 1 day).
+DEPLOY_IF_EXISTS                    Default *if_exists* policy of deploys (default "create").
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from . import graph_client
+from .graph_client import GraphRequestError
+from .tenants import get_current_tenant
+
+logger = logging.getLogger(__name__)
+
+APP_INVENTORY_PATH = os.environ.get(
+    "APP_INVENTORY_PATH",
+    os.path.join(os.path.expanduser("~"), ".intune-deployment", "app_inventory.sqlite"),
+)
+APP_INVENTORY_SYNC_INTERVAL = float(os.environ.get("APP_INVENTORY_SYNC_INTERVAL", 5 * 60))
+APP_INVENTORY_FULL_SYNC_INTERVAL = float(os.environ.get("APP_INVENTORY_FULL_SYNC_INTERVAL", 24 * 60 * 60))
+
+IF_EXISTS_CREATE = "create"
+IF_EXISTS_SKIP = "skip"
+IF_EXISTS_UPDATE = "update"
+IF_EXISTS_FAIL = "fail"
+IF_EXISTS_POLICIES = (IF_EXISTS_CREATE, IF_EXISTS_SKIP, IF_EXISTS_UPDATE, IF_EXISTS_FAIL)
+DEPLOY_IF_EXISTS = os.environ.get("DEPLOY_IF_EXISTS", IF_EXISTS_CREATE).lower()
+
+# Tags the uploaders write into ``notes`` to remember which package an app came from
+WINGET_NOTES_TAG = "Winget Package ID"
+APP_LIBRARY_NOTES_TAG = "App Library ID"
+DIGEST_NOTES_TAG = "Package Digest"
+_PACKAGE_TAG = re.compile(rf"^({WINGET_NOTES_TAG}|{APP_LIBRARY_NOTES_TAG}):\s*(\S.*?)\s*$", re.MULTILINE)
+_DIGEST_TAG = re.compile(rf"^{DIGEST_NOTES_TAG}:\s*(\S+)\s*$", re.MULTILINE)
+
+# What an update needs to know about the existing app
+CONTENT_SELECT = "id,notes,committedContentVersion"
+
+_PAGE_SIZE = 100
+_SELECT = "id,displayName,notes,publishingState,lastModifiedDateTime"
+_WIN32_FILTER = "isof('microsoft.graph.win32LobApp')"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS inventory_apps (
+    tenant            TEXT NOT NULL,
+    app_id            TEXT NOT NULL,
+    display_name      TEXT,
+    display_name_key  TEXT,
+    notes             TEXT,
+    package_id        TEXT,
+    package_tag       TEXT,
+    publishing_state  TEXT,
+    last_modified     TEXT,
+    seen_at           REAL NOT NULL,
+    PRIMARY KEY (tenant, app_id)
+);
+CREATE TABLE IF NOT EXISTS inventory_sync (
+    tenant          TEXT PRIMARY KEY,
+    full_synced_at  REAL NOT NULL,
+    synced_at       REAL NOT NULL,
+    high_water      TEXT
+);
+"""
+
+_INDEXES = """
+CREATE INDEX IF NOT EXISTS inventory_apps_display_name ON inventory_apps (tenant, display_name_key);
+DROP INDEX IF EXISTS inventory_apps_package_id;
+CREATE INDEX IF NOT EXISTS inventory_apps_package ON inventory_apps (tenant, package_tag, package_id);
+CREATE INDEX IF NOT EXISTS inventory_apps_notes ON inventory_apps (tenant, notes);
+"""
+
+_COLUMNS = "app_id, display_name, notes, package_id, package_tag, publishing_state, last_modified"
+
+
+class DuplicateAppError(RuntimeError):
+    """An app for the package already exists and the deploy's *if_exists* policy is ``fail``."""
+
+    def __init__(self, package_id: str, app_ids: List[str]):
+        super().__init__(f"An app for package {package_id} already exists in Intune: {', '.join(app_ids)}")
+        self.package_id = package_id
+        self.app_ids = app_ids
+
+
+def package_notes(tag: str, package_id: str, file_digest: Optional[str] = None) -> str:
+    """The ``notes`` an uploader stores on an app for *package_id* (and its committed content)."""
+    notes = f"{tag}: {package_id}"
+    if file_digest:
+        notes += f"\n{DIGEST_NOTES_TAG}: {file_digest}"
+    return notes
+
+
+def package_id_from_notes(notes: Optional[str]) -> Optional[str]:
+    match = _PACKAGE_TAG.search(notes or "")
+    return match.group(2) if match else None
+
+
+def package_tag_from_notes(notes: Optional[str]) -> Optional[str]:
+    """The tag (WINGET_NOTES_TAG or APP_LIBRARY_NOTES_TAG) the package ID in *notes* was written under."""
+    match = _PACKAGE_TAG.search(notes or "")
+    return match.group(1) if match else None
+
+
+def digest_from_notes(notes: Optional[str]) -> Optional[str]:
+    match = _DIGEST_TAG.search(notes or "")
+    return match.group(1) if match else None
+
+
+def content_fields(tag: str, package_id: str, meta: Dict) -> Dict[str, str]:
+    """
+    Fields PATCHed together with ``committedContentVersion``: the setup file
+    of the new content (an update may bring a different one) and notes that
+    record its digest (*meta* is the metadata from ``read_intunewin``).
+    """
+    return {"fileName": meta["file_name"], "setupFilePath": meta["file_name"],
+            "notes": package_notes(tag, package_id, meta.get("file_digest"))}
+
+
+def content_is_current(app: Optional[Dict[str, Any]], file_digest: str) -> bool:
+    """Whether *app* (selected with CONTENT_SELECT) already has the package *file_digest* committed."""
+    app = app or {}
+    return bool(app.get("committedContentVersion")) and digest_from_notes(app.get("notes")) == file_digest
+
+
+def if_exists_policy(if_exists: Optional[str] = None) -> str:
+    """Normalise *if_exists* (default DEPLOY_IF_EXISTS); raises ValueError for an unknown policy."""
+    policy = (if_exists or DEPLOY_IF_EXISTS).lower()
+    if policy not in IF_EXISTS_POLICIES:
+        raise ValueError(f"if_exists must be one of {', '.join(IF_EXISTS_POLICIES)}, not {if_exists!r}")
+    return policy
+
+
+def _tenant_key(tenant: Optional[str]) -> str:
+    return tenant or ""
+
+
+def _row_to_dict(row) -> Dict[str, Any]:
+    return dict(zip(("id", "displayName", "notes", "package_id", "package_tag", "publishingState",
+                     "lastModifiedDateTime"), row))
+
+
+class AppInventory:
+    """SQLite-backed per-tenant mobileApp inventory (thread-safe)."""
+
+    def __init__(self, path: str, sync_interval: float = APP_INVENTORY_SYNC_INTERVAL,
+                 full_sync_interval: float = APP_INVENTORY_FULL_SYNC_INTERVAL,
+                 clock: Callable[[], float] = time.time):
+        self.path = path
+        self.sync_interval = sync_interval
+        self.full_sync_interval = full_sync_interval
+        self._clock = clock
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._migrate()
+        self._conn.executescript(_INDEXES)
+        self._lock = threading.Lock()
+        # One sync in flight per tenant; lookups of other tenants are not held up
+        self._sync_locks: Dict[str, threading.Lock] = {}
+
+    def _migrate(self) -> None:
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(inventory_apps)")}
+        if "package_tag" not in columns:
+            # Inventories written before the tag was stored: relist every tenant to fill it in
+            self._conn.execute("ALTER TABLE inventory_apps ADD COLUMN package_tag TEXT")
+            self._conn.execute("DELETE FROM inventory_sync")
+
+    # -------------------------------------------------------------- lookups
+
+    def find(self, tenant: Optional[str] = None, *, package_id: Optional[str] = None,
+             package_tag: Optional[str] = None, display_name: Optional[str] = None,
+             notes: Optional[str] = None, refresh: bool = True) -> List[Dict[str, Any]]:
+        """
+        Apps of *tenant* matching every given criterion (display names compare case-insensitively).
+
+        *package_tag* restricts *package_id* to one source pipeline
+        (WINGET_NOTES_TAG or APP_LIBRARY_NOTES_TAG).  The inventory is synced
+        first when it is stale, unless *refresh* is false.
+        """
+        if refresh:
+            self.ensure_fresh(tenant)
+        clauses, args = ["tenant = ?"], [_tenant_key(tenant)]
+        criteria = (("package_id", package_id), ("package_tag", package_tag), ("notes", notes),
+                    ("display_name_key", display_name.casefold() if display_name is not None else None))
+        for column, value in criteria:
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                args.append(value)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {_COLUMNS} FROM inventory_apps WHERE {' AND '.join(clauses)} ORDER BY app_id", args
+            ).fetchall()
+        return [_row_to_dict(row) for row in rows]
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Apps and sync times per tenant ("" is the default tenant)."""
+        with self._lock:
+            counts = dict(self._conn.execute(
+                "SELECT tenant, COUNT(*) FROM inventory_apps GROUP BY tenant").fetchall())
+            syncs = self._conn.execute(
+                "SELECT tenant, full_synced_at, synced_at, high_water FROM inventory_sync").fetchall()
+        return {tenant: {"apps": counts.get(tenant, 0), "full_synced_at": full, "synced_at": synced,
+                         "high_water": high_water}
+                for tenant, full, synced, high_water in syncs}
+
+    # -------------------------------------------------------------- updates
+
+    def record(self, tenant: Optional[str], app: Dict[str, Any]) -> None:
+        """Insert or update one app (a Graph ``mobileApp`` dict); used for apps this service creates."""
+        self._upsert(_tenant_key(tenant), [app], self._clock())
+
+    def remove(self, tenant: Optional[str], app_ids: Iterable[str]) -> None:
+        with self._lock:
+            self._conn.executemany("DELETE FROM inventory_apps WHERE tenant = ? AND app_id = ?",
+                                   [(_tenant_key(tenant), app_id) for app_id in app_ids])
+
+    def _upsert(self, tenant: str, apps: List[Dict[str, Any]], seen_at: float) -> None:
+        rows = []
+        for app in apps:
+            display_name = app.get("displayName")
+            notes = app.get("notes")
+            rows.append((tenant, app["id"], display_name, display_name.casefold() if display_name else None,
+                         notes, app.get("package_id") or package_id_from_notes(notes),
+                         app.get("package_tag") or package_tag_from_notes(notes),
+                         app.get("publishingState"), app.get("lastModifiedDateTime"), seen_at))
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO inventory_apps (tenant, app_id, display_name, display_name_key, notes, "
+                "package_id, package_tag, publishing_state, last_modified, seen_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    # ------------------------------------------------------------------ sync
+
+    def _sync_state(self, tenant: str):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT full_synced_at, synced_at, high_water FROM inventory_sync WHERE tenant = ?", (tenant,)
+            ).fetchone()
+
+    def ensure_fresh(self, tenant: Optional[str] = None) -> None:
+        """Sync *tenant* if its inventory is missing or older than the sync intervals."""
+        key = _tenant_key(tenant)
+        with self._lock:
+            lock = self._sync_locks.setdefault(key, threading.Lock())
+        with lock:
+            # Whoever held the lock before us has probably synced already
+            state = self._sync_state(key)
+            now = self._clock()
+            if state is None or now - state[0] >= self.full_sync_interval:
+                self._sync(key, full=True)
+            elif now - state[1] >= self.sync_interval:
+                self._sync(key, full=False)
+
+    def sync(self, tenant: Optional[str] = None, full: bool = False) -> Dict[str, Any]:
+        """Sync *tenant* now; an incremental sync falls back to a full one when there is no state."""
+        key = _tenant_key(tenant)
+        with self._lock:
+            lock = self._sync_locks.setdefault(key, threading.Lock())
+        with lock:
+            return self._sync(key, full=full or self._sync_state(key) is None)
+
+    def _sync(self, tenant: str, full: bool) -> Dict[str, Any]:
+        started = self._clock()
+        state = self._sync_state(tenant)
+        high_water = None if full else state[2]
+        try:
+            apps = self._list(high_water)
+        except GraphRequestError as exc:
+            if full or exc.status_code != 400:
+                raise
+            # The filter on lastModifiedDateTime was rejected; list everything instead
+            logger.warning("Incremental inventory sync rejected (%s); doing a full sync", exc.status_code)
+            full, apps = True, self._list(None)
+
+        self._upsert(tenant, apps, started)
+        newest = max([a["lastModifiedDateTime"] for a in apps if a.get("lastModifiedDateTime")]
+                     + ([state[2]] if state and state[2] else []), default=None)
+        with self._lock:
+            removed = 0
+            if full:
+                # Rows not seen by this listing (and not recorded meanwhile) were deleted in Intune
+                removed = self._conn.execute("DELETE FROM inventory_apps WHERE tenant = ? AND seen_at < ?",
+                                             (tenant, started)).rowcount
+            full_synced_at = started if full or state is None else state[0]
+            self._conn.execute(
+                "INSERT OR REPLACE INTO inventory_sync (tenant, full_synced_at, synced_at, high_water) "
+                "VALUES (?, ?, ?, ?)", (tenant, full_synced_at, started, newest))
+        logger.info("%s inventory sync of tenant %s: %s apps fetched, %s removed",
+                    "Full" if full else "Incremental", tenant or "(default)", len(apps), removed)
+        return {"tenant": tenant, "full": full, "fetched": len(apps), "removed": removed}
+
+    def _list(self, modified_since: Optional[str]) -> List[Dict[str, Any]]:
+        """Page through the tenant's win32LobApps (modified at or after *modified_since*, if given)."""
+        return _list_win32_apps(f"lastModifiedDateTime ge {modified_since}" if modified_since else None)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def _list_win32_apps(condition: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Page through the current tenant's win32LobApps, optionally narrowed by an OData *condition*."""
+    query = _WIN32_FILTER + (f" and {condition}" if condition else "")
+    url: Optional[str] = f"{graph_client.GRAPH_BASE}/deviceAppManagement/mobileApps"
+    params: Optional[Dict[str, Any]] = {"$filter": query, "$select": _SELECT, "$top": _PAGE_SIZE}
+    apps: List[Dict[str, Any]] = []
+    while url:
+        page = graph_client.graph_request("GET", url, params=params) or {}
+        apps.extend(page.get("value", []))
+        # The next link already carries the query
+        url, params = page.get("@odata.nextLink"), None
+    return apps
+
+
+def _find_in_graph(package_id: str, notes_tag: str) -> List[Dict[str, Any]]:
+    """The current tenant's apps for *package_id*, looked up in Graph (no inventory)."""
+    prefix = package_notes(notes_tag, package_id).replace("'", "''")
+    try:
+        apps = _list_win32_apps(f"startswith(notes, '{prefix}')")
+    except GraphRequestError as exc:
+        if exc.status_code != 400:
+            raise
+        # The notes filter was rejected; list everything and match locally
+        logger.warning("Graph rejected the notes filter (%s); listing every app", exc.status_code)
+        apps = _list_win32_apps()
+    # startswith also matches longer IDs; compare the parsed tag exactly
+    return [app for app in apps
+            if package_id_from_notes(app.get("notes")) == package_id
+            and package_tag_from_notes(app.get("notes")) == notes_tag]
+
+
+def _most_recent_first(apps: List[Dict[str, Any]]) -> List[str]:
+    """IDs of *apps*, the most recently modified first (ties and unknown times by ID)."""
+    apps = sorted(apps, key=lambda app: app["id"])
+    return [app["id"] for app in sorted(apps, key=lambda app: app.get("lastModifiedDateTime") or "",
+                                        reverse=True)]
+
+
+_inventory: Optional[AppInventory] = None
+_inventory_lock = threading.Lock()
+
+
+def get_app_inventory() -> Optional[AppInventory]:
+    """Return the process-wide inventory, or None when APP_INVENTORY_PATH is empty."""
+    global _inventory
+    if APP_INVENTORY_PATH and _inventory is None:
+        with _inventory_lock:
+            if _inventory is None:
+                _inventory = AppInventory(APP_INVENTORY_PATH)
+    return _inventory
+
+
+def check_duplicate(package_id: str, if_exists: Optional[str] = None,
+                    notes_tag: str = WINGET_NOTES_TAG) -> Optional[str]:
+    """
+    Apply the *if_exists* policy (default DEPLOY_IF_EXISTS) before an app shell is created.
+
+    Only apps deployed from the same pipeline (*notes_tag*) count as existing.
+
+    Returns the ID of the existing app a ``skip`` deploy should return
+    instead of uploading or an ``update`` deploy should upload to, or None
+    when a new app should be created.  When the tenant has several apps for
+    the package, the most recently modified one is used.
+
+    Raises
+    ------
+    DuplicateAppError
+        If the policy is ``fail`` and the tenant already has an app for *package_id*.
+    ValueError
+        For an unknown policy.
+
+    Without an inventory (APP_INVENTORY_PATH is empty) the tenant's apps are
+    queried in Graph, so the policy is still honoured.
+    """
+    policy = if_exists_policy(if_exists)
+    if policy == IF_EXISTS_CREATE:
+        return None
+    inventory = get_app_inventory()
+    if inventory is None:
+        apps = _find_in_graph(package_id, notes_tag)
+    else:
+        apps = inventory.find(get_current_tenant(), package_id=package_id, package_tag=notes_tag)
+    existing = _most_recent_first(apps)
+    if not existing:
+        return None
+    if policy == IF_EXISTS_FAIL:
+        raise DuplicateAppError(package_id, existing)
+    if len(existing) > 1:
+        logger.warning("Package %s has %s apps in the tenant (%s); using the most recently modified, %s",
+                       package_id, len(existing), ", ".join(existing), existing[0])
+    if policy == IF_EXISTS_SKIP:
+        logger.info("Package %s already deployed as app %s; skipping the upload", package_id, existing[0])
+    return existing[0]
+
+
+def _opened_inventory() -> Optional[AppInventory]:
+    # Without an inventory file no tenant has been listed yet; its first lookup lists everything
+    if not APP_INVENTORY_PATH or (_inventory is None and not os.path.exists(APP_INVENTORY_PATH)):
+        return None
+    return get_app_inventory()
+
+
+def record_created_app(app_id: str, display_name: str, package_id: str,
+                       notes_tag: str = WINGET_NOTES_TAG) -> None:
+    """Add an app this service just created to the current tenant's inventory."""
+    inventory = _opened_inventory()
+    if inventory is not None:
+        # Stamped now so a duplicate check prefers it until the next sync brings Intune's time
+        inventory.record(get_current_tenant(), {"id": app_id, "displayName": display_name,
+                                                "package_id": package_id, "package_tag": notes_tag,
+                                                "publishingState": "notPublished",
+                                                "lastModifiedDateTime": time.strftime("%Y-%m-%dT%H:%M:%SZ",
+                                                                                      time.gmtime())})
+
+
+def forget_deleted_apps(app_ids: Iterable[str]) -> None:
+    """Drop apps this service just deleted from the current tenant's inventory."""
+    inventory = _opened_inventory()
+    if inventory is not None:
+        inventory.remove(get_current_tenant(), app_ids)
@@ -0,0 +1,345 @@
+"""
+Asyncio Intune upload engine.
+
+The threaded uploaders (``intune_win32_uploader``, ``app_library_intune_uploader``)
+hold a worker thread for the whole deploy, most of it asleep in the
+storage-URI, commit and publish pollers.  This module runs the same Graph and
+Azure Blob sequence on the event loop over one shared ``aiohttp`` session, so
+deploys waiting on Intune are idle coroutines and a single API process can
+keep dozens of them in flight.
+
+The public entry points are ``upload_intunewin_async`` and
+``upload_app_library_intunewin_async`` in the uploader modules; they build the
+app body and call :func:`upload_package_async`, which drives the stages of
+``deploy_pipeline`` with coroutine steps.  Stage reports, deploy timings and
+checkpoints (``upload_checkpoints``) are therefore the same as in the threaded
+pipelines, so an upload interrupted in one engine is resumed by the other.  Poll GETs of
+concurrent deploys are merged into ``$batch`` calls (see ``graph_batch``).
+
+Configuration
+-------------
+ASYNC_HTTP_POOL_SIZE    Connections in the shared aiohttp pool (default 100).
+ASYNC_CHECKPOINT_BATCH  Stored blocks written to the checkpoint store per
+                        batch (default 16).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import time
+import weakref
+from typing import Any, Callable, Dict, Generator, List, Optional, Tuple
+
+import aiohttp
+
+from .app_inventory import CONTENT_SELECT, WINGET_NOTES_TAG, check_duplicate, record_created_app
+from .auth import get_auth_headers
+from .blob_uploader import DEFAULT_BLOCK_SIZE, get_uncommitted_blocks_async, upload_blocks_async
+from .deploy_pipeline import (
+    WAIT_COMMIT,
+    WAIT_PUBLISHED,
+    WAIT_STORAGE_URI,
+    WAIT_STORAGE_URI_RENEWAL,
+    Step,
+    Wait,
+    app_url,
+    commit_file_body,
+    content_version_body,
+    content_versions_url,
+    deploy_stages,
+    file_placeholder_body,
+    file_url,
+)
+from . import graph_batch
+from .graph_batch import AsyncGraphBatcher
+from .graph_client import (
+    GRAPH_CONNECT_TIMEOUT,
+    GRAPH_READ_TIMEOUT,
+    GraphRequestError,
+    _parse_retry_after,
+    get_graph_client,
+)
+from .metrics import DeployTimer
+from .polling import Poller
+from .upload_checkpoints import UploadCheckpoint, UploadCheckpointStore, get_checkpoint_store
+
+logger = logging.getLogger(__name__)
+
+ASYNC_HTTP_POOL_SIZE = int(os.environ.get("ASYNC_HTTP_POOL_SIZE", 100))
+ASYNC_CHECKPOINT_BATCH = int(os.environ.get("ASYNC_CHECKPOINT_BATCH", 16))
+
+# Shared, pooled session (see open_session / close_session); bound to the loop that opened it
+_session: Optional[aiohttp.ClientSession] = None
+_session_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+async def open_session() -> aiohttp.ClientSession:
+    """Open the shared session. Called from the FastAPI lifespan on startup."""
+    global _session, _session_loop
+    loop = asyncio.get_running_loop()
+    if _session is None or _session.closed or _session_loop is not loop:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=ASYNC_HTTP_POOL_SIZE, keepalive_timeout=60),
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=GRAPH_CONNECT_TIMEOUT,
+                                          sock_read=GRAPH_READ_TIMEOUT),
+        )
+        _session_loop = loop
+    return _session
+
+
+async def close_session() -> None:
+    """Close the shared session. Called from the FastAPI lifespan on shutdown."""
+    global _session, _session_loop
+    if _session is not None and not _session.closed and _session_loop is asyncio.get_running_loop():
+        await _session.close()
+    _session = _session_loop = None
+
+
+# --------------------------------------------------------------------------------------
+# Graph
+# --------------------------------------------------------------------------------------
+async def graph_request_async(
+    method: str,
+    url: str,
+    *,
+    json: Any = None,
+    params: Optional[Dict[str, Any]] = None,
+    headers: Optional[Dict[str, str]] = None,
+) -> Any:
+    """Asyncio variant of ``graph_client.graph_request``; returns the decoded JSON body (or None)."""
+    # Tokens are cached by MSAL; a refresh is a blocking call, so keep it off the loop
+    req_headers = await asyncio.to_thread(get_auth_headers)
+    req_headers.update(headers or {})
+    session = await open_session()
+    logger.debug("GRAPH %s %s", method, url)
+
+    start = time.perf_counter()
+    status = None
+    try:
+        async with session.request(method, url, headers=req_headers, json=json, params=params) as resp:
+            status = resp.status
+            text = await resp.text()
+            retry_after = resp.headers.get("Retry-After")
+    finally:
+        get_graph_client().metrics.record(method, url, status, time.perf_counter() - start)
+
+    logger.debug("Response status: %s", status)
+    if status >= 400:
+        raise GraphRequestError(
+            f"{status} Error for url: {url}\n{text}",
+            status_code=status,
+            retry_after=_parse_retry_after(retry_after),
+            response_text=text,
+        )
+    return _loads(text) if text else None
+
+
+def _loads(text: str) -> Any:
+    return json.loads(text)
+
+
+# One poll batcher per event loop (asyncio futures cannot be shared between loops)
+_poll_batchers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncGraphBatcher]" = \
+    weakref.WeakKeyDictionary()
+
+
+async def _poll_get(url: str) -> Any:
+    """GET *url* for a poller, merged with the other deploys' polls into one ``$batch`` per tick."""
+    if not graph_batch.GRAPH_BATCH_POLLS:
+        return await graph_request_async("GET", url)
+    loop = asyncio.get_running_loop()
+    batcher = _poll_batchers.get(loop)
+    if batcher is None:
+        # Resolved per call so graph_request_async can be swapped for an emulator
+        batcher = _poll_batchers[loop] = AsyncGraphBatcher(
+            lambda *args, **kwargs: graph_request_async(*args, **kwargs))
+    return await batcher.request("GET", url)
+
+
+class AsyncDeploySteps:
+    """The steps of ``deploy_pipeline.deploy_stages`` as coroutines on the shared session."""
+
+    def __init__(self, session: aiohttp.ClientSession, store: Optional[UploadCheckpointStore] = None,
+                 block_size: Optional[int] = None, max_workers: Optional[int] = None):
+        self.session = session
+        self.store = store
+        self.block_size = block_size or DEFAULT_BLOCK_SIZE
+        self.max_workers = max_workers
+
+    # checkpoints and inventory (SQLite: kept off the event loop)
+    async def load_checkpoint(self, key: str) -> Optional[UploadCheckpoint]:
+        return await asyncio.to_thread(self.store.get, key)
+
+    async def save_checkpoint(self, checkpoint: UploadCheckpoint) -> None:
+        await asyncio.to_thread(self.store.save, checkpoint)
+
+    async def delete_checkpoint(self, key: str) -> None:
+        await asyncio.to_thread(self.store.delete, key)
+
+    async def staged_blocks(self, checkpoint: UploadCheckpoint) -> Dict[str, int]:
+        try:
+            return await get_uncommitted_blocks_async(self.session, checkpoint.sas_uri)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+            logger.warning("Could not list the staged blocks (%s); using the %s checkpointed blocks",
+                           exc, len(checkpoint.blocks))
+            return dict(checkpoint.blocks)
+
+    async def check_duplicate(self, package_id: str, if_exists: Optional[str], notes_tag: str) -> Optional[str]:
+        return await asyncio.to_thread(check_duplicate, package_id, if_exists, notes_tag)
+
+    async def record_created_app(self, app_id: str, display_name: str, package_id: str, notes_tag: str) -> None:
+        await asyncio.to_thread(record_created_app, app_id, display_name, package_id, notes_tag)
+
+    # Graph
+    async def get_app_content(self, app_id: str) -> Dict:
+        return await graph_request_async("GET", app_url(app_id), params={"$select": CONTENT_SELECT})
+
+    async def create_app(self, body: Dict) -> str:
+        return (await graph_request_async("POST", app_url(), json=body))["id"]
+
+    async def create_content_version(self, app_id: str) -> str:
+        return (await graph_request_async("POST", content_versions_url(app_id), json={}))["id"]
+
+    async def create_file_placeholder(self, app_id: str, version_id: str, meta: Dict, payload: Any) -> Dict:
+        return await graph_request_async("POST", file_url(app_id, version_id),
+                                         json=file_placeholder_body(meta, payload))
+
+    async def get_file(self, app_id: str, version_id: str, file_id: str) -> Dict:
+        return await graph_request_async("GET", file_url(app_id, version_id, file_id))
+
+    async def wait_for_storage_uri(self, app_id: str, version_id: str, file_id: str) -> Dict:
+        return await self._wait(WAIT_STORAGE_URI, file_url(app_id, version_id, file_id))
+
+    async def renew_storage_uri(self, app_id: str, version_id: str, file_id: str) -> Dict:
+        url = file_url(app_id, version_id, file_id)
+        logger.info("Renewing the Azure Storage URI of file %s...", file_id)
+        await graph_request_async("POST", f"{url}/renewUpload", json={})
+        return await self._wait(WAIT_STORAGE_URI_RENEWAL, url)
+
+    async def commit_file(self, app_id: str, version_id: str, file_id: str, meta: Dict) -> None:
+        logger.info("Committing file to Intune...")
+        await graph_request_async("POST", f"{file_url(app_id, version_id, file_id)}/commit",
+                                  json=commit_file_body(meta))
+
+    async def wait_for_commit(self, app_id: str, version_id: str, file_id: str) -> None:
+        logger.info("Waiting for Intune to finish processing the file commit...")
+        await self._wait(WAIT_COMMIT, file_url(app_id, version_id, file_id))
+        logger.info("File commit completed!")
+
+    async def commit_content_version(self, app_id: str, version_id: str, content: Optional[Dict] = None) -> None:
+        logger.info("Committing content version %s to the mobileApp…", version_id)
+        await graph_request_async("PATCH", app_url(app_id), json=content_version_body(version_id, content))
+
+    async def wait_for_published(self, app_id: str) -> None:
+        logger.info("Waiting for Intune to publish the app …")
+        await self._wait(WAIT_PUBLISHED, app_url(app_id))
+        logger.info("App is now published and ready!")
+
+    async def _wait(self, wait: Wait, url: str) -> Dict:
+        return await Poller(**wait.schedule).poll_async(
+            lambda: _poll_get(url), wait.done,
+            stage=wait.stage, timeout_message=wait.timeout_message,
+        )
+
+    # Azure Blob
+    async def upload_blob(self, payload: Any, sas_uri: str, staged: Dict[str, int], key: Optional[str]) -> None:
+        logger.info("Uploading encrypted payload to Azure Blob (%s bytes)...", payload.size)
+        recorder = _BlockRecorder(self.store, key) if key is not None else None
+        try:
+            await upload_blocks_async(
+                payload.iter_blocks(self.block_size), sas_uri,
+                session=self.session, max_workers=self.max_workers, staged=staged, on_block=recorder,
+            )
+        finally:
+            if recorder is not None:
+                await recorder.close()
+
+
+class _BlockRecorder:
+    """
+    ``on_block`` callback of an async upload: buffers the stored blocks and
+    writes them to the checkpoint store ASYNC_CHECKPOINT_BATCH at a time, in a
+    worker thread.  Blocks still buffered when a deploy dies are not lost for
+    the resume, which reads the blob's own uncommitted block list first.
+    """
+
+    def __init__(self, store: UploadCheckpointStore, key: str):
+        self.store = store
+        self.key = key
+        self._pending: List[Tuple[str, int]] = []
+        self._flushing: Optional[asyncio.Future] = None
+
+    def __call__(self, block_id: str, size: int) -> None:
+        self._pending.append((block_id, size))
+        if len(self._pending) >= ASYNC_CHECKPOINT_BATCH and (self._flushing is None or self._flushing.done()):
+            self._flushing = asyncio.ensure_future(self._flush())
+
+    async def _flush(self) -> None:
+        # Blocks stored while a batch is being written go out with the next one
+        while self._pending:
+            batch, self._pending = self._pending, []
+            await asyncio.to_thread(self.store.add_blocks, self.key, batch)
+
+    async def close(self) -> None:
+        """Write whatever is still buffered (also after a failed upload)."""
+        if self._flushing is not None:
+            await self._flushing
+        await self._flush()
+
+
+async def _run_stages_async(stages: Generator[Step, Any, str], steps: AsyncDeploySteps) -> str:
+    """Asyncio variant of ``deploy_pipeline.run_stages``: awaits each step on the event loop."""
+    send, value = stages.send, None
+    while True:
+        try:
+            name, *args = send(value)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            send, value = stages.send, await getattr(steps, name)(*args)
+        except BaseException as exc:
+            send, value = stages.throw, exc
+
+
+# --------------------------------------------------------------------------------------
+# Pipeline
+# --------------------------------------------------------------------------------------
+async def upload_package_async(
+    meta: Dict,
+    payload: Any,
+    *,
+    app_body: Dict[str, Any],
+    checkpoint_pipeline: str,
+    package_id: str,
+    display_name: str,
+    report: Callable[[str], None],
+    timer: DeployTimer,
+    block_size: Optional[int] = None,
+    max_workers: Optional[int] = None,
+    if_exists: Optional[str] = None,
+    notes_tag: str = WINGET_NOTES_TAG,
+) -> str:
+    """
+    Run the Intune upload sequence (``deploy_pipeline.deploy_stages``) for an
+    already parsed package on the event loop.
+
+    Parameters are those of ``deploy_pipeline.run_deploy``, plus the
+    *block_size* and *max_workers* of the blob upload.
+
+    Returns
+    -------
+    str
+        The mobileApp ID (the existing one when a duplicate is skipped or updated).
+    """
+    store = get_checkpoint_store()
+    stages = deploy_stages(
+        meta, payload, app_body=app_body,
+        checkpoint_pipeline=checkpoint_pipeline if store is not None else None,
+        package_id=package_id, display_name=display_name, report=report, timer=timer,
+        if_exists=if_exists, notes_tag=notes_tag,
+    )
+    steps = AsyncDeploySteps(await open_session(), store, block_size=block_size, max_workers=max_workers)
+    return await _run_stages_async(stages, steps)
@@ -58,6 +58,21 @@ def my_graph_api_endpoint():
     return response.json()
 ```
 
+Token Refresh:
+-------------
+Tokens are cached per tenant profile and scope set (see ``tenants.py`` for
+multi-tenant setups) and refreshed single-flight: when a token is
+missing or expired, one caller acquires a new one while concurrent callers
+wait for it instead of all hitting login.microsoftonline.com.  Once a token
+is within GRAPH_TOKEN_REFRESH_MARGIN seconds (default 300) of expiry, callers
+keep getting the cached token while a background thread refreshes it.  One
+MSAL ConfidentialClientApplication per tenant is reused so its own token
+cache works.
+
+Set GRAPH_STATIC_TOKEN to send a fixed bearer token instead (no MSAL, every
+tenant).  It is meant for local Graph emulators such as
+``benchmarks/fake_intune_server.py`` together with GRAPH_BASE.
+
 Security Considerations:
 ----------------------
 - NEVER commit client secrets to source control
@@ -70,10 +85,13 @@ Security Considerations:
 import os
 import time
 import logging
-from typing import Dict, Optional
+import threading
+from typing import Dict, Optional, Tuple
 import msal
 from dotenv import load_dotenv
 
+from .tenants import DEFAULT_TENANT, get_current_tenant, get_tenant_profile
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -81,83 +99,86 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Cache to store the token in memory
-_token_cache = {
-    "access_token": None,
-    "expires_at": 0
-}
+# Refresh this many seconds before expiry, in the background
+GRAPH_TOKEN_REFRESH_MARGIN = int(os.environ.get("GRAPH_TOKEN_REFRESH_MARGIN", 300))
+# A cached token is never handed out with less than this left
+_EXPIRY_BUFFER = 60
+# Fixed token for local emulators; bypasses MSAL entirely
+GRAPH_STATIC_TOKEN = os.environ.get("GRAPH_STATIC_TOKEN")
+
+# Cache to store tokens in memory, keyed by (tenant profile, scope set)
+_token_cache: Dict[Tuple[str, Tuple[str, ...]], Dict] = {}
+
+# Single-flight refresh: only the holder of a tenant's lock talks to its token endpoint
+_locks_guard = threading.Lock()
+_refresh_locks: Dict[str, threading.Lock] = {}
+_background_refreshes = set()
 
-def get_auth_config() -> Dict[str, str]:
+# Reused MSAL apps, keyed by the credentials they were built from
+_msal_apps: Dict[Tuple[str, str, str], "msal.ConfidentialClientApplication"] = {}
+
+def get_auth_config(tenant: Optional[str] = None) -> Dict[str, str]:
     """
-    Get authentication configuration from environment variables or configuration file.
-    
+    Get authentication configuration for a tenant profile.
+
+    Args:
+        tenant: Profile name (see ``tenants.py``). Defaults to the tenant selected
+            with ``use_tenant``, or the GRAPH_* environment variables.
+
     Returns:
         Dict containing client_id, client_secret, tenant_id, and authority
     """
-    # Get credentials from environment variables
-    config = {
-        "client_id": os.environ.get("GRAPH_CLIENT_ID"),
-        "client_secret": os.environ.get("GRAPH_CLIENT_SECRET"),
-        "tenant_id": os.environ.get("GRAPH_TENANT_ID"),
-    }
-    
+    config = get_tenant_profile(tenant if tenant is not None else get_current_tenant())
+
     # Construct the authority URL (https://login.microsoftonline.com/{tenant_id})
     config["authority"] = f"https://login.microsoftonline.com/{config['tenant_id']}"
-    
+
     # Check if required config is available
     required_keys = ["client_id", "client_secret", "tenant_id"]
     missing_keys = [key for key in required_keys if not config.get(key)]
-    
+
     if missing_keys:
         logger.error(f"Missing required configuration: {', '.join(missing_keys)}")
-    
+
     return config
 
-def get_access_token(scopes: Optional[list] = None) -> Optional[str]:
-    """
-    Get an access token for Microsoft Graph API.
-    
-    Args:
-        scopes: List of permission scopes to request. Defaults to ["https://graph.microsoft.com/.default"]
-    
-    Returns:
-        Access token string or None if authentication fails
-    """
-    global _token_cache
-    
-    # Default scopes for client credentials flow
-    if scopes is None:
-        scopes = ["https://graph.microsoft.com/.default"]
-    
-    # Check if we have a valid token in the cache
-    current_time = time.time()
-    if (_token_cache["access_token"] and 
-            _token_cache["expires_at"] > current_time + 60):  # 60 second buffer
-        logger.debug("Using cached access token")
-        return _token_cache["access_token"]
-    
+def _get_msal_app(config: Dict[str, str]) -> "msal.ConfidentialClientApplication":
+    """Return the shared MSAL app for these credentials, creating it on first use."""
+    key = (config["client_id"], config["client_secret"], config["authority"])
+    with _locks_guard:
+        app = _msal_apps.get(key)
+        if app is None:
+            app = _msal_apps[key] = msal.ConfidentialClientApplication(
+                client_id=config["client_id"],
+                client_credential=config["client_secret"],
+                authority=config["authority"]
+            )
+    return app
+
+def _refresh_lock(tenant: str) -> threading.Lock:
+    with _locks_guard:
+        return _refresh_locks.setdefault(tenant, threading.Lock())
+
+def _acquire_token(tenant: str, scopes: list) -> Optional[str]:
+    """Fetch a token from Entra ID and cache it. Caller must hold the tenant's refresh lock."""
     # Get the configuration
-    config = get_auth_config()
+    config = get_auth_config(tenant)
     if not all([config.get("client_id"), config.get("client_secret"), config.get("authority")]):
         logger.error("Incomplete authentication configuration")
         return None
-    
+
     try:
-        # Create an MSAL app instance
-        app = msal.ConfidentialClientApplication(
-            client_id=config["client_id"],
-            client_credential=config["client_secret"],
-            authority=config["authority"]
-        )
-        
         # Acquire token using client credentials flow (app-only)
-        result = app.acquire_token_for_client(scopes=scopes)
-        
+        current_time = time.time()
+        result = _get_msal_app(config).acquire_token_for_client(scopes=scopes)
+
         if "access_token" in result:
             # Cache the token with expiration time
-            _token_cache["access_token"] = result["access_token"]
-            _token_cache["expires_at"] = current_time + result.get("expires_in", 3599)  # Default to 1 hour - 1 second
-            logger.info("Successfully acquired new access token")
+            _token_cache[(tenant, tuple(scopes))] = {
+                "access_token": result["access_token"],
+                "expires_at": current_time + result.get("expires_in", 3599)  # Default to 1 hour - 1 second
+            }
+            logger.info(f"Successfully acquired new access token for tenant '{tenant}'")
             return result["access_token"]
         else:
             # Log error details
@@ -166,23 +187,83 @@ def get_access_token(scopes: Optional[list] = None) -> Optional[str]:
             correlation_id = result.get("correlation_id")
             logger.error(f"Failed to acquire token. Error: {error}, Description: {error_description}, Correlation ID: {correlation_id}")
             return None
-            
+
     except Exception as ex:
         logger.error(f"Exception during token acquisition: {str(ex)}")
         return None
 
-def get_auth_headers() -> Dict[str, str]:
+def _refresh_in_background(tenant: str, scopes: list) -> None:
+    """Start one background refresh for *tenant* / *scopes* unless one is already running."""
+    key = (tenant, tuple(scopes))
+    with _locks_guard:
+        if key in _background_refreshes:
+            return
+        _background_refreshes.add(key)
+
+    def _run():
+        try:
+            with _refresh_lock(tenant):
+                cached = _token_cache.get(key)
+                # Another caller may have refreshed it while we were starting
+                if not cached or cached["expires_at"] <= time.time() + GRAPH_TOKEN_REFRESH_MARGIN:
+                    _acquire_token(tenant, scopes)
+        finally:
+            with _locks_guard:
+                _background_refreshes.discard(key)
+
+    threading.Thread(target=_run, name="graph-token-refresh", daemon=True).start()
+
+def get_access_token(scopes: Optional[list] = None, tenant: Optional[str] = None) -> Optional[str]:
+    """
+    Get an access token for Microsoft Graph API.
+
+    Args:
+        scopes: List of permission scopes to request. Defaults to ["https://graph.microsoft.com/.default"]
+        tenant: Tenant profile name. Defaults to the tenant selected with ``use_tenant``.
+
+    Returns:
+        Access token string or None if authentication fails
+    """
+    if GRAPH_STATIC_TOKEN:
+        return GRAPH_STATIC_TOKEN
+
+    # Default scopes for client credentials flow
+    if scopes is None:
+        scopes = ["https://graph.microsoft.com/.default"]
+    tenant = tenant or get_current_tenant() or DEFAULT_TENANT
+    key = (tenant, tuple(scopes))
+
+    # Check if we have a valid token in the cache
+    cached = _token_cache.get(key)
+    if cached and cached["expires_at"] > time.time() + _EXPIRY_BUFFER:
+        if cached["expires_at"] <= time.time() + GRAPH_TOKEN_REFRESH_MARGIN:
+            # Still usable, but close to expiry: refresh without making anyone wait
+            _refresh_in_background(tenant, scopes)
+        logger.debug("Using cached access token")
+        return cached["access_token"]
+
+    with _refresh_lock(tenant):
+        # Whoever held the lock before us has probably refreshed it already
+        cached = _token_cache.get(key)
+        if cached and cached["expires_at"] > time.time() + _EXPIRY_BUFFER:
+            return cached["access_token"]
+        return _acquire_token(tenant, scopes)
+
+def get_auth_headers(tenant: Optional[str] = None) -> Dict[str, str]:
     """
     Get the authorization headers needed for Microsoft Graph API calls.
-    
+
+    Args:
+        tenant: Tenant profile name. Defaults to the tenant selected with ``use_tenant``.
+
     Returns:
         Dictionary containing Authorization header with Bearer token
     """
-    token = get_access_token()
+    token = get_access_token(tenant=tenant)
     if not token:
         logger.error("No access token available for headers")
         return {}
-    
+
     return {
         "Authorization": f"Bearer {token}",
         "Content-Type": "application/json"
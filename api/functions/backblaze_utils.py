@@ -1,13 +1,29 @@
 """
 BackBlaze utilities for the Intune Deployment API
+
+All B2 calls share one pooled ``aiohttp.ClientSession`` that is opened and
+closed with the FastAPI lifespan (see ``open_session`` / ``close_session``).
+Resolving a download URL is usually free: download authorizations are cached
+per prefix until shortly before they expire and file listings are memoized,
+so a hot path needs zero or one network calls.
+
+The account token is refreshed single-flight: concurrent callers that find it
+expired wait for one ``b2_authorize_account`` call, and once it is within
+BACKBLAZE_TOKEN_REFRESH_MARGIN seconds of expiry it is refreshed in the
+background while callers keep using the cached one.
 """
 
+import asyncio
 import os
+import weakref
 import logging
 import aiohttp
-from typing import Optional
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Tuple
 import time
 
+from .metrics import B2_REQUEST_SECONDS, B2_REQUESTS, status_label
+
 logger = logging.getLogger(__name__)
 
 # Get BackBlaze configuration from environment variables
@@ -16,6 +32,16 @@ BACKBLAZE_BUCKET_NAME = os.environ.get("BACKBLAZE_BUCKET_NAME")
 BACKBLAZE_APPLICATION_KEY_ID = os.environ.get("BACKBLAZE_APPLICATION_KEY_ID")
 BACKBLAZE_APPLICATION_KEY = os.environ.get("BACKBLAZE_APPLICATION_KEY")
 BACKBLAZE_ENDPOINT = os.environ.get("BACKBLAZE_ENDPOINT", "https://api.backblazeb2.com")
+BACKBLAZE_POOL_SIZE = int(os.environ.get("BACKBLAZE_POOL_SIZE", 20))
+# How long a file listing (fileId, size, SHA1) is trusted before B2 is asked again
+BACKBLAZE_LISTING_TTL = int(os.environ.get("BACKBLAZE_LISTING_TTL", 300))
+
+# Refresh the account token in the background this long before it expires
+BACKBLAZE_TOKEN_REFRESH_MARGIN = int(os.environ.get("BACKBLAZE_TOKEN_REFRESH_MARGIN", 30 * 60))
+
+# Download authorizations are requested for 24 hours and reused until 1 hour before expiry
+DOWNLOAD_AUTH_DURATION = 24 * 60 * 60
+DOWNLOAD_AUTH_MARGIN = 60 * 60
 
 # Cache for the auth token and download URL
 auth_cache = {
@@ -25,116 +51,261 @@ auth_cache = {
     "expires_at": 0
 }
 
+# prefix -> (download authorization token, expires_at)
+_download_auth_cache: Dict[str, Tuple[str, float]] = {}
+# file path -> (B2 listing entry, expires_at)
+_file_listing_cache: Dict[str, Tuple[Dict[str, Any], float]] = {}
+
+# Shared, pooled HTTP session (see open_session / close_session)
+_session: Optional[aiohttp.ClientSession] = None
+
+async def open_session() -> aiohttp.ClientSession:
+    """Open the shared B2 session. Called from the FastAPI lifespan on startup."""
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=BACKBLAZE_POOL_SIZE, keepalive_timeout=60),
+            timeout=aiohttp.ClientTimeout(total=60),
+        )
+    return _session
+
+async def close_session() -> None:
+    """Close the shared B2 session. Called from the FastAPI lifespan on shutdown."""
+    global _session
+    if _background_refresh is not None and not _background_refresh.done():
+        _background_refresh.cancel()
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+async def _get_session() -> aiohttp.ClientSession:
+    # Opened lazily as well so the helpers keep working outside the API (scripts, tests)
+    if _session is None or _session.closed:
+        return await open_session()
+    return _session
+
+# One refresh lock per event loop (asyncio locks cannot be shared between loops)
+_auth_locks: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Lock]" = weakref.WeakKeyDictionary()
+_background_refresh: Optional["asyncio.Task"] = None
+
+def _auth_lock() -> asyncio.Lock:
+    loop = asyncio.get_running_loop()
+    lock = _auth_locks.get(loop)
+    if lock is None:
+        lock = _auth_locks[loop] = asyncio.Lock()
+    return lock
+
+def _cached_auth() -> Dict[str, str]:
+    return {
+        "authorization_token": auth_cache["authorization_token"],
+        "api_url": auth_cache["api_url"],
+        "download_url": auth_cache["download_url"]
+    }
+
 async def get_auth_token():
     """Get an authorization token from BackBlaze B2"""
-    global auth_cache
-    
+    global _background_refresh
+
     # Check if we have a valid cached token
     now = time.time()
     if auth_cache["authorization_token"] and auth_cache["expires_at"] > now:
-        return {
-            "authorization_token": auth_cache["authorization_token"],
-            "api_url": auth_cache["api_url"],
-            "download_url": auth_cache["download_url"]
+        if auth_cache["expires_at"] - BACKBLAZE_TOKEN_REFRESH_MARGIN <= now and (
+                _background_refresh is None or _background_refresh.done()):
+            # Close to expiry: refresh without making this caller wait
+            _background_refresh = asyncio.get_running_loop().create_task(_refresh_auth_token(force=True))
+            _background_refresh.add_done_callback(_log_refresh_failure)
+        return _cached_auth()
+
+    return await _refresh_auth_token()
+
+def _log_refresh_failure(task: "asyncio.Task") -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Background BackBlaze token refresh failed: {task.exception()}")
+
+async def _refresh_auth_token(force: bool = False):
+    """Authorize the account, at most one call in flight per event loop."""
+    global auth_cache
+
+    async with _auth_lock():
+        # Another caller may have refreshed the token while we waited for the lock
+        now = time.time()
+        if auth_cache["authorization_token"] and auth_cache["expires_at"] > now and not (
+                force and auth_cache["expires_at"] - BACKBLAZE_TOKEN_REFRESH_MARGIN <= now):
+            return _cached_auth()
+
+        # Encode credentials
+        import base64
+        credentials = base64.b64encode(
+            f"{BACKBLAZE_APPLICATION_KEY_ID}:{BACKBLAZE_APPLICATION_KEY}".encode()
+        ).decode()
+
+        # Authorize account
+        session = await _get_session()
+        with _timed_call("b2_authorize_account") as call:
+            async with session.get(
+                f"{BACKBLAZE_ENDPOINT}/b2api/v2/b2_authorize_account",
+                headers={"Authorization": f"Basic {credentials}"}
+            ) as response:
+                call["status"] = response.status
+                if response.status != 200:
+                    logger.error(f"Failed to authorize BackBlaze account: {await response.text()}")
+                    return None
+
+                data = await response.json()
+
+        # Cache the token for 23 hours (tokens are valid for 24 hours)
+        auth_cache = {
+            "authorization_token": data["authorizationToken"],
+            "api_url": data["apiUrl"],
+            "download_url": data["downloadUrl"],
+            "expires_at": now + 23 * 60 * 60
         }
-    
-    # Encode credentials
-    import base64
-    credentials = base64.b64encode(
-        f"{BACKBLAZE_APPLICATION_KEY_ID}:{BACKBLAZE_APPLICATION_KEY}".encode()
-    ).decode()
-    
-    # Authorize account
-    async with aiohttp.ClientSession() as session:
-        async with session.get(
-            f"{BACKBLAZE_ENDPOINT}/b2api/v2/b2_authorize_account",
-            headers={"Authorization": f"Basic {credentials}"}
+        return _cached_auth()
+
+@contextmanager
+def _timed_call(api_name: str) -> Iterator[Dict[str, Optional[int]]]:
+    """Record count and latency of one B2 call; set ``["status"]`` inside the block."""
+    call: Dict[str, Optional[int]] = {"status": None}
+    start = time.perf_counter()
+    try:
+        yield call
+    finally:
+        B2_REQUESTS.inc(api=api_name, status=status_label(call["status"]))
+        B2_REQUEST_SECONDS.observe(time.perf_counter() - start, api=api_name)
+
+async def _b2_post(auth: Dict[str, str], api_name: str, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """POST to a B2 API call with the shared session; returns the JSON body or None."""
+    session = await _get_session()
+    with _timed_call(api_name) as call:
+        async with session.post(
+            f"{auth['api_url']}/b2api/v2/{api_name}",
+            headers={
+                "Authorization": auth["authorization_token"],
+                "Content-Type": "application/json"
+            },
+            json=payload
         ) as response:
+            call["status"] = response.status
+            if response.status == 401:
+                # The account token was revoked or expired early; force a re-authorization next time
+                auth_cache["expires_at"] = 0
             if response.status != 200:
-                logger.error(f"Failed to authorize BackBlaze account: {await response.text()}")
+                logger.error(f"{api_name} failed: {await response.text()}")
                 return None
-            
-            data = await response.json()
-            
-            # Cache the token for 23 hours (tokens are valid for 24 hours)
-            auth_cache = {
-                "authorization_token": data["authorizationToken"],
-                "api_url": data["apiUrl"],
-                "download_url": data["downloadUrl"],
-                "expires_at": now + 23 * 60 * 60
-            }
-            
-            return {
-                "authorization_token": data["authorizationToken"],
-                "api_url": data["apiUrl"],
-                "download_url": data["downloadUrl"]
-            }
+            return await response.json()
+
+def _download_auth_prefix(file_path: str) -> str:
+    """Authorizations are scoped to the file's folder so sibling versions share one."""
+    folder, sep, _ = file_path.rpartition("/")
+    return f"{folder}/" if sep else file_path
+
+async def _get_download_authorization(auth: Dict[str, str], file_path: str) -> Optional[str]:
+    """Return a cached download authorization covering *file_path*, requesting one if needed."""
+    prefix = _download_auth_prefix(file_path)
+    cached = _download_auth_cache.get(prefix)
+    if cached and cached[1] - DOWNLOAD_AUTH_MARGIN > time.time():
+        return cached[0]
+
+    data = await _b2_post(auth, "b2_get_download_authorization", {
+        "bucketId": BACKBLAZE_BUCKET_ID,
+        "fileNamePrefix": prefix,
+        "validDurationInSeconds": DOWNLOAD_AUTH_DURATION
+    })
+    if data is None:
+        return None
+    _download_auth_cache[prefix] = (data["authorizationToken"], time.time() + DOWNLOAD_AUTH_DURATION)
+    return data["authorizationToken"]
+
+async def _get_file_entry(auth: Dict[str, str], file_path: str) -> Optional[Dict[str, Any]]:
+    """Return the (memoized) B2 listing entry for *file_path*."""
+    cached = _file_listing_cache.get(file_path)
+    if cached and cached[1] > time.time():
+        return cached[0]
+
+    data = await _b2_post(auth, "b2_list_file_names", {
+        "bucketId": BACKBLAZE_BUCKET_ID,
+        "prefix": file_path,
+        "maxFileCount": 1
+    })
+    if data is None:
+        return None
+    if not data.get("files"):
+        logger.error(f"File not found in BackBlaze: {file_path}")
+        return None
+    entry = data["files"][0]
+    _file_listing_cache[file_path] = (entry, time.time() + BACKBLAZE_LISTING_TTL)
+    return entry
+
+def invalidate_file_cache(file_path: Optional[str] = None) -> None:
+    """Forget memoized listings (all of them, or just *file_path*), e.g. after an upload."""
+    if file_path is None:
+        _file_listing_cache.clear()
+    else:
+        _file_listing_cache.pop(file_path, None)
 
 async def get_file_download_url(file_path: str) -> Optional[str]:
     """
     Get a signed download URL for a file in BackBlaze
-    
+
     Parameters
     ----------
     file_path : str
         The path to the file in BackBlaze
-        
+
     Returns
     -------
     str or None
         The signed download URL, or None if the file was not found
     """
+    info = await get_file_download_info(file_path)
+    return info["download_url"] if info else None
+
+async def get_file_download_info(file_path: str) -> Optional[Dict[str, Any]]:
+    """
+    Get a signed download URL plus the file metadata returned by the listing
+
+    The metadata (file ID, size and SHA1) comes from the same
+    ``b2_list_file_names`` call used to find the file, so callers such as the
+    package cache can validate local copies without extra requests.
+
+    Returns
+    -------
+    dict or None
+        ``download_url``, ``file_id``, ``file_name``, ``content_length`` and
+        ``content_sha1`` (None when B2 has no verified SHA1), or None if the
+        file was not found
+    """
     auth = await get_auth_token()
     if not auth:
         logger.error("Failed to get BackBlaze auth token")
         return None
-    
-    # First, get the file ID
-    async with aiohttp.ClientSession() as session:
-        async with session.post(
-            f"{auth['api_url']}/b2api/v2/b2_list_file_names",
-            headers={
-                "Authorization": auth["authorization_token"],
-                "Content-Type": "application/json"
-            },
-            json={
-                "bucketId": BACKBLAZE_BUCKET_ID,
-                "prefix": file_path,
-                "maxFileCount": 1
-            }
-        ) as response:
-            if response.status != 200:
-                logger.error(f"Failed to list files: {await response.text()}")
-                return None
-            
-            data = await response.json()
-            if not data.get("files"):
-                logger.error(f"File not found in BackBlaze: {file_path}")
-                return None
-            
-            file_id = data["files"][0]["fileId"]
-    
-    # Get a download authorization
-    async with aiohttp.ClientSession() as session:
-        async with session.post(
-            f"{auth['api_url']}/b2api/v2/b2_get_download_authorization",
-            headers={
-                "Authorization": auth["authorization_token"],
-                "Content-Type": "application/json"
-            },
-            json={
-                "bucketId": BACKBLAZE_BUCKET_ID,
-                "fileNamePrefix": file_path,
-                "validDurationInSeconds": 86400  # 24 hours
-            }
-        ) as response:
-            if response.status != 200:
-                logger.error(f"Failed to get download authorization: {await response.text()}")
-                return None
-            
-            data = await response.json()
-            auth_token = data["authorizationToken"]
-    
+
+    # First, get the file ID (memoized)
+    file_entry = await _get_file_entry(auth, file_path)
+    if file_entry is None:
+        return None
+
+    # Get a download authorization (cached per prefix)
+    auth_token = await _get_download_authorization(auth, file_path)
+    if auth_token is None:
+        return None
+
     # Construct the download URL
     download_url = f"{auth['download_url']}/file/{BACKBLAZE_BUCKET_NAME}/{file_path}?Authorization={auth_token}"
-    return download_url
+    return {
+        "download_url": download_url,
+        "file_id": file_entry["fileId"],
+        "file_name": file_entry.get("fileName", file_path),
+        "content_length": file_entry.get("contentLength"),
+        "content_sha1": _content_sha1(file_entry),
+    }
+
+def _content_sha1(file_entry: Dict[str, Any]) -> Optional[str]:
+    """Return the file's SHA1 from a B2 listing entry, if B2 knows it."""
+    sha1 = file_entry.get("contentSha1") or ""
+    if sha1.startswith("unverified:"):
+        sha1 = sha1[len("unverified:"):]
+    if not sha1 or sha1 == "none":
+        # Large files (uploaded in parts) carry the SHA1 in their file info, if at all
+        sha1 = (file_entry.get("fileInfo") or {}).get("large_file_sha1") or ""
+    return sha1.lower() or None
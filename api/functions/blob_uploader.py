@@ -0,0 +1,409 @@
+"""
+Concurrent Azure BlockBlob uploader shared by the Intune upload helpers.
+
+Intune hands back a SAS URI for every content file; the encrypted payload is
+PUT to it as a series of blocks and then stitched together with a single
+``comp=blocklist`` call.  Uploading the blocks one after another makes large
+packages latency bound, so this module keeps several block PUTs in flight at
+once while still committing the block list in the original order.
+
+Block PUTs that fail with a transient error (connection reset, timeout,
+408/429/5xx) are retried with exponential backoff.  Block IDs depend only on
+the block index, so an interrupted upload can be resumed: pass the blob's
+uncommitted blocks (see :func:`get_uncommitted_blocks`) as *staged* and only
+the missing blocks are sent.
+
+:func:`upload_blocks_async` does the same on an ``aiohttp`` session for the
+asyncio upload engine (``async_uploader``): block PUTs are coroutines bounded
+by a semaphore instead of pool threads.
+
+Configuration
+-------------
+BLOB_BLOCK_SIZE     Block size in bytes (default 4 MiB).
+BLOB_UPLOAD_WORKERS Number of concurrent block PUTs (default 8).
+BLOB_PUT_RETRIES    Retries per block PUT after a transient failure (default 5).
+BLOB_RETRY_BACKOFF  First retry delay in seconds, doubled per attempt (default 0.5).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import base64
+import logging
+import os
+import random
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import quote
+
+import aiohttp
+import requests
+import yarl
+from requests.adapters import HTTPAdapter
+
+from .metrics import BLOB_REQUEST_SECONDS, BLOB_REQUESTS, BLOB_UPLOAD_BYTES, status_label
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BLOCK_SIZE = int(os.environ.get("BLOB_BLOCK_SIZE", 4 * 1024 * 1024))
+DEFAULT_MAX_WORKERS = int(os.environ.get("BLOB_UPLOAD_WORKERS", 8))
+BLOB_PUT_RETRIES = int(os.environ.get("BLOB_PUT_RETRIES", 5))
+BLOB_RETRY_BACKOFF = float(os.environ.get("BLOB_RETRY_BACKOFF", 0.5))
+_MAX_BACKOFF = 30.0
+
+_RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+def block_id(index: int) -> str:
+    """Return the Base64 block ID for block *index* (all IDs share one length)."""
+    return base64.b64encode(f"{index:05}".encode()).decode()
+
+
+def iter_blocks(fh: BinaryIO, block_size: int = DEFAULT_BLOCK_SIZE) -> Iterator[bytes]:
+    """Yield successive *block_size* chunks from an open binary file object."""
+    while chunk := fh.read(block_size):
+        yield chunk
+
+
+def _new_session(pool_size: int) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _timed_put(session: requests.Session, operation: str, sas_uri: str, **kwargs) -> requests.Response:
+    start = time.perf_counter()
+    status = None
+    try:
+        response = session.put(sas_uri, **kwargs)
+        status = response.status_code
+        return response
+    finally:
+        BLOB_REQUESTS.inc(operation=operation, status=status_label(status))
+        BLOB_REQUEST_SECONDS.observe(time.perf_counter() - start, operation=operation)
+
+
+def _backoff(attempt: int, retry_after: Optional[str] = None) -> float:
+    try:
+        if retry_after is not None:
+            return min(_MAX_BACKOFF, float(retry_after))
+    except ValueError:
+        pass
+    return min(_MAX_BACKOFF, BLOB_RETRY_BACKOFF * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+def _put_block(session: requests.Session, sas_uri: str, blk_id: str, chunk: bytes) -> None:
+    params = {"comp": "block", "blockid": blk_id}
+    for attempt in range(BLOB_PUT_RETRIES + 1):
+        retry_after = None
+        try:
+            response = _timed_put(
+                session,
+                "block",
+                sas_uri,
+                params=params,
+                data=chunk,
+                headers={"x-ms-blob-type": "BlockBlob"},
+            )
+        except (requests.ConnectionError, requests.Timeout) as exc:
+            if attempt == BLOB_PUT_RETRIES:
+                raise
+            reason = str(exc)
+        else:
+            if response.status_code not in _RETRYABLE_STATUSES or attempt == BLOB_PUT_RETRIES:
+                response.raise_for_status()
+                BLOB_UPLOAD_BYTES.inc(len(chunk))
+                return
+            reason = f"HTTP {response.status_code}"
+            retry_after = response.headers.get("Retry-After")
+        delay = _backoff(attempt, retry_after)
+        logger.warning("Block %s PUT failed (%s); retry %s/%s in %.1fs",
+                       blk_id, reason, attempt + 1, BLOB_PUT_RETRIES, delay)
+        time.sleep(delay)
+
+
+def get_uncommitted_blocks(session: requests.Session, sas_uri: str) -> Dict[str, int]:
+    """
+    Return ``{block id: size}`` of the blocks already staged (but not yet
+    committed) on the blob; empty if the blob does not exist yet.
+    """
+    response = session.get(sas_uri, params={"comp": "blocklist", "blocklisttype": "uncommitted"})
+    if response.status_code == 404:
+        return {}
+    response.raise_for_status()
+    uncommitted = ET.fromstring(response.content).find("UncommittedBlocks")
+    if uncommitted is None:
+        return {}
+    return {block.findtext("Name"): int(block.findtext("Size") or 0)
+            for block in uncommitted.findall("Block")}
+
+
+def commit_block_list(session: requests.Session, sas_uri: str, block_ids: List[str]) -> None:
+    """Commit *block_ids* (in order) as the content of the blob."""
+    block_list_xml = (
+        '<?xml version="1.0" encoding="utf-8"?><BlockList>'
+        + "".join(f"<Latest>{b}</Latest>" for b in block_ids)
+        + "</BlockList>"
+    )
+    _timed_put(session, "blocklist", sas_uri, params={"comp": "blocklist"}, data=block_list_xml,
+               headers={"Content-Type": "application/xml"}).raise_for_status()
+
+
+def upload_blocks(
+    blocks: Iterable[bytes],
+    sas_uri: str,
+    *,
+    max_workers: Optional[int] = None,
+    session: Optional[requests.Session] = None,
+    staged: Optional[Dict[str, int]] = None,
+    on_block: Optional[Callable[[str, int], None]] = None,
+) -> int:
+    """
+    Upload *blocks* to *sas_uri* concurrently and commit the block list.
+
+    Blocks are read from the iterable on the calling thread and handed to a
+    bounded pool of workers.  At most ``2 * max_workers`` blocks are buffered
+    at any time, so memory use stays flat regardless of the payload size.
+
+    Parameters
+    ----------
+    blocks : Iterable[bytes]
+        Payload chunks in upload order.  Every chunk becomes one block.
+    sas_uri : str
+        The ``azureStorageUri`` returned by Intune for the content file.
+    max_workers : int, optional
+        Number of concurrent block PUTs. Defaults to ``BLOB_UPLOAD_WORKERS``.
+    session : requests.Session, optional
+        Session to reuse; a pooled session sized to *max_workers* is created
+        (and closed) when omitted.
+    staged : dict, optional
+        ``{block id: size}`` of blocks already on the blob from an earlier,
+        interrupted attempt; blocks with a matching ID and size are not sent
+        again.
+    on_block : callable, optional
+        Called with ``(block id, size)`` after each block has been stored
+        (from a worker thread), e.g. to checkpoint progress.
+
+    Returns
+    -------
+    int
+        Total number of bytes uploaded.
+    """
+    workers = max(1, max_workers or DEFAULT_MAX_WORKERS)
+    own_session = session is None
+    if own_session:
+        session = _new_session(workers)
+
+    block_ids: List[str] = []
+    futures: List[Future] = []
+    errors: List[BaseException] = []
+    slots = threading.BoundedSemaphore(workers * 2)
+    staged = staged or {}
+    total = 0
+    skipped = 0
+
+    def _on_done(fut: Future) -> None:
+        if fut.exception() is not None:
+            errors.append(fut.exception())
+        slots.release()
+
+    def _recorder(blk_id: str, size: int) -> Callable[[Future], None]:
+        def _record(fut: Future) -> None:
+            if fut.exception() is None:
+                on_block(blk_id, size)
+        return _record
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="blob-put") as pool:
+            for idx, chunk in enumerate(blocks):
+                slots.acquire()
+                # Stop feeding the pool as soon as any block has failed
+                if errors:
+                    slots.release()
+                    break
+                blk_id = block_id(idx)
+                block_ids.append(blk_id)
+                total += len(chunk)
+                if staged.get(blk_id) == len(chunk):
+                    # Already uploaded by an earlier attempt
+                    skipped += 1
+                    slots.release()
+                    continue
+                fut = pool.submit(_put_block, session, sas_uri, blk_id, chunk)
+                if on_block is not None:
+                    fut.add_done_callback(_recorder(blk_id, len(chunk)))
+                fut.add_done_callback(_on_done)
+                futures.append(fut)
+        # Leaving the executor waits for every in-flight PUT; surface the first error
+        for fut in futures:
+            fut.result()
+
+        logger.info("Uploaded %s blocks (%s bytes, %s already staged), committing block list...",
+                    len(block_ids), total, skipped)
+        commit_block_list(session, sas_uri, block_ids)
+    finally:
+        if own_session:
+            session.close()
+    return total
+
+
+# -- asyncio ---------------------------------------------------------------------
+
+def _blob_url(sas_uri: str, **params: str) -> yarl.URL:
+    # Append to the SAS query as-is; letting aiohttp re-encode it can break the signature
+    query = "&".join(f"{name}={quote(value, safe='')}" for name, value in params.items())
+    return yarl.URL(f"{sas_uri}{'&' if '?' in sas_uri else '?'}{query}", encoded=True)
+
+
+async def _timed_put_async(session: aiohttp.ClientSession, operation: str, url: yarl.URL,
+                           **kwargs) -> Tuple[int, Optional[str]]:
+    """PUT *url*; return the status and any ``Retry-After`` (the body is drained for keep-alive)."""
+    start = time.perf_counter()
+    status = None
+    try:
+        async with session.put(url, **kwargs) as response:
+            status = response.status
+            await response.read()
+            return status, response.headers.get("Retry-After")
+    finally:
+        BLOB_REQUESTS.inc(operation=operation, status=status_label(status))
+        BLOB_REQUEST_SECONDS.observe(time.perf_counter() - start, operation=operation)
+
+
+async def _put_block_async(session: aiohttp.ClientSession, sas_uri: str, blk_id: str, chunk: bytes) -> None:
+    url = _blob_url(sas_uri, comp="block", blockid=blk_id)
+    for attempt in range(BLOB_PUT_RETRIES + 1):
+        retry_after = None
+        try:
+            status, retry_after = await _timed_put_async(session, "block", url, data=chunk,
+                                                         headers={"x-ms-blob-type": "BlockBlob"})
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as exc:
+            if attempt == BLOB_PUT_RETRIES:
+                raise
+            reason = str(exc) or type(exc).__name__
+        else:
+            if status < 400:
+                BLOB_UPLOAD_BYTES.inc(len(chunk))
+                return
+            if status not in _RETRYABLE_STATUSES or attempt == BLOB_PUT_RETRIES:
+                raise requests.HTTPError(f"{status} Error putting block {blk_id}")
+            reason = f"HTTP {status}"
+        delay = _backoff(attempt, retry_after)
+        logger.warning("Block %s PUT failed (%s); retry %s/%s in %.1fs",
+                       blk_id, reason, attempt + 1, BLOB_PUT_RETRIES, delay)
+        await asyncio.sleep(delay)
+
+
+async def get_uncommitted_blocks_async(session: aiohttp.ClientSession, sas_uri: str) -> Dict[str, int]:
+    """Asyncio variant of :func:`get_uncommitted_blocks`."""
+    url = _blob_url(sas_uri, comp="blocklist", blocklisttype="uncommitted")
+    async with session.get(url) as response:
+        if response.status == 404:
+            return {}
+        response.raise_for_status()
+        body = await response.read()
+    uncommitted = ET.fromstring(body).find("UncommittedBlocks")
+    if uncommitted is None:
+        return {}
+    return {block.findtext("Name"): int(block.findtext("Size") or 0)
+            for block in uncommitted.findall("Block")}
+
+
+async def commit_block_list_async(session: aiohttp.ClientSession, sas_uri: str, block_ids: List[str]) -> None:
+    """Asyncio variant of :func:`commit_block_list`."""
+    block_list_xml = (
+        '<?xml version="1.0" encoding="utf-8"?><BlockList>'
+        + "".join(f"<Latest>{b}</Latest>" for b in block_ids)
+        + "</BlockList>"
+    )
+    status, _ = await _timed_put_async(session, "blocklist", _blob_url(sas_uri, comp="blocklist"),
+                                    data=block_list_xml, headers={"Content-Type": "application/xml"})
+    if status >= 400:
+        raise requests.HTTPError(f"{status} Error committing the block list")
+
+
+async def upload_blocks_async(
+    blocks: Iterable[bytes],
+    sas_uri: str,
+    *,
+    session: aiohttp.ClientSession,
+    max_workers: Optional[int] = None,
+    staged: Optional[Dict[str, int]] = None,
+    on_block: Optional[Callable[[str, int], None]] = None,
+) -> int:
+    """
+    Asyncio variant of :func:`upload_blocks`.
+
+    *blocks* is a regular iterable (a payload member reading from disk or from
+    the origin); each block is read in a worker thread so the event loop never
+    blocks on I/O.  At most *max_workers* block PUTs are in flight.  Returns
+    the total number of bytes uploaded.
+    """
+    workers = max(1, max_workers or DEFAULT_MAX_WORKERS)
+    slots = asyncio.Semaphore(workers)
+    staged = staged or {}
+    block_ids: List[str] = []
+    tasks: List["asyncio.Task[None]"] = []
+    errors: List[BaseException] = []
+    total = 0
+    skipped = 0
+
+    async def _put(blk_id: str, chunk: bytes) -> None:
+        try:
+            await _put_block_async(session, sas_uri, blk_id, chunk)
+            if on_block is not None:
+                on_block(blk_id, len(chunk))
+        except Exception as exc:
+            errors.append(exc)
+        finally:
+            slots.release()
+
+    iterator = iter(blocks)
+    try:
+        while True:
+            await slots.acquire()
+            # Stop feeding blocks as soon as any PUT has failed
+            chunk = None if errors else await asyncio.to_thread(next, iterator, None)
+            if chunk is None:
+                slots.release()
+                break
+            blk_id = block_id(len(block_ids))
+            block_ids.append(blk_id)
+            total += len(chunk)
+            if staged.get(blk_id) == len(chunk):
+                # Already uploaded by an earlier attempt
+                skipped += 1
+                slots.release()
+                continue
+            tasks.append(asyncio.ensure_future(_put(blk_id, chunk)))
+    finally:
+        # Let the PUTs in flight finish (and be checkpointed) even if reading the payload failed
+        await asyncio.gather(*tasks, return_exceptions=True)
+    if errors:
+        raise errors[0]
+
+    logger.info("Uploaded %s blocks (%s bytes, %s already staged), committing block list...",
+                len(block_ids), total, skipped)
+    await commit_block_list_async(session, sas_uri, block_ids)
+    return total
+
+
+def upload_file(
+    payload_file: Path,
+    sas_uri: str,
+    *,
+    block_size: Optional[int] = None,
+    max_workers: Optional[int] = None,
+) -> int:
+    """Upload a local file to *sas_uri* as a block blob. Returns bytes uploaded."""
+    size = block_size or DEFAULT_BLOCK_SIZE
+    logger.info("Uploading payload to Azure Blob (%s bytes, %s-byte blocks)...",
+                os.path.getsize(payload_file), size)
+    with open(payload_file, "rb") as fh:
+        return upload_blocks(iter_blocks(fh, size), sas_uri, max_workers=max_workers)
@@ -0,0 +1,228 @@
+"""
+Background deployment jobs for the Intune Deployment API.
+
+Uploading a package to Intune is a long, blocking sequence (create the app
+shell, upload the payload, wait for Intune to commit and publish).  Running it
+inside an ``async def`` endpoint freezes the event loop for the entire deploy,
+so the endpoints hand the work to a bounded thread pool instead and return a
+job ID immediately.  Clients poll ``GET /jobs/{job_id}`` for progress.
+Coroutine deployments (the asyncio upload engine, see ``async_uploader``) are
+run as tasks on the event loop with :meth:`JobManager.submit_async` instead.
+
+Configuration
+-------------
+DEPLOY_MAX_WORKERS      Number of deployments that may run at once (default 4).
+DEPLOY_MAX_ASYNC        Number of coroutine deployments that may run at once (default 64).
+DEPLOY_ASYNC            Set to "true" to deploy with the asyncio upload engine (default "false").
+DEPLOY_JOB_RETENTION    Seconds a finished job stays queryable (default 86400).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import threading
+import time
+import uuid
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+DEPLOY_MAX_WORKERS = int(os.environ.get("DEPLOY_MAX_WORKERS", 4))
+DEPLOY_MAX_ASYNC = int(os.environ.get("DEPLOY_MAX_ASYNC", 64))
+DEPLOY_ASYNC = os.environ.get("DEPLOY_ASYNC", "false").lower() == "true"
+DEPLOY_JOB_RETENTION = int(os.environ.get("DEPLOY_JOB_RETENTION", 24 * 60 * 60))
+
+# Stages reported by the uploaders through their ``on_stage`` callback
+STAGE_QUEUED = "queued"
+STAGE_DOWNLOADING = "downloading"
+STAGE_SHELL_CREATED = "shell_created"
+STAGE_UPLOADING = "uploading"
+STAGE_COMMITTING = "committing"
+STAGE_PUBLISHING = "publishing"
+STAGE_COMPLETED = "completed"
+STAGE_FAILED = "failed"
+
+# Overall job status
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_SUCCEEDED = "succeeded"
+STATUS_FAILED = "failed"
+
+
+class DeploymentJob:
+    """State of a single background deployment."""
+
+    def __init__(self, kind: str, label: Optional[str] = None):
+        self.job_id = uuid.uuid4().hex
+        self.kind = kind
+        self.label = label
+        self.status = STATUS_QUEUED
+        self.stage = STAGE_QUEUED
+        self.history: List[Dict[str, Any]] = [{"stage": STAGE_QUEUED, "at": time.time()}]
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def set_stage(self, stage: str) -> None:
+        """Record that the deployment has moved on to *stage*."""
+        with self._lock:
+            self.stage = stage
+            self.history.append({"stage": stage, "at": time.time()})
+        logger.info("Job %s → %s", self.job_id, stage)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "job_id": self.job_id,
+                "kind": self.kind,
+                "label": self.label,
+                "status": self.status,
+                "stage": self.stage,
+                "history": list(self.history),
+                "result": self.result,
+                "error": self.error,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+            }
+
+
+class JobManager:
+    """Runs deployment callables on a bounded thread pool and tracks their state."""
+
+    def __init__(self, max_workers: int = DEPLOY_MAX_WORKERS, retention: int = DEPLOY_JOB_RETENTION,
+                 max_async: int = DEPLOY_MAX_ASYNC):
+        self.retention = retention
+        self.max_async = max_async
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="deploy")
+        self._jobs: Dict[str, DeploymentJob] = {}
+        self._lock = threading.Lock()
+        self._tasks: Set["asyncio.Task[None]"] = set()
+        # One semaphore per event loop (asyncio primitives cannot be shared between loops)
+        self._async_slots: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = \
+            weakref.WeakKeyDictionary()
+
+    def submit(
+        self,
+        kind: str,
+        func: Callable[..., Any],
+        *,
+        label: Optional[str] = None,
+        **kwargs: Any,
+    ) -> DeploymentJob:
+        """
+        Queue ``func(on_stage=..., **kwargs)`` and return its job immediately.
+
+        *func* receives an ``on_stage`` callback which it should call with one
+        of the ``STAGE_*`` constants as the deployment progresses.  Its return
+        value becomes the job ``result``.
+        """
+        job = self._add(kind, label)
+        self._executor.submit(self._run, job, func, kwargs)
+        return job
+
+    def submit_async(
+        self,
+        kind: str,
+        func: Callable[..., Awaitable[Any]],
+        *,
+        label: Optional[str] = None,
+        **kwargs: Any,
+    ) -> DeploymentJob:
+        """
+        Like :meth:`submit` for a coroutine function: ``func(on_stage=..., **kwargs)``
+        runs as a task on the running event loop (at most ``max_async`` at
+        once) rather than on a pool thread.  Must be called from the loop,
+        e.g. in an ``async def`` endpoint.
+        """
+        job = self._add(kind, label)
+        task = asyncio.get_running_loop().create_task(self._run_async(job, func, kwargs))
+        # The loop only keeps weak references to tasks
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    def get(self, job_id: str) -> Optional[DeploymentJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self) -> List[DeploymentJob]:
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda j: j.created_at, reverse=True)
+
+    def shutdown(self, wait: bool = False) -> None:
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+        for task in list(self._tasks):
+            task.cancel()
+
+    def _add(self, kind: str, label: Optional[str]) -> DeploymentJob:
+        job = DeploymentJob(kind, label)
+        with self._lock:
+            self._prune()
+            self._jobs[job.job_id] = job
+        return job
+
+    def _run(self, job: DeploymentJob, func: Callable[..., Any], kwargs: Dict[str, Any]) -> None:
+        self._started(job)
+        try:
+            result = func(on_stage=job.set_stage, **kwargs)
+        except Exception as exc:
+            self._failed(job, exc)
+        else:
+            self._succeeded(job, result)
+
+    async def _run_async(self, job: DeploymentJob, func: Callable[..., Awaitable[Any]],
+                         kwargs: Dict[str, Any]) -> None:
+        loop = asyncio.get_running_loop()
+        slots = self._async_slots.get(loop)
+        if slots is None:
+            slots = self._async_slots[loop] = asyncio.Semaphore(self.max_async)
+        async with slots:
+            self._started(job)
+            try:
+                result = await func(on_stage=job.set_stage, **kwargs)
+            except Exception as exc:
+                self._failed(job, exc)
+            else:
+                self._succeeded(job, result)
+
+    @staticmethod
+    def _started(job: DeploymentJob) -> None:
+        with job._lock:
+            job.status = STATUS_RUNNING
+            job.started_at = time.time()
+
+    @staticmethod
+    def _failed(job: DeploymentJob, exc: Exception) -> None:
+        logger.error("Job %s failed: %s", job.job_id, exc, exc_info=True)
+        with job._lock:
+            job.error = str(exc)
+            job.status = STATUS_FAILED
+            job.finished_at = time.time()
+        job.set_stage(STAGE_FAILED)
+
+    @staticmethod
+    def _succeeded(job: DeploymentJob, result: Any) -> None:
+        with job._lock:
+            job.result = result
+            job.status = STATUS_SUCCEEDED
+            job.finished_at = time.time()
+        job.set_stage(STAGE_COMPLETED)
+
+    def _prune(self) -> None:
+        cutoff = time.time() - self.retention
+        expired = [jid for jid, j in self._jobs.items()
+                   if j.finished_at is not None and j.finished_at < cutoff]
+        for jid in expired:
+            del self._jobs[jid]
+
+
+# Process-wide job manager used by the API endpoints
+job_manager = JobManager()
@@ -0,0 +1,459 @@
+"""
+The Intune deploy sequence shared by every uploader.
+
+Once a package is parsed (encryption metadata from ``Detection.xml`` plus a
+payload member that streams the encrypted content) every deploy runs the same
+stages: resume an interrupted upload from its checkpoint
+(``upload_checkpoints``), apply the duplicate policy (``app_inventory``),
+create the app shell or a new content version of the existing app, upload the
+payload to Azure Blob, commit the file and the content version, and wait for
+Intune to publish the app.
+
+The stages are written once, as the generator :func:`deploy_stages`.  It
+yields every Graph, Azure Blob or checkpoint step as a ``(step, *args)``
+tuple and gets the step's result sent back, so the same logic runs on a
+worker thread (:class:`DeploySteps` driven by :func:`run_deploy`) and on the
+event loop (``async_uploader.AsyncDeploySteps``).  The Winget and App Library
+uploaders only differ in how they obtain the .intunewin and in the app body
+they create.
+"""
+
+from __future__ import annotations
+
+import functools
+import json
+import logging
+import time
+from typing import Any, Callable, Dict, Generator, NamedTuple, Optional, Tuple
+
+from . import graph_client
+from .app_inventory import (
+    CONTENT_SELECT,
+    IF_EXISTS_UPDATE,
+    WINGET_NOTES_TAG,
+    check_duplicate,
+    content_fields,
+    content_is_current,
+    if_exists_policy,
+    record_created_app,
+)
+from .blob_uploader import DEFAULT_BLOCK_SIZE, upload_blocks
+from .deploy_jobs import STAGE_COMMITTING, STAGE_PUBLISHING, STAGE_SHELL_CREATED, STAGE_UPLOADING
+from .graph_batch import batched_get
+from .graph_client import GraphRequestError, graph_request
+from .metrics import DeployTimer
+from .polling import Poller
+from .tenants import get_current_tenant
+from .upload_checkpoints import (
+    UploadCheckpoint,
+    UploadCheckpointStore,
+    checkpoint_key,
+    get_checkpoint_store,
+    staged_blocks,
+)
+
+logger = logging.getLogger(__name__)
+
+# A step yielded by deploy_stages: the name of a DeploySteps method and its arguments
+Step = Tuple[Any, ...]
+
+
+# --------------------------------------------------------------------------------------
+# Graph requests
+# --------------------------------------------------------------------------------------
+def app_url(app_id: Optional[str] = None) -> str:
+    # GRAPH_BASE is read per call so it can be pointed at an emulator
+    url = f"{graph_client.GRAPH_BASE}/deviceAppManagement/mobileApps"
+    return f"{url}/{app_id}" if app_id else url
+
+
+def content_versions_url(app_id: str) -> str:
+    return f"{app_url(app_id)}/microsoft.graph.win32LobApp/contentVersions"
+
+
+def file_url(app_id: str, version_id: str, file_id: Optional[str] = None) -> str:
+    url = f"{content_versions_url(app_id)}/{version_id}/files"
+    return f"{url}/{file_id}" if file_id else url
+
+
+def file_placeholder_body(meta: Dict, payload: Any) -> Dict:
+    return {
+        "@odata.type": "#microsoft.graph.mobileAppContentFile",
+        "name": meta["file_name"],
+        "size": meta["unencrypted_size"],
+        "sizeEncrypted": payload.size,  # from the zip central directory
+        "isDependency": False,
+    }
+
+
+def commit_file_body(meta: Dict) -> Dict:
+    return {
+        "fileEncryptionInfo": {
+            "@odata.type": "microsoft.graph.fileEncryptionInfo",
+            "encryptionKey": meta["encryption_key"],
+            "initializationVector": meta["iv"],
+            "mac": meta["mac"],
+            "macKey": meta["mac_key"],
+            "profileIdentifier": meta["profile_identifier"],
+            "fileDigest": meta["file_digest"],
+            "fileDigestAlgorithm": meta["digest_algorithm"],
+        }
+    }
+
+
+def content_version_body(version_id: str, content: Optional[Dict] = None) -> Dict:
+    """
+    Finalize the content version after all files are committed.
+    Without this PATCH the mobileApp remains 'notPublished'.
+    *content* (see ``app_inventory.content_fields``) is sent along with it.
+    """
+    return {
+        "@odata.type": "#microsoft.graph.win32LobApp",
+        "committedContentVersion": version_id,
+        **(content or {}),
+    }
+
+
+# --------------------------------------------------------------------------------------
+# Waiting for Intune
+# --------------------------------------------------------------------------------------
+def _storage_uri_ready(data: Dict) -> bool:
+    return bool(data.get("azureStorageUri"))
+
+
+def _storage_uri_renewed(data: Dict) -> bool:
+    if data.get("uploadState") == "azureStorageUriRenewalFailed":
+        raise RuntimeError(f"Intune could not renew the storage URI: {json.dumps(data)[:1000]}")
+    return data.get("uploadState") == "azureStorageUriRenewalSuccess"
+
+
+def _file_committed(data: Dict) -> bool:
+    logger.info(
+        "Commit poll → isCommitted=%s  uploadState=%s  size=%s",
+        data.get("isCommitted"), data.get("uploadState", "n/a"), data.get("size")
+    )
+    logger.debug("Full commit poll payload: %s", json.dumps(data)[:1000])
+    if data.get("uploadState") == "commitFileFailed":
+        raise RuntimeError(f"Intune reported commit failure: {json.dumps(data)[:1000]}")
+    return bool(data.get("isCommitted"))
+
+
+def _app_published(data: Dict) -> bool:
+    # full object; not all tenants expose processingState
+    logger.info("Publish poll → publishingState=%s", data.get("publishingState"))
+    logger.debug("Full publish poll payload: %s", json.dumps(data)[:1000])
+    return data.get("publishingState") == "published"
+
+
+class Wait(NamedTuple):
+    """How to poll for one Intune state change (see ``polling.Poller``)."""
+
+    initial: float
+    max_interval: float
+    deadline: float
+    stage: str
+    timeout_message: str
+    done: Callable[[Dict], bool]
+
+    @property
+    def schedule(self) -> Dict[str, float]:
+        return {"initial": self.initial, "max_interval": self.max_interval, "deadline": self.deadline}
+
+
+WAIT_STORAGE_URI = Wait(1, 5, 300, "storage_uri", "Timed out waiting for AzureStorageUri",
+                        _storage_uri_ready)
+WAIT_STORAGE_URI_RENEWAL = Wait(1, 5, 300, "storage_uri_renewal", "Timed out renewing AzureStorageUri",
+                                _storage_uri_renewed)
+WAIT_COMMIT = Wait(2, 15, 600, "commit", "Timed out waiting for file commit", _file_committed)
+WAIT_PUBLISHED = Wait(2, 20, 900, "publish", "Timed out waiting for publishingState='published'",
+                      _app_published)
+
+
+# --------------------------------------------------------------------------------------
+# Stages
+# --------------------------------------------------------------------------------------
+def deploy_stages(
+    meta: Dict,
+    payload: Any,
+    *,
+    app_body: Dict[str, Any],
+    checkpoint_pipeline: Optional[str],
+    package_id: str,
+    display_name: str,
+    report: Callable[[str], None],
+    timer: DeployTimer,
+    if_exists: Optional[str] = None,
+    notes_tag: str = WINGET_NOTES_TAG,
+) -> Generator[Step, Any, str]:
+    """
+    The deploy of an already parsed package, one yielded step at a time.
+
+    Parameters
+    ----------
+    meta, payload
+        Encryption metadata and payload member from ``read_intunewin`` (or
+        ``read_remote_intunewin``).
+    app_body : dict
+        The ``win32LobApp`` to create (built by the calling uploader).
+    checkpoint_pipeline : str or None
+        Pipeline part of the checkpoint key ("win32" or "app_library"), shared
+        by the threaded and async uploaders of the same kind; None when no
+        checkpoint store is configured.
+    report : callable
+        Called with a ``deploy_jobs`` stage name as the upload progresses.
+    timer : DeployTimer
+        Times every step.
+    if_exists : str, optional
+        Duplicate policy for *package_id* (see ``app_inventory.check_duplicate``).
+    notes_tag : str, optional
+        Tag of the package ID in ``notes``; the committed content's digest is
+        recorded next to it (see ``app_inventory.content_fields``).
+
+    Returns
+    -------
+    str
+        The mobileApp ID (the existing one when a duplicate is skipped or updated).
+    """
+    # A deploy of the same package to the same tenant that was interrupted
+    # before publishing is resumed from its checkpoint (see ``upload_checkpoints``)
+    key = checkpoint = None
+    if checkpoint_pipeline is not None:
+        key = checkpoint_key(checkpoint_pipeline, get_current_tenant(), package_id, display_name,
+                             meta["file_digest"], payload.size)
+        with timer.span("resume"):
+            checkpoint = yield from _resume_checkpoint(key)
+
+    staged: Dict[str, int] = {}
+    if checkpoint is None:
+        # Make sure the tenant does not have the app already (see ``app_inventory``)
+        with timer.span("duplicate_check"):
+            existing = yield "check_duplicate", package_id, if_exists, notes_tag
+        if existing is not None and if_exists_policy(if_exists) != IF_EXISTS_UPDATE:
+            return existing
+        if existing is not None:
+            # Update: a new content version for the existing app, unless it already has this package
+            app_id = existing
+            with timer.span("check_content"):
+                current = content_is_current((yield "get_app_content", app_id), meta["file_digest"])
+            if current:
+                logger.info("App %s already has this package committed; nothing to upload", app_id)
+                return app_id
+            logger.info("Updating app %s with a new content version", app_id)
+        else:
+            with timer.span("create_app"):
+                app_id = yield "create_app", app_body
+            yield "record_created_app", app_id, display_name, package_id, notes_tag
+            logger.info("Created app shell. ID: %s", app_id)
+        report(STAGE_SHELL_CREATED)
+        with timer.span("create_content_version"):
+            version_id = yield "create_content_version", app_id
+        logger.info("Created content version: %s", version_id)
+        with timer.span("create_file"):
+            placeholder = yield "create_file_placeholder", app_id, version_id, meta, payload
+        file_id = placeholder["id"]
+        logger.info("Placeholder file created: %s", file_id)
+        with timer.span("wait_storage_uri"):
+            placeholder = yield "wait_for_storage_uri", app_id, version_id, file_id
+        sas_uri = placeholder["azureStorageUri"]
+        if key is not None:
+            checkpoint = UploadCheckpoint(key, app_id, version_id, file_id, sas_uri, time.time())
+            yield "save_checkpoint", checkpoint
+    else:
+        # Reuse the app, content version and file of the interrupted upload
+        app_id, version_id, file_id = checkpoint.app_id, checkpoint.version_id, checkpoint.file_id
+        sas_uri = checkpoint.sas_uri
+        report(STAGE_SHELL_CREATED)
+        if checkpoint.stage == STAGE_UPLOADING:
+            staged = yield "staged_blocks", checkpoint
+
+    if checkpoint is None or checkpoint.stage == STAGE_UPLOADING:
+        # Blocks already staged by an interrupted attempt are skipped
+        report(STAGE_UPLOADING)
+        with timer.span("upload_blob"):
+            yield "upload_blob", payload, sas_uri, staged, key
+        report(STAGE_COMMITTING)
+        with timer.span("commit_file"):
+            yield "commit_file", app_id, version_id, file_id, meta
+        if checkpoint is not None:
+            checkpoint.stage = STAGE_COMMITTING
+            yield "save_checkpoint", checkpoint
+    else:
+        report(STAGE_COMMITTING)
+    with timer.span("wait_commit"):
+        try:
+            yield "wait_for_commit", app_id, version_id, file_id
+        except RuntimeError:
+            # A rejected commit cannot be resumed; the next attempt starts over
+            if key is not None:
+                yield "delete_checkpoint", key
+            raise
+    with timer.span("commit_content_version"):
+        yield "commit_content_version", app_id, version_id, content_fields(notes_tag, package_id, meta)
+    report(STAGE_PUBLISHING)
+    with timer.span("wait_published"):
+        yield "wait_for_published", app_id
+    if key is not None:
+        yield "delete_checkpoint", key
+
+    logger.info("Upload finished successfully. App ID: %s", app_id)
+    return app_id
+
+
+def _resume_checkpoint(key: str) -> Generator[Step, Any, Optional[UploadCheckpoint]]:
+    """
+    Return the checkpoint of an earlier, interrupted upload of the same
+    package if its content file still exists in Intune (renewing a stale SAS
+    URI), else None.
+    """
+    checkpoint = yield "load_checkpoint", key
+    if checkpoint is None:
+        return None
+    try:
+        yield "get_file", checkpoint.app_id, checkpoint.version_id, checkpoint.file_id
+        if checkpoint.stage == STAGE_UPLOADING and checkpoint.sas_expired():
+            renewed = yield "renew_storage_uri", checkpoint.app_id, checkpoint.version_id, checkpoint.file_id
+            checkpoint.sas_uri = renewed["azureStorageUri"]
+            checkpoint.sas_issued_at = time.time()
+            yield "save_checkpoint", checkpoint
+    except GraphRequestError as exc:
+        if exc.status_code != 404:
+            raise
+        logger.warning("App %s of an interrupted upload no longer exists; starting over", checkpoint.app_id)
+        yield "delete_checkpoint", key
+        return None
+    logger.info("Resuming interrupted upload of app %s (%s blocks checkpointed, stage %s)",
+                checkpoint.app_id, len(checkpoint.blocks), checkpoint.stage)
+    return checkpoint
+
+
+def run_stages(stages: Generator[Step, Any, str], steps: Any) -> str:
+    """Drive *stages* by calling the blocking method of *steps* named by each step."""
+    send, value = stages.send, None
+    while True:
+        try:
+            name, *args = send(value)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            send, value = stages.send, getattr(steps, name)(*args)
+        except BaseException as exc:
+            # Raised inside the stage, so its span records the error and cleanup runs
+            send, value = stages.throw, exc
+
+
+# --------------------------------------------------------------------------------------
+# Threaded steps
+# --------------------------------------------------------------------------------------
+class DeploySteps:
+    """The steps of :func:`deploy_stages` as blocking calls, for deploys run on a worker thread."""
+
+    def __init__(self, store: Optional[UploadCheckpointStore] = None,
+                 block_size: Optional[int] = None, max_workers: Optional[int] = None):
+        self.store = store
+        self.block_size = block_size or DEFAULT_BLOCK_SIZE
+        self.max_workers = max_workers
+
+    # checkpoints and inventory
+    def load_checkpoint(self, key: str) -> Optional[UploadCheckpoint]:
+        return self.store.get(key)
+
+    def save_checkpoint(self, checkpoint: UploadCheckpoint) -> None:
+        self.store.save(checkpoint)
+
+    def delete_checkpoint(self, key: str) -> None:
+        self.store.delete(key)
+
+    def staged_blocks(self, checkpoint: UploadCheckpoint) -> Dict[str, int]:
+        return staged_blocks(checkpoint)
+
+    def check_duplicate(self, package_id: str, if_exists: Optional[str], notes_tag: str) -> Optional[str]:
+        return check_duplicate(package_id, if_exists, notes_tag)
+
+    def record_created_app(self, app_id: str, display_name: str, package_id: str, notes_tag: str) -> None:
+        record_created_app(app_id, display_name, package_id, notes_tag)
+
+    # Graph
+    def get_app_content(self, app_id: str) -> Dict:
+        return graph_request("GET", app_url(app_id), params={"$select": CONTENT_SELECT})
+
+    def create_app(self, body: Dict) -> str:
+        return graph_request("POST", app_url(), json=body)["id"]
+
+    def create_content_version(self, app_id: str) -> str:
+        return graph_request("POST", content_versions_url(app_id), json={})["id"]
+
+    def create_file_placeholder(self, app_id: str, version_id: str, meta: Dict, payload: Any) -> Dict:
+        return graph_request("POST", file_url(app_id, version_id), json=file_placeholder_body(meta, payload))
+
+    def get_file(self, app_id: str, version_id: str, file_id: str) -> Dict:
+        return graph_request("GET", file_url(app_id, version_id, file_id))
+
+    def wait_for_storage_uri(self, app_id: str, version_id: str, file_id: str) -> Dict:
+        return self._wait(WAIT_STORAGE_URI, file_url(app_id, version_id, file_id))
+
+    def renew_storage_uri(self, app_id: str, version_id: str, file_id: str) -> Dict:
+        """Ask Intune for a fresh SAS URI (they expire after a few minutes) for a resumed upload."""
+        url = file_url(app_id, version_id, file_id)
+        logger.info("Renewing the Azure Storage URI of file %s...", file_id)
+        graph_request("POST", f"{url}/renewUpload", json={})
+        return self._wait(WAIT_STORAGE_URI_RENEWAL, url)
+
+    def commit_file(self, app_id: str, version_id: str, file_id: str, meta: Dict) -> None:
+        logger.info("Committing file to Intune...")
+        graph_request("POST", f"{file_url(app_id, version_id, file_id)}/commit", json=commit_file_body(meta))
+
+    def wait_for_commit(self, app_id: str, version_id: str, file_id: str) -> None:
+        logger.info("Waiting for Intune to finish processing the file commit...")
+        self._wait(WAIT_COMMIT, file_url(app_id, version_id, file_id))
+        logger.info("File commit completed!")
+
+    def commit_content_version(self, app_id: str, version_id: str, content: Optional[Dict] = None) -> None:
+        logger.info("Committing content version %s to the mobileApp…", version_id)
+        graph_request("PATCH", app_url(app_id), json=content_version_body(version_id, content))
+
+    def wait_for_published(self, app_id: str) -> None:
+        logger.info("Waiting for Intune to publish the app …")
+        self._wait(WAIT_PUBLISHED, app_url(app_id))
+        logger.info("App is now published and ready!")
+
+    def _wait(self, wait: Wait, url: str) -> Dict:
+        return Poller(**wait.schedule).poll(
+            lambda: batched_get(url), wait.done,
+            stage=wait.stage, timeout_message=wait.timeout_message,
+        )
+
+    # Azure Blob
+    def upload_blob(self, payload: Any, sas_uri: str, staged: Dict[str, int], key: Optional[str]) -> None:
+        """Stream the encrypted payload into a block blob using concurrent block PUTs.
+
+        Blocks listed in *staged* are already on the blob and are skipped;
+        every block stored is added to the checkpoint under *key*.
+        """
+        logger.info("Uploading encrypted payload to Azure Blob (%s bytes)...", payload.size)
+        on_block = functools.partial(self.store.add_block, key) if key is not None else None
+        upload_blocks(payload.iter_blocks(self.block_size), sas_uri, max_workers=self.max_workers,
+                      staged=staged, on_block=on_block)
+
+
+def run_deploy(
+    meta: Dict,
+    payload: Any,
+    *,
+    app_body: Dict[str, Any],
+    checkpoint_pipeline: str,
+    package_id: str,
+    display_name: str,
+    report: Callable[[str], None],
+    timer: DeployTimer,
+    if_exists: Optional[str] = None,
+    notes_tag: str = WINGET_NOTES_TAG,
+) -> str:
+    """Run :func:`deploy_stages` on the calling thread (same parameters; see there)."""
+    store = get_checkpoint_store()
+    stages = deploy_stages(
+        meta, payload, app_body=app_body,
+        checkpoint_pipeline=checkpoint_pipeline if store is not None else None,
+        package_id=package_id, display_name=display_name, report=report, timer=timer,
+        if_exists=if_exists, notes_tag=notes_tag,
+    )
+    return run_stages(stages, DeploySteps(store))
@@ -0,0 +1,155 @@
+"""
+Persistent cache for AI-generated detection scripts.
+
+Generating a detection script is an LLM round trip that takes seconds and
+costs money, yet the same popular apps are requested over and over.  Scripts
+are stored in a small SQLite database keyed by the normalised app name, the
+model, the temperature and a hash of the prompt templates, so editing the
+prompts in ``ai_detection.py`` automatically stops old scripts from being
+served.  Entries expire after DETECTION_CACHE_TTL seconds and can be dropped
+through ``DELETE /detection-script/cache``.
+
+Configuration
+-------------
+DETECTION_CACHE_PATH    SQLite file (default ``~/.intune-deployment/detection_cache.sqlite``);
+                        set to an empty string to disable the cache.
+DETECTION_CACHE_TTL     Seconds a cached script is served (default 30 days).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+DETECTION_CACHE_PATH = os.environ.get(
+    "DETECTION_CACHE_PATH",
+    os.path.join(os.path.expanduser("~"), ".intune-deployment", "detection_cache.sqlite"),
+)
+DETECTION_CACHE_TTL = float(os.environ.get("DETECTION_CACHE_TTL", 30 * 24 * 60 * 60))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS detection_scripts (
+    cache_key   TEXT PRIMARY KEY,
+    app_name    TEXT NOT NULL,
+    model       TEXT NOT NULL,
+    temperature REAL NOT NULL,
+    prompt_hash TEXT NOT NULL,
+    script      TEXT NOT NULL,
+    created_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS detection_scripts_app_name ON detection_scripts (app_name);
+"""
+
+
+def normalize_app_name(app_name: str) -> str:
+    """Case-fold, unquote and collapse whitespace: "  Google  CHROME " → "google chrome"."""
+    return " ".join(app_name.strip().strip("\"'").casefold().split())
+
+
+def detection_cache_key(app_name: str, model: str, temperature: float, prompt_hash: str) -> str:
+    raw = "\x1f".join((normalize_app_name(app_name), model, repr(float(temperature)), prompt_hash))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class DetectionScriptCache:
+    """SQLite-backed script store with TTL and hit/miss counters (thread-safe)."""
+
+    def __init__(self, path: str, ttl: float = DETECTION_CACHE_TTL,
+                 clock: Callable[[], float] = time.time):
+        self.path = path
+        self.ttl = ttl
+        self._clock = clock
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, app_name: str, model: str, temperature: float, prompt_hash: str) -> Optional[str]:
+        key = detection_cache_key(app_name, model, temperature, prompt_hash)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT script, created_at FROM detection_scripts WHERE cache_key = ?", (key,)
+            ).fetchone()
+            if row is not None and row[1] + self.ttl > self._clock():
+                self.hits += 1
+                return row[0]
+            self.misses += 1
+            if row is not None:
+                self._conn.execute("DELETE FROM detection_scripts WHERE cache_key = ?", (key,))
+        return None
+
+    def put(self, app_name: str, model: str, temperature: float, prompt_hash: str, script: str) -> None:
+        key = detection_cache_key(app_name, model, temperature, prompt_hash)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO detection_scripts VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, normalize_app_name(app_name), model, float(temperature), prompt_hash,
+                 script, self._clock()),
+            )
+
+    def get_or_generate(
+        self,
+        app_name: str,
+        generate: Callable[[], str],
+        *,
+        model: str,
+        temperature: float,
+        prompt_hash: str,
+    ) -> str:
+        """Return the cached script, or call *generate* and cache its result."""
+        script = self.get(app_name, model, temperature, prompt_hash)
+        if script is None:
+            script = generate()
+            self.put(app_name, model, temperature, prompt_hash, script)
+        return script
+
+    def invalidate(self, app_name: Optional[str] = None) -> int:
+        """Drop every cached script for *app_name* (all apps if None); returns the count."""
+        with self._lock:
+            if app_name is None:
+                cur = self._conn.execute("DELETE FROM detection_scripts")
+            else:
+                cur = self._conn.execute("DELETE FROM detection_scripts WHERE app_name = ?",
+                                         (normalize_app_name(app_name),))
+            return cur.rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM detection_scripts").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_cache: Optional[DetectionScriptCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_detection_cache() -> Optional[DetectionScriptCache]:
+    """Return the process-wide script cache, or None when DETECTION_CACHE_PATH is empty."""
+    global _cache
+    if DETECTION_CACHE_PATH and _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = DetectionScriptCache(DETECTION_CACHE_PATH)
+    return _cache
@@ -0,0 +1,172 @@
+"""
+Deterministic detection scripts built from winget manifest data.
+
+Most apps are detected the same way: their uninstall registry key, an
+Apps & Features DisplayName, or the main executable under ProgramFiles.
+When the local winget index (see ``winget_index.py``) knows an app's
+ProductCode, DisplayName or install location, the script is rendered from a
+template here instead of asking the LLM, so it costs no network round trip
+and is the same every time.  ``ai_detection`` only falls back to the LLM
+when :func:`template_detection_script` returns None.
+
+Templates, most specific first:
+
+1. ``product_code``  the uninstall key ``...\\Uninstall\\<ProductCode>`` exists
+2. ``file``          the launch executable exists under its install location
+3. ``display_name``  an uninstall entry's DisplayName equals a manifest
+                     Apps & Features name (case-insensitive)
+
+Apps whose manifests carry none of these are left to the LLM; the package
+name alone is never used, because "Git" would also match "GitHub Desktop".
+
+Configuration
+-------------
+DETECTION_TEMPLATES     Set to ``false`` to always use the LLM (default ``true``).
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from .winget_index import get_winget_index
+
+logger = logging.getLogger(__name__)
+
+DETECTION_TEMPLATES = os.environ.get("DETECTION_TEMPLATES", "true").lower() == "true"
+
+_UNINSTALL_ROOTS = (
+    r"HKLM:\Software\Microsoft\Windows\CurrentVersion\Uninstall",
+    r"HKLM:\Software\Wow6432Node\Microsoft\Windows\CurrentVersion\Uninstall",
+)
+
+_PRODUCT_CODE_TEMPLATE = """\
+$codes = @({codes})
+$roots = @({roots})
+foreach ($root in $roots) {{
+    foreach ($code in $codes) {{
+        $entry = Get-ItemProperty -LiteralPath (Join-Path $root $code) -ErrorAction SilentlyContinue
+        if ($entry) {{
+            Write-Output "$($entry.DisplayName) $($entry.DisplayVersion) detected"
+            exit 0
+        }}
+    }}
+}}
+exit 1"""
+
+_FILE_TEMPLATE = """\
+$paths = @({paths})
+foreach ($path in $paths) {{
+    $path = [Environment]::ExpandEnvironmentVariables($path)
+    if (Test-Path -LiteralPath $path -PathType Leaf) {{
+        Write-Output "$path $((Get-Item -LiteralPath $path).VersionInfo.ProductVersion) detected"
+        exit 0
+    }}
+}}
+exit 1"""
+
+_DISPLAY_NAME_TEMPLATE = """\
+$names = @({names})
+$roots = @({roots})
+$entry = Get-ChildItem -LiteralPath $roots -ErrorAction SilentlyContinue |
+    Get-ItemProperty -ErrorAction SilentlyContinue |
+    Where-Object {{
+        $displayName = $_.DisplayName
+        $displayName -and ($names | Where-Object {{ [string]::Equals($displayName, $_, [StringComparison]::OrdinalIgnoreCase) }})
+    }} |
+    Select-Object -First 1
+if ($entry) {{
+    Write-Output "$($entry.DisplayName) $($entry.DisplayVersion) detected"
+    exit 0
+}}
+exit 1"""
+
+
+def _ps_list(values: List[str]) -> str:
+    """A PowerShell array literal of single-quoted (non-expanding) strings."""
+    return ", ".join("'" + value.replace("'", "''") + "'" for value in values)
+
+
+def _executable_paths(installers: List[Dict[str, Any]]) -> List[str]:
+    paths: List[str] = []
+    for installer in installers:
+        location = installer.get("install_location")
+        if not location:
+            continue
+        locations = [location]
+        # The manifest names the native location; 32-bit builds land in ProgramFiles(x86)
+        if "%ProgramFiles%" in location:
+            locations.append(location.replace("%ProgramFiles%", "%ProgramFiles(x86)%"))
+        for base in locations:
+            for relative in installer.get("files") or []:
+                paths.append(base.rstrip("\\/") + "\\" + relative.lstrip("\\/"))
+    return list(dict.fromkeys(paths))
+
+
+def render_detection_script(package: Dict[str, Any]) -> Optional[Tuple[str, str]]:
+    """
+    Render a detection script from a winget index record.
+
+    Returns ``(template, script)`` or None when the record carries nothing
+    to detect the app by.
+    """
+    installers = package.get("installers") or []
+    roots = _ps_list(list(_UNINSTALL_ROOTS))
+
+    codes = list(dict.fromkeys(c for i in installers for c in i.get("product_codes") or []))
+    if codes:
+        return "product_code", _PRODUCT_CODE_TEMPLATE.format(codes=_ps_list(codes), roots=roots)
+
+    paths = _executable_paths(installers)
+    if paths:
+        return "file", _FILE_TEMPLATE.format(paths=_ps_list(paths))
+
+    names = list(dict.fromkeys(n for i in installers for n in i.get("display_names") or []))
+    if names:
+        return "display_name", _DISPLAY_NAME_TEMPLATE.format(names=_ps_list(names), roots=roots)
+    return None
+
+
+def find_package(app_name: str, package_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Look *package_id*, or else the exact name or ID *app_name*, up in the
+    local winget index.  Fuzzy matches are not used: a script for the wrong
+    app is worse than an LLM call.
+    """
+    index = get_winget_index()
+    if index is None:
+        return None
+    if package_id:
+        return index.get(package_id)
+
+    wanted = " ".join(app_name.casefold().split())
+    for result in index.search(app_name, limit=10, fuzzy=False):
+        if wanted in (result["Name"].casefold(), result["Id"].casefold()):
+            return index.get(result["Id"])
+    return None
+
+
+def template_detection_script(app_name: str, package_id: Optional[str] = None) -> Optional[str]:
+    """
+    Build a detection script for *app_name* without the LLM.
+
+    Returns None when templates are disabled, no winget index is configured,
+    the app is not in the index, or its manifests carry no detection data.
+    """
+    if not DETECTION_TEMPLATES:
+        return None
+    try:
+        record = find_package(app_name, package_id)
+    except Exception as exc:
+        # The LLM path still works without the index
+        logger.warning("Winget index lookup failed for '%s': %s", app_name, exc)
+        return None
+    if record is None:
+        return None
+    rendered = render_detection_script(record)
+    if rendered is None:
+        return None
+    template, script = rendered
+    logger.debug("Detection script for '%s' rendered from the %s template", app_name, template)
+    return script
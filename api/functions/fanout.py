@@ -0,0 +1,85 @@
+"""
+Push one package to many tenants in parallel.
+
+The package is parsed once by the caller; :func:`deploy_to_tenants` then runs
+the per-tenant Graph/Azure upload sequence concurrently, each inside
+``use_tenant`` so Graph calls authenticate against the right tenant, and
+collects one result per tenant.  A failure in one tenant does not stop the
+others.
+
+Concurrency is bounded twice: at most FANOUT_MAX_PARALLEL tenants are worked
+on per fan-out, and each tenant additionally holds one of its
+TENANT_MAX_CONCURRENT_DEPLOYS slots (see ``tenants.py``) so overlapping
+jobs cannot pile onto the same tenant and get throttled.
+
+Configuration
+-------------
+FANOUT_MAX_PARALLEL     Tenants deployed to at once per fan-out (default 4).
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from .tenants import tenant_deploy_slot, use_tenant
+
+logger = logging.getLogger(__name__)
+
+FANOUT_MAX_PARALLEL = int(os.environ.get("FANOUT_MAX_PARALLEL", 4))
+
+RESULT_SUCCEEDED = "succeeded"
+RESULT_FAILED = "failed"
+
+
+def deploy_to_tenants(
+    tenants: List[str],
+    deploy: Callable[[Callable[[str], None]], Any],
+    *,
+    max_parallel: Optional[int] = None,
+    on_stage: Optional[Callable[[str], None]] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Call ``deploy(report)`` once per tenant, concurrently, and aggregate the results.
+
+    Parameters
+    ----------
+    tenants : list of str
+        Tenant profile names; duplicates are deployed to once.
+    deploy : callable
+        Runs the upload for the tenant selected by the surrounding
+        ``use_tenant`` block and returns its result (e.g. the Intune app ID).
+        It receives a ``report(stage)`` callback.
+    max_parallel : int, optional
+        Tenants worked on at once; defaults to FANOUT_MAX_PARALLEL.
+    on_stage : callable, optional
+        Receives ``"<tenant>: <stage>"`` as each tenant progresses.
+
+    Returns
+    -------
+    dict
+        ``{tenant: {"status": "succeeded", "result": ...}}`` or
+        ``{tenant: {"status": "failed", "error": "..."}}`` for every tenant.
+    """
+    tenants = list(dict.fromkeys(tenants))
+    results: Dict[str, Dict[str, Any]] = {}
+
+    def _one(tenant: str) -> None:
+        def report(stage: str) -> None:
+            if on_stage:
+                on_stage(f"{tenant}: {stage}")
+
+        try:
+            with tenant_deploy_slot(tenant), use_tenant(tenant):
+                results[tenant] = {"status": RESULT_SUCCEEDED, "result": deploy(report)}
+        except Exception as exc:
+            logger.error("Deployment to tenant '%s' failed: %s", tenant, exc, exc_info=True)
+            results[tenant] = {"status": RESULT_FAILED, "error": str(exc)}
+            report("failed")
+
+    workers = max(1, min(max_parallel or FANOUT_MAX_PARALLEL, len(tenants) or 1))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fanout") as pool:
+        list(pool.map(_one, tenants))
+    return {tenant: results[tenant] for tenant in tenants}
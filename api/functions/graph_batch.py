@@ -0,0 +1,503 @@
+"""
+JSON batching for Microsoft Graph control-plane calls.
+
+Graph's ``$batch`` endpoint takes up to 20 requests in one POST.  A deploy
+spends most of its Graph calls polling (storage URI, commit, publish), and
+with 50 deploys in flight those polls are 50 separate GETs every tick, each
+counted against the tenant's throttling budget.  This module provides:
+
+* :func:`send_batch` / :func:`send_batch_async` – send any number of
+  :class:`BatchRequest` objects in as few ``$batch`` calls as possible.
+  ``dependsOn`` chains are kept in the same call (Graph requires that) and
+  sub-requests Graph throttled (429/503) are re-sent after their
+  ``Retry-After``.
+* :class:`GraphBatcher` / :class:`AsyncGraphBatcher` – merge the GETs of
+  concurrent pollers (threads or coroutines) into one ``$batch`` per tick.
+  The uploaders poll through :func:`batched_get`.
+* :func:`get_app_statuses`, :func:`assign_apps` and :func:`delete_apps` –
+  bulk operations on many mobileApps.
+
+Requests are grouped per tenant (see ``tenants.use_tenant``) so a batch is
+always sent with the token of the tenant its requests belong to.
+
+Configuration
+-------------
+GRAPH_BATCH_POLLS       Set to "false" to poll with one GET per call (default "true").
+GRAPH_BATCH_WINDOW      Seconds a poll waits for others to join its batch (default 0.25).
+GRAPH_BATCH_RETRIES     Times a throttled sub-request is re-sent (default 3).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from . import graph_client
+from .app_inventory import forget_deleted_apps
+from .graph_client import GraphRequestError, _parse_retry_after
+from .tenants import get_current_tenant, use_tenant
+
+logger = logging.getLogger(__name__)
+
+GRAPH_BATCH_POLLS = os.environ.get("GRAPH_BATCH_POLLS", "true").lower() == "true"
+GRAPH_BATCH_WINDOW = float(os.environ.get("GRAPH_BATCH_WINDOW", 0.25))
+GRAPH_BATCH_RETRIES = int(os.environ.get("GRAPH_BATCH_RETRIES", 3))
+
+# Hard limit of the Graph $batch endpoint
+GRAPH_BATCH_MAX = 20
+
+# Sub-request statuses after which Graph asks clients to slow down
+_THROTTLE_STATUSES = (429, 503)
+# Status of a sub-request skipped because a request it depends on failed
+_FAILED_DEPENDENCY = 424
+# Wait before re-sending throttled sub-requests that carry no Retry-After
+_DEFAULT_RETRY_AFTER = 1.0
+
+
+class BatchRequest:
+    """One sub-request of a ``$batch`` call; *url* is absolute, as for ``graph_request``."""
+
+    def __init__(self, method: str, url: str, *, json: Any = None, headers: Optional[Dict[str, str]] = None,
+                 depends_on: Optional[Iterable[str]] = None, request_id: Optional[str] = None):
+        self.method = method.upper()
+        self.url = url
+        self.json = json
+        self.headers = headers
+        self.depends_on = list(depends_on or [])
+        self.request_id = request_id
+
+    def _copy(self, request_id: str, depends_on: Iterable[str]) -> "BatchRequest":
+        return BatchRequest(self.method, self.url, json=self.json, headers=self.headers,
+                            depends_on=depends_on, request_id=request_id)
+
+
+class BatchResponse:
+    """Status, headers and body of one sub-request."""
+
+    def __init__(self, request: BatchRequest, status: int, body: Any = None,
+                 headers: Optional[Dict[str, str]] = None):
+        self.request = request
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status < 300
+
+    @property
+    def retry_after(self) -> Optional[float]:
+        return _parse_retry_after(self.headers.get("Retry-After") or self.headers.get("retry-after"))
+
+    def error_message(self) -> str:
+        error = self.body.get("error") if isinstance(self.body, dict) else None
+        if isinstance(error, dict) and error.get("message"):
+            return f"{self.status}: {error['message']}"
+        return f"{self.status}: {self.body}" if self.body else str(self.status)
+
+    def result(self) -> Any:
+        """Return the body, or raise :class:`GraphRequestError` like ``graph_request`` would."""
+        if not self.ok:
+            raise GraphRequestError(
+                f"{self.status} Error for url: {self.request.url}\n{self.body}",
+                status_code=self.status,
+                retry_after=self.retry_after,
+                response_text=str(self.body or ""),
+            )
+        return self.body
+
+
+def _split_url(url: str) -> Tuple[str, str]:
+    """
+    Return the Graph root a ``$batch`` call goes to and *url*'s path relative to it.
+
+    URLs under ``GRAPH_BASE`` use it as the root, whatever its depth (e.g. a
+    proxy at ``https://proxy/graph/beta``); other absolute Graph URLs are
+    split after their first path segment (``https://graph.microsoft.com/v1.0``).
+    """
+    base = graph_client.GRAPH_BASE
+    if url.startswith(base + "/") or url.startswith(base + "?"):
+        rest = url[len(base):]
+        return base, rest if rest.startswith("/") else "/" + rest
+    parts = urlsplit(url)
+    version, _, rest = parts.path.lstrip("/").partition("/")
+    return f"{parts.scheme}://{parts.netloc}/{version}", "/" + rest + (f"?{parts.query}" if parts.query else "")
+
+
+def _with_ids(requests: List[BatchRequest]) -> List[BatchRequest]:
+    """Give every request a unique ID (its position unless it brought its own)."""
+    taken = {r.request_id for r in requests if r.request_id is not None}
+    counter = 0
+    result = []
+    for request in requests:
+        if request.request_id is None:
+            counter += 1
+            while str(counter) in taken:
+                counter += 1
+            request = request._copy(str(counter), request.depends_on)
+        result.append(request)
+    ids = [r.request_id for r in result]
+    if len(set(ids)) != len(ids):
+        raise ValueError("Batch request IDs must be unique")
+    return result
+
+
+def _chunks(requests: List[BatchRequest]) -> List[List[BatchRequest]]:
+    """Split *requests* into ``$batch`` calls of at most 20, keeping dependency chains together."""
+    by_id = {r.request_id: r for r in requests}
+    group_of = {r.request_id: r.request_id for r in requests}
+
+    def _root(request_id: str) -> str:
+        while group_of[request_id] != request_id:
+            request_id = group_of[request_id]
+        return request_id
+
+    for request in requests:
+        for dependency in request.depends_on:
+            if dependency not in by_id:
+                raise ValueError(f"Request {request.request_id} depends on unknown request {dependency}")
+            if _split_url(by_id[dependency].url)[0] != _split_url(request.url)[0]:
+                raise ValueError("Dependent requests must target the same Graph version")
+            group_of[_root(dependency)] = _root(request.request_id)
+
+    groups: Dict[str, List[BatchRequest]] = {}
+    for request in requests:
+        groups.setdefault(_root(request.request_id), []).append(request)
+
+    chunks: Dict[str, List[List[BatchRequest]]] = {}
+    for group in groups.values():
+        if len(group) > GRAPH_BATCH_MAX:
+            raise ValueError(f"A dependsOn chain may span at most {GRAPH_BATCH_MAX} requests")
+        per_root = chunks.setdefault(_split_url(group[0].url)[0], [[]])
+        if len(per_root[-1]) + len(group) > GRAPH_BATCH_MAX:
+            per_root.append([])
+        per_root[-1].extend(group)
+    return [chunk for per_root in chunks.values() for chunk in per_root if chunk]
+
+
+def _payload(requests: List[BatchRequest]) -> Dict[str, Any]:
+    entries = []
+    for request in requests:
+        entry: Dict[str, Any] = {"id": request.request_id, "method": request.method,
+                                 "url": _split_url(request.url)[1]}
+        headers = dict(request.headers or {})
+        if request.json is not None:
+            entry["body"] = request.json
+            headers.setdefault("Content-Type", "application/json")
+        if headers:
+            entry["headers"] = headers
+        if request.depends_on:
+            entry["dependsOn"] = list(request.depends_on)
+        entries.append(entry)
+    return {"requests": entries}
+
+
+def _batch_call(requests: List[BatchRequest]) -> Tuple[str, str, Dict[str, Any]]:
+    """Return ``(method, url, kwargs)`` for sending *requests*; a lone request is sent as is."""
+    if len(requests) == 1 and not requests[0].depends_on:
+        request = requests[0]
+        return request.method, request.url, {"json": request.json, "headers": request.headers}
+    return "POST", f"{_split_url(requests[0].url)[0]}/$batch", {"json": _payload(requests)}
+
+
+def _parse(requests: List[BatchRequest], data: Any) -> Dict[str, BatchResponse]:
+    if len(requests) == 1 and not requests[0].depends_on:
+        return {requests[0].request_id: BatchResponse(requests[0], 200 if data is not None else 204, data)}
+    received = {str(entry.get("id")): entry for entry in (data or {}).get("responses", [])}
+    responses = {}
+    for request in requests:
+        entry = received.get(request.request_id)
+        if entry is None:
+            responses[request.request_id] = BatchResponse(request, 500, {"error": {
+                "message": "Missing from the $batch response"}})
+        else:
+            responses[request.request_id] = BatchResponse(
+                request, int(entry.get("status", 500)), entry.get("body"), entry.get("headers"))
+    return responses
+
+
+def _failed_call(requests: List[BatchRequest], exc: GraphRequestError) -> Dict[str, BatchResponse]:
+    """The whole call failed (e.g. the batch itself was throttled); so did every request in it."""
+    headers = {"Retry-After": str(exc.retry_after)} if exc.retry_after is not None else {}
+    return {r.request_id: BatchResponse(r, exc.status_code, exc.response_text, headers) for r in requests}
+
+
+def _retry_plan(pending: List[BatchRequest], responses: Dict[str, BatchResponse]
+                ) -> Tuple[List[BatchRequest], float]:
+    """Return the requests to re-send (throttled ones and their skipped dependents) and the wait."""
+    retry = {r.request_id for r in pending if responses[r.request_id].status in _THROTTLE_STATUSES}
+    if not retry:
+        return [], 0.0
+    waits = [responses[i].retry_after for i in retry]
+    wait = max(_DEFAULT_RETRY_AFTER if w is None else w for w in waits)
+    changed = True
+    while changed:
+        changed = False
+        for request in pending:
+            if (request.request_id not in retry and responses[request.request_id].status == _FAILED_DEPENDENCY
+                    and any(dep in retry for dep in request.depends_on)):
+                retry.add(request.request_id)
+                changed = True
+    # Dependencies that already succeeded are not sent again
+    return [r._copy(r.request_id, [d for d in r.depends_on if d in retry])
+            for r in pending if r.request_id in retry], wait
+
+
+def send_batch(requests: List[BatchRequest], *, retries: Optional[int] = None,
+               send: Optional[Callable[..., Any]] = None) -> List[BatchResponse]:
+    """
+    Send *requests* via ``$batch`` (at most 20 per call) and return their responses in order.
+
+    Sub-request failures are reported in the responses, not raised; see
+    :meth:`BatchResponse.result`.  Throttled sub-requests are re-sent up to
+    *retries* times (GRAPH_BATCH_RETRIES).
+
+    Raises
+    ------
+    ValueError
+        If a ``dependsOn`` reference is unknown or a chain exceeds 20 requests.
+    """
+    send = send or graph_client.graph_request
+    retries = GRAPH_BATCH_RETRIES if retries is None else retries
+    requests = _with_ids(requests)
+    results: Dict[str, BatchResponse] = {}
+    for chunk in _chunks(requests):
+        pending = chunk
+        for attempt in range(retries + 1):
+            method, url, kwargs = _batch_call(pending)
+            try:
+                responses = _parse(pending, send(method, url, **kwargs))
+            except GraphRequestError as exc:
+                responses = _failed_call(pending, exc)
+            results.update(responses)
+            pending, wait = _retry_plan(pending, responses)
+            if not pending or attempt == retries:
+                break
+            logger.warning("%s batched Graph requests throttled; retrying in %.1fs", len(pending), wait)
+            time.sleep(wait)
+    return [results[r.request_id] for r in requests]
+
+
+async def send_batch_async(requests: List[BatchRequest], *, send: Callable[..., Awaitable[Any]],
+                           retries: Optional[int] = None) -> List[BatchResponse]:
+    """Asyncio variant of :func:`send_batch`; *send* is e.g. ``graph_request_async``."""
+    retries = GRAPH_BATCH_RETRIES if retries is None else retries
+    requests = _with_ids(requests)
+    results: Dict[str, BatchResponse] = {}
+    for chunk in _chunks(requests):
+        pending = chunk
+        for attempt in range(retries + 1):
+            method, url, kwargs = _batch_call(pending)
+            try:
+                responses = _parse(pending, await send(method, url, **kwargs))
+            except GraphRequestError as exc:
+                responses = _failed_call(pending, exc)
+            results.update(responses)
+            pending, wait = _retry_plan(pending, responses)
+            if not pending or attempt == retries:
+                break
+            logger.warning("%s batched Graph requests throttled; retrying in %.1fs", len(pending), wait)
+            await asyncio.sleep(wait)
+    return [results[r.request_id] for r in requests]
+
+
+def _by_tenant(pending: List[Tuple[Optional[str], BatchRequest, Any]]
+               ) -> Dict[Optional[str], List[Tuple[BatchRequest, Any]]]:
+    groups: Dict[Optional[str], List[Tuple[BatchRequest, Any]]] = {}
+    for tenant, request, future in pending:
+        groups.setdefault(tenant, []).append((request, future))
+    return groups
+
+
+class GraphBatcher:
+    """
+    Merge requests submitted from many threads within *window* seconds into ``$batch`` calls.
+
+    Throttled sub-requests are not retried here: they surface as
+    :class:`GraphRequestError` with ``retry_after`` so the caller's
+    :class:`~.polling.Poller` backs off as it would for a single GET.
+    """
+
+    def __init__(self, window: float = GRAPH_BATCH_WINDOW, send: Optional[Callable[..., Any]] = None):
+        self.window = window
+        self._send = send
+        self._cond = threading.Condition()
+        self._pending: List[Tuple[Optional[str], BatchRequest, Future]] = []
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, request: BatchRequest) -> "Future[BatchResponse]":
+        future: Future = Future()
+        with self._cond:
+            self._pending.append((get_current_tenant(), request, future))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="graph-batcher", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return future
+
+    def request(self, method: str, url: str) -> Any:
+        """Send one request as part of the next batch and return its body (or raise)."""
+        return self.submit(BatchRequest(method, url)).result().result()
+
+    def _loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                deadline = time.monotonic() + self.window
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                pending, self._pending = self._pending, []
+            for tenant, group in _by_tenant(pending).items():
+                self._flush(tenant, group)
+
+    def _flush(self, tenant: Optional[str], group: List[Tuple[BatchRequest, Future]]) -> None:
+        try:
+            with use_tenant(tenant):
+                responses = send_batch([request for request, _ in group], retries=0, send=self._send)
+        except Exception as exc:
+            for _, future in group:
+                future.set_exception(exc)
+            return
+        for (_, future), response in zip(group, responses):
+            future.set_result(response)
+
+
+class AsyncGraphBatcher:
+    """:class:`GraphBatcher` for coroutines on one event loop; *send* is an async request function."""
+
+    def __init__(self, send: Callable[..., Awaitable[Any]], window: float = GRAPH_BATCH_WINDOW):
+        self.window = window
+        self._send = send
+        self._pending: List[Tuple[Optional[str], BatchRequest, "asyncio.Future"]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()
+
+    async def request(self, method: str, url: str) -> Any:
+        """Send one request as part of the next batch and return its body (or raise)."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((get_current_tenant(), BatchRequest(method, url), future))
+        if self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return (await future).result()
+
+    def _flush(self) -> None:
+        self._timer = None
+        pending, self._pending = self._pending, []
+        loop = asyncio.get_running_loop()
+        for tenant, group in _by_tenant(pending).items():
+            task = loop.create_task(self._send_group(tenant, group))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send_group(self, tenant: Optional[str], group: List[Tuple[BatchRequest, "asyncio.Future"]]) -> None:
+        try:
+            with use_tenant(tenant):
+                responses = await send_batch_async([request for request, _ in group], send=self._send, retries=0)
+        except Exception as exc:
+            for _, future in group:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        for (_, future), response in zip(group, responses):
+            if not future.done():  # the poller may have been cancelled meanwhile
+                future.set_result(response)
+
+
+_batcher: Optional[GraphBatcher] = None
+_batcher_lock = threading.Lock()
+
+
+def get_poll_batcher() -> GraphBatcher:
+    """Return the process-wide batcher used by the uploaders' pollers."""
+    global _batcher
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                _batcher = GraphBatcher()
+    return _batcher
+
+
+def batched_get(url: str) -> Any:
+    """GET *url*, merged with concurrent polls into one ``$batch`` unless GRAPH_BATCH_POLLS is off."""
+    if not GRAPH_BATCH_POLLS:
+        return graph_client.graph_request("GET", url)
+    return get_poll_batcher().request("GET", url)
+
+
+# --------------------------------------------------------------------------------------
+# Bulk operations on mobileApps
+# --------------------------------------------------------------------------------------
+
+_STATUS_FIELDS = "id,displayName,publishingState,committedContentVersion,lastModifiedDateTime"
+
+
+def _app_url(app_id: str, suffix: str = "") -> str:
+    return f"{graph_client.GRAPH_BASE}/deviceAppManagement/mobileApps/{app_id}{suffix}"
+
+
+def _bulk(requests: Dict[str, BatchRequest]) -> Tuple[Dict[str, BatchResponse], Dict[str, str]]:
+    """Send one request per app; return the successful responses and error messages by app ID."""
+    app_ids = list(requests)
+    ok, failed = {}, {}
+    for app_id, response in zip(app_ids, send_batch([requests[a] for a in app_ids])):
+        if response.ok:
+            ok[app_id] = response
+        else:
+            failed[app_id] = response.error_message()
+    return ok, failed
+
+
+def assignment_target(target: str) -> Dict[str, str]:
+    """Graph assignment target for ``"allDevices"``, ``"allUsers"`` or an Entra group ID."""
+    if target == "allDevices":
+        return {"@odata.type": "#microsoft.graph.allDevicesAssignmentTarget"}
+    if target == "allUsers":
+        return {"@odata.type": "#microsoft.graph.allLicensedUsersAssignmentTarget"}
+    return {"@odata.type": "#microsoft.graph.groupAssignmentTarget", "groupId": target}
+
+
+def get_app_statuses(app_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Publishing state of many apps in as few Graph calls as possible.
+
+    Returns ``{"apps": {id: {...}}, "failed": {id: "reason"}}``; apps that do
+    not exist are reported under ``failed``.
+    """
+    ok, failed = _bulk({a: BatchRequest("GET", _app_url(a, f"?$select={_STATUS_FIELDS}"))
+                        for a in dict.fromkeys(app_ids)})
+    return {"apps": {a: response.body for a, response in ok.items()}, "failed": failed}
+
+
+def assign_apps(app_ids: List[str], targets: List[str], intent: str = "required") -> Dict[str, Any]:
+    """
+    Assign every app in *app_ids* to *targets* (see :func:`assignment_target`) with *intent*.
+
+    Uses the ``assign`` action, which replaces the app's existing assignments.
+    Returns ``{"assigned": [ids], "failed": {id: "reason"}}``.
+    """
+    body = {"mobileAppAssignments": [
+        {"@odata.type": "#microsoft.graph.mobileAppAssignment", "intent": intent,
+         "target": assignment_target(target)}
+        for target in targets
+    ]}
+    ok, failed = _bulk({a: BatchRequest("POST", _app_url(a, "/assign"), json=body)
+                        for a in dict.fromkeys(app_ids)})
+    return {"assigned": list(ok), "failed": failed}
+
+
+def delete_apps(app_ids: List[str]) -> Dict[str, Any]:
+    """Delete many apps; returns ``{"deleted": [ids], "failed": {id: "reason"}}``."""
+    ok, failed = _bulk({a: BatchRequest("DELETE", _app_url(a)) for a in dict.fromkeys(app_ids)})
+    forget_deleted_apps(ok)
+    return {"deleted": list(ok), "failed": failed}
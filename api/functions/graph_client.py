@@ -0,0 +1,252 @@
+"""
+Shared, pooled HTTP client for Microsoft Graph.
+
+The uploader modules used to call ``requests.request`` for every Graph call,
+paying a fresh TCP + TLS handshake each time – including every iteration of
+the commit/publish polling loops.  This module keeps one process-wide client
+with a keep-alive connection pool and records per-endpoint latency so slow
+Graph calls can be spotted.
+
+When ``httpx`` and ``h2`` are installed the client speaks HTTP/2 (one
+multiplexed connection serves every concurrent deploy); otherwise it falls
+back to a pooled ``requests.Session``.
+
+Configuration
+-------------
+GRAPH_BASE              Graph root URL used by the uploaders (default
+                        ``https://graph.microsoft.com/beta``); point it at a
+                        local emulator for benchmarks.
+GRAPH_POOL_SIZE         Maximum pooled connections (default 10).
+GRAPH_CONNECT_TIMEOUT   Connect timeout in seconds (default 10).
+GRAPH_READ_TIMEOUT      Read timeout in seconds (default 60).
+GRAPH_HTTP2             Set to "false" to force HTTP/1.1 (default "true").
+"""
+
+from __future__ import annotations
+
+import importlib.util
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .auth import get_auth_headers
+from .metrics import GRAPH_REQUEST_SECONDS, GRAPH_REQUESTS, status_label
+
+logger = logging.getLogger(__name__)
+
+GRAPH_BASE = os.environ.get("GRAPH_BASE", "https://graph.microsoft.com/beta").rstrip("/")
+GRAPH_POOL_SIZE = int(os.environ.get("GRAPH_POOL_SIZE", 10))
+GRAPH_CONNECT_TIMEOUT = float(os.environ.get("GRAPH_CONNECT_TIMEOUT", 10))
+GRAPH_READ_TIMEOUT = float(os.environ.get("GRAPH_READ_TIMEOUT", 60))
+GRAPH_HTTP2 = os.environ.get("GRAPH_HTTP2", "true").lower() == "true"
+
+# GUIDs and other opaque IDs are collapsed so metrics group by endpoint
+_ID_SEGMENT = re.compile(r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$|^\d+$")
+
+
+class GraphRequestError(requests.HTTPError):
+    """Raised when Graph answers with an error status; carries the details."""
+
+    def __init__(self, message: str, status_code: int, retry_after: Optional[float] = None,
+                 response_text: str = ""):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.response_text = response_text
+
+
+def _translate_httpx_error(exc: Exception) -> requests.RequestException:
+    """Map an ``httpx`` transport error onto the equivalent ``requests`` exception.
+
+    Callers catch ``requests.RequestException`` regardless of backend, so the
+    HTTP/2 client must not leak ``httpx`` types.
+    """
+    import httpx
+
+    if isinstance(exc, httpx.ConnectTimeout):
+        error: requests.RequestException = requests.ConnectTimeout(str(exc))
+    elif isinstance(exc, httpx.TimeoutException):
+        error = requests.ReadTimeout(str(exc))
+    elif isinstance(exc, httpx.TransportError):
+        error = requests.ConnectionError(str(exc))
+    else:
+        error = requests.RequestException(str(exc))
+    return error
+
+
+def endpoint_key(method: str, url: str) -> str:
+    """Return ``"METHOD /path/{id}/..."`` for *url* with IDs and query stripped."""
+    path = urlparse(url).path
+    segments = ["{id}" if _ID_SEGMENT.match(seg) else seg for seg in path.split("/")]
+    return f"{method.upper()} {'/'.join(segments)}"
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+class GraphMetrics:
+    """Thread-safe latency/count accumulator keyed by endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data: Dict[str, Dict[str, float]] = {}
+
+    def record(self, method: str, url: str, status: Optional[int], elapsed: float) -> None:
+        key = endpoint_key(method, url)
+        endpoint = key.split(" ", 1)[1]
+        GRAPH_REQUESTS.inc(method=method.upper(), endpoint=endpoint, status=status_label(status))
+        GRAPH_REQUEST_SECONDS.observe(elapsed, method=method.upper(), endpoint=endpoint)
+        with self._lock:
+            entry = self._data.setdefault(key, {
+                "count": 0, "errors": 0, "total_seconds": 0.0,
+                "max_seconds": 0.0, "last_seconds": 0.0,
+            })
+            entry["count"] += 1
+            if status is None or status >= 400:
+                entry["errors"] += 1
+            entry["total_seconds"] += elapsed
+            entry["max_seconds"] = max(entry["max_seconds"], elapsed)
+            entry["last_seconds"] = elapsed
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                key: dict(entry, avg_seconds=entry["total_seconds"] / entry["count"])
+                for key, entry in self._data.items()
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+class GraphClient:
+    """Keep-alive Graph client; one instance is shared by the whole process."""
+
+    def __init__(
+        self,
+        pool_size: int = GRAPH_POOL_SIZE,
+        connect_timeout: float = GRAPH_CONNECT_TIMEOUT,
+        read_timeout: float = GRAPH_READ_TIMEOUT,
+        http2: bool = GRAPH_HTTP2,
+    ):
+        self.timeout = (connect_timeout, read_timeout)
+        self.metrics = GraphMetrics()
+        self._httpx = None
+        self._session: Optional[requests.Session] = None
+
+        if http2 and importlib.util.find_spec("httpx") and importlib.util.find_spec("h2"):
+            import httpx  # optional dependency, imported lazily
+
+            self._httpx = httpx.Client(
+                http2=True,
+                limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            )
+            self.backend = "httpx-http2"
+        else:
+            self._session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            self._session.mount("https://", adapter)
+            self._session.mount("http://", adapter)
+            self.backend = "requests"
+        logger.debug("Graph client using %s backend (pool size %s)", self.backend, pool_size)
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        *,
+        headers: Optional[Dict[str, str]] = None,
+        json: Any = None,
+        params: Optional[Dict[str, Any]] = None,
+    ) -> Any:
+        """Send an authenticated Graph request and return the decoded JSON body (or None)."""
+        req_headers = get_auth_headers()
+        req_headers.update(headers or {})
+        logger.debug("GRAPH %s %s", method, url)
+        if json is not None:
+            try:
+                logger.debug("Payload: %s", _dumps(json)[:1000])
+            except Exception:
+                pass
+
+        start = time.perf_counter()
+        status = None
+        try:
+            if self._httpx is not None:
+                resp = self._request_httpx(method, url, headers=req_headers, json=json, params=params)
+            else:
+                resp = self._session.request(method, url, headers=req_headers, json=json,
+                                             params=params, timeout=self.timeout)
+            status = resp.status_code
+        finally:
+            self.metrics.record(method, url, status, time.perf_counter() - start)
+
+        logger.debug("Response status: %s", resp.status_code)
+        logger.debug("Response snippet: %s", resp.text[:500])
+        if resp.status_code >= 400:
+            # Surface error details from Graph for easier troubleshooting
+            raise GraphRequestError(
+                f"{resp.status_code} Error for url: {url}\n{resp.text}",
+                status_code=resp.status_code,
+                retry_after=_parse_retry_after(resp.headers.get("Retry-After")),
+                response_text=resp.text,
+            )
+        return resp.json() if resp.content else None
+
+    def _request_httpx(self, method: str, url: str, **kwargs):
+        import httpx
+
+        try:
+            return self._httpx.request(method, url, **kwargs)
+        except httpx.RequestError as exc:
+            raise _translate_httpx_error(exc) from exc
+
+    def close(self) -> None:
+        if self._httpx is not None:
+            self._httpx.close()
+        if self._session is not None:
+            self._session.close()
+
+
+def _dumps(payload: Any) -> str:
+    return json.dumps(payload)
+
+
+_client: Optional[GraphClient] = None
+_client_lock = threading.Lock()
+
+
+def get_graph_client() -> GraphClient:
+    """Return the process-wide Graph client, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = GraphClient()
+    return _client
+
+
+def graph_request(method: str, url: str, **kwargs) -> Any:
+    """Shorthand for ``get_graph_client().request(...)``."""
+    return get_graph_client().request(method, url, **kwargs)
+
+
+def get_graph_metrics() -> Dict[str, Dict[str, float]]:
+    """Per-endpoint request counts and latencies since start-up."""
+    return get_graph_client().metrics.snapshot()
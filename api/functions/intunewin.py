@@ -0,0 +1,117 @@
+"""
+Read .intunewin packages without extracting the encrypted payload.
+
+A .intunewin file is a zip archive holding ``Metadata/Detection.xml`` (the
+encryption info Intune needs for the commit) and ``Contents/<file>`` (the
+already-encrypted payload that is uploaded to Azure Blob as-is).  Instead of
+extracting the payload to disk first, :func:`read_intunewin` returns a
+:class:`PayloadMember` that streams blocks straight out of the archive.  The
+IntuneWinAppUtil stores the payload uncompressed, in which case blocks are
+read from a fixed offset inside the .intunewin with no intermediate file.
+"""
+
+from __future__ import annotations
+
+import struct
+import xml.etree.ElementTree as ET
+import zipfile
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, Tuple
+
+DETECTION_XML = "IntuneWinPackage/Metadata/Detection.xml"
+CONTENTS_DIR = "IntuneWinPackage/Contents/"
+
+# Fixed-size part of a zip local file header (see APPNOTE.TXT 4.3.7)
+_LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+_LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+LOCAL_HEADER_SIZE = _LOCAL_HEADER.size
+
+
+def parse_detection_xml(fh: BinaryIO) -> Dict:
+    """Return the encryption metadata stored in a Detection.xml stream."""
+    root = ET.parse(fh).getroot()
+
+    enc = root.find("EncryptionInfo")
+    if enc is None:
+        raise ValueError("EncryptionInfo not found in Detection.xml")
+
+    meta = {
+        "file_name": root.findtext("FileName"),
+        "unencrypted_size": int(root.findtext("UnencryptedContentSize")),
+        "encryption_key": enc.findtext("EncryptionKey"),
+        "iv": enc.findtext("InitializationVector"),
+        "mac": enc.findtext("Mac"),
+        "mac_key": enc.findtext("MacKey"),
+        "profile_identifier": enc.findtext("ProfileIdentifier"),
+        "file_digest": enc.findtext("FileDigest"),
+        "digest_algorithm": enc.findtext("FileDigestAlgorithm") or "SHA256",
+    }
+    if meta["file_name"] is None:
+        raise ValueError("FileName not found in Detection.xml")
+    return meta
+
+
+def local_header_data_offset(header: bytes, header_offset: int) -> int:
+    """Return the offset of a member's data given its 30-byte local file header."""
+    fields = _LOCAL_HEADER.unpack(header[:LOCAL_HEADER_SIZE])
+    if fields[0] != _LOCAL_HEADER_SIGNATURE:
+        raise zipfile.BadZipFile("Bad local file header signature")
+    name_len, extra_len = fields[-2], fields[-1]
+    return header_offset + LOCAL_HEADER_SIZE + name_len + extra_len
+
+
+class PayloadMember:
+    """The encrypted payload inside a .intunewin archive."""
+
+    def __init__(self, archive: Path, info: zipfile.ZipInfo, data_offset: int | None):
+        self.archive = archive
+        self.info = info
+        self.name = info.filename
+        # Size of the encrypted payload as recorded in the central directory
+        self.size = info.file_size
+        # Only set for uncompressed members, which can be read in place
+        self.data_offset = data_offset
+
+    @property
+    def seekable(self) -> bool:
+        return self.data_offset is not None
+
+    def iter_blocks(self, block_size: int) -> Iterator[bytes]:
+        """Yield the payload in *block_size* chunks without touching the disk."""
+        if self.seekable:
+            with open(self.archive, "rb") as fh:
+                fh.seek(self.data_offset)
+                remaining = self.size
+                while remaining > 0:
+                    chunk = fh.read(min(block_size, remaining))
+                    if not chunk:
+                        raise zipfile.BadZipFile(f"Truncated payload member '{self.name}'")
+                    remaining -= len(chunk)
+                    yield chunk
+        else:
+            # Compressed member – fall back to zipfile's streaming decompressor
+            with zipfile.ZipFile(self.archive) as zf, zf.open(self.info) as fh:
+                while chunk := fh.read(block_size):
+                    yield chunk
+
+
+def read_intunewin(intunewin: Path) -> Tuple[Dict, PayloadMember]:
+    """Return encryption metadata + a streaming handle to the *encrypted* payload."""
+    with zipfile.ZipFile(intunewin) as zf:
+        with zf.open(DETECTION_XML) as f:
+            meta = parse_detection_xml(f)
+
+        payload_name = f"{CONTENTS_DIR}{meta['file_name']}"
+        try:
+            info = zf.getinfo(payload_name)
+        except KeyError:
+            raise FileNotFoundError(
+                f"Encrypted content file '{payload_name}' not found in the .intunewin package."
+            ) from None
+
+    data_offset = None
+    if info.compress_type == zipfile.ZIP_STORED and not info.flag_bits & 0x1:
+        with open(intunewin, "rb") as fh:
+            fh.seek(info.header_offset)
+            data_offset = local_header_data_offset(fh.read(LOCAL_HEADER_SIZE), info.header_offset)
+    return meta, PayloadMember(Path(intunewin), info, data_offset)
@@ -0,0 +1,264 @@
+"""
+Process-wide deployment metrics in the Prometheus text format.
+
+The uploaders time each step of a deploy (parse the package, create the app,
+upload the payload, wait for the commit, ...) with :class:`DeployTimer`, and
+the Graph, BackBlaze B2 and Azure Blob clients record request counts,
+latencies and bytes moved.  Everything is exported by ``GET /metrics`` for
+scraping; histograms make slow stages alertable, e.g.::
+
+    histogram_quantile(0.95, sum by (stage, le) (
+        rate(intune_deploy_stage_duration_seconds_bucket[1h])))
+
+The implementation is a small, dependency-free subset of the Prometheus data
+model (counters and histograms with labels); ``prometheus_client`` is not
+required.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Seconds; deploy stages range from a few ms (parse) to many minutes (publish)
+STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+OUTCOME_OK = "ok"
+OUTCOME_ERROR = "error"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """Monotonically increasing value per label set."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Cumulative bucket counts, sum and count per label set."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = REQUEST_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # label values -> [per-bucket counts..., sum, count]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+                    break
+            entry[-2] += value
+            entry[-1] += 1
+
+    def count(self, **labels: str) -> int:
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            return int(entry[-1]) if entry else 0
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            items = sorted((key, list(entry)) for key, entry in self._values.items())
+        for key, entry in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, entry):
+                cumulative += n
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(entry[-2])}")
+            lines.append(f"{self.name}_count{labels} {int(entry[-1])}")
+        return lines
+
+
+class Registry:
+    """Collection of metrics rendered together by ``GET /metrics``."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric already registered: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = REQUEST_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# -- deploy pipeline ---------------------------------------------------------------
+
+DEPLOY_STAGE_SECONDS = registry.histogram(
+    "intune_deploy_stage_duration_seconds", "Duration of one step of an Intune deploy.",
+    ("pipeline", "stage", "outcome"), STAGE_BUCKETS)
+DEPLOY_SECONDS = registry.histogram(
+    "intune_deploy_duration_seconds", "Duration of a whole Intune deploy.",
+    ("pipeline", "outcome"), STAGE_BUCKETS)
+
+# -- outbound requests ---------------------------------------------------------------
+
+GRAPH_REQUESTS = registry.counter(
+    "graph_requests_total", "Microsoft Graph requests by endpoint and HTTP status.",
+    ("method", "endpoint", "status"))
+GRAPH_REQUEST_SECONDS = registry.histogram(
+    "graph_request_duration_seconds", "Microsoft Graph request latency by endpoint.",
+    ("method", "endpoint"))
+B2_REQUESTS = registry.counter(
+    "b2_requests_total", "BackBlaze B2 API requests by call and HTTP status.", ("api", "status"))
+B2_REQUEST_SECONDS = registry.histogram(
+    "b2_request_duration_seconds", "BackBlaze B2 API request latency by call.", ("api",))
+BLOB_REQUESTS = registry.counter(
+    "azure_blob_requests_total", "Azure Blob block/blocklist PUTs by HTTP status.",
+    ("operation", "status"))
+BLOB_REQUEST_SECONDS = registry.histogram(
+    "azure_blob_request_duration_seconds", "Azure Blob PUT latency.", ("operation",))
+
+# -- bytes moved --------------------------------------------------------------------
+
+BLOB_UPLOAD_BYTES = registry.counter(
+    "azure_blob_upload_bytes_total", "Encrypted payload bytes uploaded to Azure Blob.")
+PACKAGE_DOWNLOAD_BYTES = registry.counter(
+    "package_download_bytes_total", "Package bytes downloaded from storage (B2).", ("mode",))
+
+
+def status_label(status: Optional[int]) -> str:
+    """HTTP status as a label value; ``error`` when no response was received."""
+    return str(status) if status is not None else "error"
+
+
+class DeployTimer:
+    """
+    Times the steps of one deploy.
+
+    Each :meth:`span` feeds ``intune_deploy_stage_duration_seconds``;
+    :meth:`finish` records the total and logs one structured line with every
+    step, so a slow deploy shows where its time went.
+    """
+
+    def __init__(self, pipeline: str):
+        self.pipeline = pipeline
+        self.spans: List[Dict[str, object]] = []
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        outcome = OUTCOME_ERROR
+        try:
+            yield
+            outcome = OUTCOME_OK
+        finally:
+            elapsed = time.perf_counter() - start
+            DEPLOY_STAGE_SECONDS.observe(elapsed, pipeline=self.pipeline, stage=stage, outcome=outcome)
+            self.spans.append({"stage": stage, "seconds": round(elapsed, 3), "outcome": outcome})
+            logger.debug("deploy_stage pipeline=%s stage=%s outcome=%s seconds=%.3f",
+                         self.pipeline, stage, outcome, elapsed)
+
+    def finish(self, outcome: str = OUTCOME_OK) -> float:
+        elapsed = time.perf_counter() - self._start
+        DEPLOY_SECONDS.observe(elapsed, pipeline=self.pipeline, outcome=outcome)
+        logger.info("deploy_timings pipeline=%s outcome=%s total=%.3f %s", self.pipeline, outcome, elapsed,
+                    " ".join(f"{s['stage']}={s['seconds']:.3f}" for s in self.spans))
+        return elapsed
+
+    @contextmanager
+    def run(self) -> Iterator["DeployTimer"]:
+        """Call :meth:`finish` with the right outcome when the block exits."""
+        try:
+            yield self
+        except BaseException:
+            self.finish(OUTCOME_ERROR)
+            raise
+        self.finish(OUTCOME_OK)
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    return registry.render()
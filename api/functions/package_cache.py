@@ -0,0 +1,199 @@
+"""
+Content-addressed on-disk cache for .intunewin packages downloaded from BackBlaze.
+
+Pushing one app-library version to several tenants, or redeploying after a
+failed publish, used to download the same package every time.  Entries are
+keyed by the B2 content SHA1 (falling back to the B2 fileId when B2 has no
+verified SHA1), validated against the size/SHA1 from the B2 file listing, and
+evicted least-recently-used once the cache exceeds its size cap.
+
+Fills are atomic: a package is downloaded to a temporary file in the cache
+directory and renamed into place only after its size and SHA1 check out.
+Concurrent deploys of the same package share one download – the first caller
+fills the entry while the others wait for it.
+
+Configuration
+-------------
+PACKAGE_CACHE_DIR        Cache directory; the cache is disabled when unset.
+PACKAGE_CACHE_MAX_BYTES  Size cap in bytes (default 20 GiB).
+"""
+
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import logging
+import os
+import re
+import threading
+import uuid
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+PACKAGE_CACHE_DIR = os.environ.get("PACKAGE_CACHE_DIR")
+PACKAGE_CACHE_MAX_BYTES = int(os.environ.get("PACKAGE_CACHE_MAX_BYTES", 20 * 1024 ** 3))
+
+_SUFFIX = ".intunewin"
+_TMP_PREFIX = ".fill-"
+_UNSAFE_KEY_CHARS = re.compile(r"[^A-Za-z0-9_.-]")
+
+
+class CacheValidationError(ValueError):
+    """A downloaded package did not match the size/SHA1 reported by BackBlaze."""
+
+
+def cache_key(file_id: str, content_sha1: Optional[str] = None) -> str:
+    """Content address for a B2 file: its SHA1 when known, otherwise its fileId."""
+    if content_sha1:
+        return f"sha1-{content_sha1.lower()}"
+    return f"id-{_UNSAFE_KEY_CHARS.sub('_', file_id)}"
+
+
+class PackageCache:
+    """LRU, size-capped package cache rooted at a directory."""
+
+    def __init__(self, root: str | Path, max_bytes: int = PACKAGE_CACHE_MAX_BYTES):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._fill_locks: Dict[str, threading.Lock] = {}
+        self._pins: Dict[str, int] = {}
+        # Remove temporary files left behind by an interrupted fill
+        for stale in self.root.glob(f"{_TMP_PREFIX}*"):
+            with contextlib.suppress(OSError):
+                stale.unlink()
+
+    def path_for(self, key: str) -> Path:
+        return self.root / f"{key}{_SUFFIX}"
+
+    def _valid(self, path: Path, expected_size: Optional[int]) -> bool:
+        try:
+            size = path.stat().st_size
+        except FileNotFoundError:
+            return False
+        return expected_size is None or size == expected_size
+
+    @contextlib.contextmanager
+    def package(
+        self,
+        key: str,
+        download: Callable[[BinaryIO], None],
+        *,
+        expected_size: Optional[int] = None,
+        expected_sha1: Optional[str] = None,
+    ) -> Iterator[Path]:
+        """
+        Yield the path of the cached package *key*, filling it first if needed.
+
+        *download* is called with a writable binary file object and must write
+        the complete package to it.  The entry is pinned while the context is
+        active so eviction cannot remove a package that is being uploaded.
+        """
+        with self._lock:
+            fill_lock = self._fill_locks.setdefault(key, threading.Lock())
+            self._pins[key] = self._pins.get(key, 0) + 1
+        try:
+            path = self.path_for(key)
+            # Single flight: only one thread fills a given key, the rest wait here
+            with fill_lock:
+                if self._valid(path, expected_size):
+                    with self._lock:
+                        self.hits += 1
+                    os.utime(path)  # mtime doubles as the LRU clock
+                    logger.info("Package cache hit: %s", key)
+                else:
+                    with self._lock:
+                        self.misses += 1
+                    logger.info("Package cache miss: %s – downloading", key)
+                    self._fill(path, download, expected_size, expected_sha1)
+            yield path
+        finally:
+            with self._lock:
+                self._pins[key] -= 1
+                if not self._pins[key]:
+                    del self._pins[key]
+            self.evict()
+
+    def _fill(
+        self,
+        path: Path,
+        download: Callable[[BinaryIO], None],
+        expected_size: Optional[int],
+        expected_sha1: Optional[str],
+    ) -> None:
+        tmp = self.root / f"{_TMP_PREFIX}{uuid.uuid4().hex}"
+        try:
+            with open(tmp, "wb") as raw:
+                writer = _HashingWriter(raw)
+                download(writer)
+            if expected_size is not None and writer.size != expected_size:
+                raise CacheValidationError(
+                    f"Downloaded {writer.size} bytes, BackBlaze reported {expected_size}")
+            if expected_sha1 and writer.sha1.hexdigest() != expected_sha1.lower():
+                raise CacheValidationError("Downloaded package SHA1 does not match BackBlaze")
+            self.evict(reserve=writer.size)
+            os.replace(tmp, path)
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                tmp.unlink()
+
+    def evict(self, reserve: int = 0) -> None:
+        """Delete least-recently-used unpinned entries until *reserve* more bytes fit."""
+        with self._lock:
+            entries = []
+            for entry in self.root.glob(f"*{_SUFFIX}"):
+                with contextlib.suppress(FileNotFoundError):
+                    entries.append((entry.stat(), entry))
+            total = sum(st.st_size for st, _ in entries)
+            for st, entry in sorted(entries, key=lambda e: e[0].st_mtime):
+                if total + reserve <= self.max_bytes:
+                    break
+                if entry.name[:-len(_SUFFIX)] in self._pins:
+                    continue
+                with contextlib.suppress(FileNotFoundError):
+                    entry.unlink()
+                    total -= st.st_size
+                    logger.info("Evicted %s from package cache", entry.name)
+
+    def stats(self) -> Dict[str, int]:
+        entries = list(self.root.glob(f"*{_SUFFIX}"))
+        return {
+            "entries": len(entries),
+            "bytes": sum(e.stat().st_size for e in entries if e.exists()),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class _HashingWriter:
+    """File wrapper that tracks size and SHA1 of everything written through it."""
+
+    def __init__(self, fh: BinaryIO):
+        self._fh = fh
+        self.size = 0
+        self.sha1 = hashlib.sha1()
+
+    def write(self, data: bytes) -> int:
+        self.sha1.update(data)
+        self.size += len(data)
+        return self._fh.write(data)
+
+
+_cache: Optional[PackageCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_package_cache() -> Optional[PackageCache]:
+    """Return the process-wide package cache, or None when PACKAGE_CACHE_DIR is unset."""
+    global _cache
+    if PACKAGE_CACHE_DIR and _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = PackageCache(PACKAGE_CACHE_DIR)
+    return _cache
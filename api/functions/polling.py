@@ -0,0 +1,183 @@
+"""
+Adaptive polling for long-running Intune operations.
+
+Intune processes uploads asynchronously, so the uploaders poll Graph until a
+file has a storage URI, a commit has finished or an app has been published.
+A fixed sleep makes small packages wait a full interval for nothing while
+large packages hit Graph at a constant rate.  :class:`Poller` starts with a
+short interval and backs off exponentially (with jitter) up to a ceiling,
+honours ``Retry-After`` on throttled responses, and gives up at an overall
+deadline.  :meth:`Poller.poll_async` is the same loop for the asyncio upload
+engine: a waiting deploy is then an idle coroutine instead of a sleeping thread.
+
+Per-stage poll counts are kept in memory; see :func:`get_poll_stats`.
+
+Configuration
+-------------
+POLL_INITIAL_INTERVAL   First sleep in seconds (default 1).
+POLL_MAX_INTERVAL       Upper bound for the sleep in seconds (default 15).
+POLL_BACKOFF_FACTOR     Multiplier applied after every poll (default 1.5).
+POLL_JITTER             Random +/- fraction applied to each sleep (default 0.1).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+POLL_INITIAL_INTERVAL = float(os.environ.get("POLL_INITIAL_INTERVAL", 1))
+POLL_MAX_INTERVAL = float(os.environ.get("POLL_MAX_INTERVAL", 15))
+POLL_BACKOFF_FACTOR = float(os.environ.get("POLL_BACKOFF_FACTOR", 1.5))
+POLL_JITTER = float(os.environ.get("POLL_JITTER", 0.1))
+
+# Status codes after which Graph asks clients to slow down
+_THROTTLE_STATUSES = (429, 503)
+
+T = TypeVar("T")
+
+_stats_lock = threading.Lock()
+_poll_stats: Dict[str, Dict[str, Any]] = {}
+
+
+def _record(stage: str, polls: int, elapsed: float, completed: bool) -> None:
+    with _stats_lock:
+        entry = _poll_stats.setdefault(stage, {
+            "runs": 0, "timeouts": 0, "polls_total": 0,
+            "last_polls": 0, "last_seconds": 0.0, "max_polls": 0,
+        })
+        entry["runs"] += 1
+        entry["timeouts"] += 0 if completed else 1
+        entry["polls_total"] += polls
+        entry["last_polls"] = polls
+        entry["last_seconds"] = elapsed
+        entry["max_polls"] = max(entry["max_polls"], polls)
+
+
+def get_poll_stats() -> Dict[str, Dict[str, Any]]:
+    """Return poll counts per stage (runs, total/last/max polls, last duration)."""
+    with _stats_lock:
+        return {stage: dict(entry) for stage, entry in _poll_stats.items()}
+
+
+class Poller:
+    """Exponential-backoff poller with jitter, ``Retry-After`` support and a deadline."""
+
+    def __init__(
+        self,
+        initial: float = POLL_INITIAL_INTERVAL,
+        max_interval: float = POLL_MAX_INTERVAL,
+        factor: float = POLL_BACKOFF_FACTOR,
+        jitter: float = POLL_JITTER,
+        deadline: float = 300,
+        sleep: Callable[[float], None] = time.sleep,
+        clock: Callable[[], float] = time.monotonic,
+        async_sleep: Callable[[float], Awaitable[None]] = asyncio.sleep,
+    ):
+        self.initial = initial
+        self.max_interval = max(max_interval, initial)
+        self.factor = factor
+        self.jitter = jitter
+        self.deadline = deadline
+        self._sleep = sleep
+        self._clock = clock
+        self._async_sleep = async_sleep
+
+    def _jittered(self, interval: float) -> float:
+        if not self.jitter:
+            return interval
+        return max(0.0, interval * (1 + random.uniform(-self.jitter, self.jitter)))
+
+    def poll(
+        self,
+        fetch: Callable[[], T],
+        done: Callable[[T], bool],
+        *,
+        stage: str,
+        timeout_message: Optional[str] = None,
+    ) -> T:
+        """
+        Call *fetch* until ``done(result)`` is true and return that result.
+
+        *done* may raise to abort polling (e.g. when Intune reports a failed
+        commit).  Exceptions from *fetch* propagate unless they carry a
+        throttling ``status_code`` (429/503), in which case the poller waits
+        for ``retry_after`` seconds (or the current interval) and tries again.
+
+        Raises
+        ------
+        TimeoutError
+            If the deadline passes before *done* returns true.
+        """
+        start = self._clock()
+        interval = self.initial
+        polls = 0
+        while True:
+            polls += 1
+            try:
+                result = fetch()
+            except Exception as exc:
+                wait = self._throttled(exc, interval, stage, polls, start)
+            else:
+                if self._finished(done, result, stage, polls, start):
+                    return result
+                wait = interval
+            self._sleep(self._next_sleep(wait, stage, polls, start, timeout_message))
+            interval = min(interval * self.factor, self.max_interval)
+
+    async def poll_async(
+        self,
+        fetch: Callable[[], Awaitable[T]],
+        done: Callable[[T], bool],
+        *,
+        stage: str,
+        timeout_message: Optional[str] = None,
+    ) -> T:
+        """Asyncio variant of :meth:`poll`; *fetch* is a coroutine function."""
+        start = self._clock()
+        interval = self.initial
+        polls = 0
+        while True:
+            polls += 1
+            try:
+                result = await fetch()
+            except Exception as exc:
+                wait = self._throttled(exc, interval, stage, polls, start)
+            else:
+                if self._finished(done, result, stage, polls, start):
+                    return result
+                wait = interval
+            await self._async_sleep(self._next_sleep(wait, stage, polls, start, timeout_message))
+            interval = min(interval * self.factor, self.max_interval)
+
+    def _throttled(self, exc: Exception, interval: float, stage: str, polls: int, start: float) -> float:
+        """Return how long to wait after a throttled *fetch*; re-raise any other error."""
+        if getattr(exc, "status_code", None) not in _THROTTLE_STATUSES:
+            _record(stage, polls, self._clock() - start, completed=False)
+            raise exc
+        wait = max(interval, getattr(exc, "retry_after", None) or 0.0)
+        logger.warning("Poll %s for %s throttled; retrying in %.1fs", polls, stage, wait)
+        return wait
+
+    def _finished(self, done: Callable[[T], bool], result: T, stage: str, polls: int, start: float) -> bool:
+        if not done(result):
+            return False
+        elapsed = self._clock() - start
+        _record(stage, polls, elapsed, completed=True)
+        logger.info("Stage %s finished after %s polls in %.1fs", stage, polls, elapsed)
+        return True
+
+    def _next_sleep(self, wait: float, stage: str, polls: int, start: float,
+                    timeout_message: Optional[str]) -> float:
+        """Return the sleep before the next poll, or raise once the deadline has passed."""
+        remaining = self.deadline - (self._clock() - start)
+        if remaining <= 0:
+            _record(stage, polls, self._clock() - start, completed=False)
+            raise TimeoutError(timeout_message or f"Timed out waiting for {stage}")
+        return min(self._jittered(wait), remaining)
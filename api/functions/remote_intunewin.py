@@ -0,0 +1,267 @@
+"""
+Stream a .intunewin package from an HTTP URL (e.g. a BackBlaze download URL)
+straight into Azure Blob without a local copy.
+
+Only the parts of the archive that are actually needed are fetched:
+
+1. The zip central directory (and ``Detection.xml``) are read through
+   :class:`HTTPRangeFile`, a small seekable file object that turns
+   ``zipfile``'s reads into HTTP ``Range`` requests.
+2. The encrypted payload member is then fetched with a single ranged GET and
+   re-chunked into Azure block-sized pieces as bytes arrive, so the download
+   overlaps with the concurrent block upload.
+
+The origin must honour ``Range`` requests (BackBlaze B2 and Azure do).  Every
+GET carries a (connect, read) timeout; a request that stalls or a payload
+stream that breaks part-way is retried from the last byte received.
+
+Configuration
+-------------
+REMOTE_CONNECT_TIMEOUT  Connect timeout in seconds (default 10).
+REMOTE_READ_TIMEOUT     Read timeout in seconds between bytes (default 60).
+REMOTE_RETRIES          Retries per ranged GET after a transient failure
+                        (default 5).
+REMOTE_RETRY_BACKOFF    First retry delay in seconds, doubled per attempt
+                        (default 0.5).
+"""
+
+from __future__ import annotations
+
+import io
+import logging
+import os
+import re
+import time
+import zipfile
+import zlib
+from typing import Dict, Iterator, Optional, Tuple
+
+import requests
+
+from .intunewin import (
+    CONTENTS_DIR,
+    DETECTION_XML,
+    LOCAL_HEADER_SIZE,
+    local_header_data_offset,
+    parse_detection_xml,
+)
+from .metrics import PACKAGE_DOWNLOAD_BYTES
+
+logger = logging.getLogger(__name__)
+
+# zipfile issues many tiny reads; fetch at least this much per request
+_READ_AHEAD = 64 * 1024
+_CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+)")
+
+REMOTE_CONNECT_TIMEOUT = float(os.environ.get("REMOTE_CONNECT_TIMEOUT", 10))
+REMOTE_READ_TIMEOUT = float(os.environ.get("REMOTE_READ_TIMEOUT", 60))
+REMOTE_RETRIES = int(os.environ.get("REMOTE_RETRIES", 5))
+REMOTE_RETRY_BACKOFF = float(os.environ.get("REMOTE_RETRY_BACKOFF", 0.5))
+
+# Failures worth retrying: stalls, resets and streams cut off mid-body
+_TRANSIENT_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+
+
+def _timeout() -> Tuple[float, float]:
+    return (REMOTE_CONNECT_TIMEOUT, REMOTE_READ_TIMEOUT)
+
+
+def _retry_wait(attempt: int, what: str, exc: Exception) -> None:
+    """Sleep before retry *attempt* (1-based), or re-raise *exc* once retries are exhausted."""
+    if attempt > REMOTE_RETRIES:
+        raise exc
+    delay = REMOTE_RETRY_BACKOFF * 2 ** (attempt - 1)
+    logger.warning("%s failed (%s); retry %s/%s in %.1fs", what, exc, attempt, REMOTE_RETRIES, delay)
+    time.sleep(delay)
+
+
+class RangeNotSupportedError(RuntimeError):
+    """The origin ignored the ``Range`` header and returned the whole object."""
+
+
+class HTTPRangeFile(io.RawIOBase):
+    """Read-only, seekable file object backed by HTTP range requests."""
+
+    def __init__(self, url: str, session: Optional[requests.Session] = None,
+                 read_ahead: int = _READ_AHEAD):
+        self.url = url
+        self.session = session or requests.Session()
+        self.read_ahead = read_ahead
+        self.requests = 0
+        self._pos = 0
+        self._buf = b""
+        self._buf_start = 0
+        # Probe the size with a one-byte range request
+        self.size = self._fetch(0, 0)[1]
+
+    def _fetch(self, start: int, end: int) -> Tuple[bytes, int]:
+        """Return bytes ``start..end`` (inclusive) and the total object size."""
+        attempt = 0
+        while True:
+            self.requests += 1
+            try:
+                # Streamed so an origin that ignores Range is caught before the whole object is read
+                with self.session.get(self.url, headers={"Range": f"bytes={start}-{end}"},
+                                      stream=True, timeout=_timeout()) as resp:
+                    if resp.status_code == 200:
+                        raise RangeNotSupportedError(f"Range requests are not supported by {self._safe_url}")
+                    resp.raise_for_status()
+                    match = _CONTENT_RANGE.match(resp.headers.get("Content-Range", ""))
+                    if not match:
+                        raise RangeNotSupportedError(f"Missing Content-Range from {self._safe_url}")
+                    content = resp.content
+                break
+            except _TRANSIENT_ERRORS as exc:
+                attempt += 1
+                _retry_wait(attempt, f"Range GET {start}-{end} of {self._safe_url}", exc)
+        PACKAGE_DOWNLOAD_BYTES.inc(len(content), mode="ranged")
+        return content, int(match.group(3))
+
+    @property
+    def _safe_url(self) -> str:
+        # Never log the download authorization token
+        return self.url.split("?", 1)[0]
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        return self._pos
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self.size - self._pos
+        size = min(size, self.size - self._pos)
+        if size <= 0:
+            return b""
+        buf_end = self._buf_start + len(self._buf)
+        if not (self._buf_start <= self._pos and self._pos + size <= buf_end):
+            end = min(self.size, self._pos + max(size, self.read_ahead)) - 1
+            self._buf, _ = self._fetch(self._pos, end)
+            self._buf_start = self._pos
+        offset = self._pos - self._buf_start
+        data = self._buf[offset:offset + size]
+        self._pos += len(data)
+        return data
+
+    def readinto(self, b) -> int:
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+
+def _rechunk(chunks: Iterator[bytes], block_size: int) -> Iterator[bytes]:
+    """Regroup arbitrarily sized *chunks* into exact *block_size* blocks."""
+    buf = bytearray()
+    for chunk in chunks:
+        buf += chunk
+        while len(buf) >= block_size:
+            yield bytes(buf[:block_size])
+            del buf[:block_size]
+    if buf:
+        yield bytes(buf)
+
+
+def _inflate(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    """Decompress a raw deflate stream (zip method 8) chunk by chunk."""
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    for chunk in chunks:
+        yield decompressor.decompress(chunk)
+    yield decompressor.flush()
+
+
+class RemotePayloadMember:
+    """The encrypted payload of a remote .intunewin, streamed with one ranged GET."""
+
+    def __init__(self, url: str, session: requests.Session, info: zipfile.ZipInfo, data_offset: int):
+        self.url = url
+        self.session = session
+        self.info = info
+        self.name = info.filename
+        # Size of the encrypted payload as recorded in the central directory
+        self.size = info.file_size
+        self.data_offset = data_offset
+        self.bytes_downloaded = 0
+
+    seekable = True
+
+    def _iter_raw(self, chunk_size: int) -> Iterator[bytes]:
+        """Yield the raw member bytes, resuming from the current offset after a broken stream."""
+        end = self.data_offset + self.info.compress_size - 1
+        received = 0
+        attempt = 0
+        while self.data_offset + received <= end:
+            start = self.data_offset + received
+            try:
+                with self.session.get(self.url, headers={"Range": f"bytes={start}-{end}"},
+                                      stream=True, timeout=_timeout()) as resp:
+                    if resp.status_code != 206:
+                        resp.raise_for_status()
+                        raise RangeNotSupportedError("Origin did not return a partial response for the payload")
+                    for chunk in resp.iter_content(chunk_size=chunk_size):
+                        received += len(chunk)
+                        self.bytes_downloaded += len(chunk)
+                        PACKAGE_DOWNLOAD_BYTES.inc(len(chunk), mode="ranged")
+                        attempt = 0
+                        yield chunk
+                if self.data_offset + received <= end:
+                    raise requests.exceptions.ChunkedEncodingError(
+                        f"Payload stream ended after {received} of {self.info.compress_size} bytes"
+                    )
+            except _TRANSIENT_ERRORS as exc:
+                attempt += 1
+                _retry_wait(attempt, f"Payload GET from byte {start}", exc)
+
+    def iter_blocks(self, block_size: int) -> Iterator[bytes]:
+        """Yield the payload in *block_size* blocks as it arrives from the origin."""
+        if self.info.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            raise ValueError(f"Unsupported compression for '{self.name}': {self.info.compress_type}")
+        raw = self._iter_raw(min(block_size, 1024 * 1024))
+        if self.info.compress_type == zipfile.ZIP_DEFLATED:
+            raw = _inflate(raw)
+        yield from _rechunk(raw, block_size)
+
+
+def read_remote_intunewin(
+    url: str, session: Optional[requests.Session] = None,
+) -> Tuple[Dict, RemotePayloadMember]:
+    """
+    Return encryption metadata + a streaming handle to the encrypted payload
+    of the .intunewin at *url*, using only ranged reads.
+    """
+    session = session or requests.Session()
+    remote = HTTPRangeFile(url, session)
+    with zipfile.ZipFile(remote) as zf:
+        with zf.open(DETECTION_XML) as f:
+            meta = parse_detection_xml(f)
+
+        payload_name = f"{CONTENTS_DIR}{meta['file_name']}"
+        try:
+            info = zf.getinfo(payload_name)
+        except KeyError:
+            raise FileNotFoundError(
+                f"Encrypted content file '{payload_name}' not found in the .intunewin package."
+            ) from None
+        if info.flag_bits & 0x1:
+            raise ValueError(f"Encrypted zip members are not supported: '{payload_name}'")
+
+        remote.seek(info.header_offset)
+        data_offset = local_header_data_offset(remote.read(LOCAL_HEADER_SIZE), info.header_offset)
+
+    logger.info("Read .intunewin metadata with %s range requests (archive size %s bytes)",
+                remote.requests, remote.size)
+    return meta, RemotePayloadMember(url, session, info, data_offset)
@@ -0,0 +1,129 @@
+"""
+Async result cache with request coalescing for ``/search``.
+
+Every keystroke in the UI's search box used to run ``winget search`` again.
+Results are now cached per normalised search term with a TTL and an LRU
+bound, and concurrent misses for the same term share one backend lookup:
+the loader runs as its own task that every caller awaits, so a caller that
+disconnects does not cancel the lookup for the others.
+
+Empty results are kept only briefly, because winget failures surface as an
+empty result and must not turn into minutes of cached 404s.
+
+Configuration
+-------------
+SEARCH_CACHE_TTL          Seconds a result stays fresh (default 300).
+SEARCH_CACHE_EMPTY_TTL    Seconds an empty result stays fresh (default 10).
+SEARCH_CACHE_MAX_ENTRIES  Maximum cached search terms (default 512).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import functools
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+SEARCH_CACHE_TTL = float(os.environ.get("SEARCH_CACHE_TTL", 300))
+SEARCH_CACHE_EMPTY_TTL = float(os.environ.get("SEARCH_CACHE_EMPTY_TTL", 10))
+SEARCH_CACHE_MAX_ENTRIES = int(os.environ.get("SEARCH_CACHE_MAX_ENTRIES", 512))
+
+
+def normalize_search_term(term: str) -> str:
+    """Case-fold, unquote and collapse whitespace so equivalent queries share an entry."""
+    return " ".join(term.strip().strip("\"'").lower().split())
+
+
+class AsyncTTLCache:
+    """TTL + LRU cache whose misses are single-flight per key."""
+
+    def __init__(self, max_entries: int = SEARCH_CACHE_MAX_ENTRIES, ttl: float = SEARCH_CACHE_TTL,
+                 empty_ttl: float = SEARCH_CACHE_EMPTY_TTL, clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.empty_ttl = empty_ttl
+        self._clock = clock
+        self._entries: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """Return the cached value for *key*, awaiting ``loader()`` at most once per miss."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > self._clock():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            inflight = asyncio.ensure_future(loader())
+            self._inflight[key] = inflight
+            inflight.add_done_callback(functools.partial(self._loaded, key))
+        # shield: a cancelled caller must not cancel the shared lookup
+        return await asyncio.shield(inflight)
+
+    def _loaded(self, key: Hashable, task: asyncio.Task) -> None:
+        """Store the result of a finished lookup; failed or cancelled lookups are not cached."""
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # exception() also marks the error retrieved when every caller has gone away
+        if not task.cancelled() and task.exception() is None:
+            self._store(key, task.result())
+
+    def peek(self, key: Hashable) -> Optional[Any]:
+        """Return a fresh cached value without loading (counts as a hit), else None."""
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= self._clock():
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """Store a value produced outside :meth:`get_or_load` (e.g. by a streamed search)."""
+        self._store(key, value)
+
+    def _store(self, key: Hashable, value: Any) -> None:
+        ttl = self.ttl if value else self.empty_ttl
+        self._entries[key] = (self._clock() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        """Drop one entry, or everything when *key* is None."""
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "empty_ttl_seconds": self.empty_ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._inflight),
+            "hit_ratio": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
+
+
+search_cache = AsyncTTLCache()
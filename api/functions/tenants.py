@@ -0,0 +1,141 @@
+"""
+Per-tenant Graph credential profiles.
+
+The single-tenant setup reads ``GRAPH_TENANT_ID`` / ``GRAPH_CLIENT_ID`` /
+``GRAPH_CLIENT_SECRET`` from the environment; that profile is always
+available as ``"default"``.  Additional tenants are described in a JSON file
+so one API instance can deploy to many tenants::
+
+    {
+      "contoso":  {"tenant_id": "...", "client_id": "...", "client_secret_env": "CONTOSO_SECRET"},
+      "fabrikam": {"tenant_id": "...", "client_id": "...", "client_secret_env": "FABRIKAM_SECRET"}
+    }
+
+``client_secret_env`` names the environment variable holding the secret so
+secrets stay out of the file (a literal ``client_secret`` is accepted too).
+
+Graph calls pick the tenant from the current context: wrap work for a tenant
+in ``with use_tenant("contoso"):`` and every ``graph_request`` made inside it
+(in the same thread) authenticates against that tenant.
+
+Configuration
+-------------
+GRAPH_TENANTS_FILE          Path of the JSON profile file (optional).
+TENANT_MAX_CONCURRENT_DEPLOYS
+                            Deployments that may run against one tenant at
+                            once, across all jobs (default 2).
+"""
+
+from __future__ import annotations
+
+import contextlib
+import json
+import logging
+import os
+import threading
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TENANT = "default"
+TENANT_MAX_CONCURRENT_DEPLOYS = int(os.environ.get("TENANT_MAX_CONCURRENT_DEPLOYS", 2))
+
+_current_tenant: ContextVar[Optional[str]] = ContextVar("graph_tenant", default=None)
+
+_profiles: Optional[Dict[str, Dict[str, str]]] = None
+_profiles_lock = threading.Lock()
+_deploy_slots: Dict[str, threading.BoundedSemaphore] = {}
+
+
+class UnknownTenantError(KeyError):
+    """No credential profile exists for the requested tenant."""
+
+    def __str__(self) -> str:
+        return f"Unknown tenant profile: {self.args[0]}"
+
+
+def _env_profile() -> Dict[str, str]:
+    return {
+        "client_id": os.environ.get("GRAPH_CLIENT_ID"),
+        "client_secret": os.environ.get("GRAPH_CLIENT_SECRET"),
+        "tenant_id": os.environ.get("GRAPH_TENANT_ID"),
+    }
+
+
+def _load_profiles() -> Dict[str, Dict[str, str]]:
+    profiles: Dict[str, Dict[str, str]] = {}
+    path = os.environ.get("GRAPH_TENANTS_FILE")
+    if path:
+        with open(path, encoding="utf-8") as fh:
+            raw = json.load(fh)
+        for name, entry in raw.items():
+            secret = entry.get("client_secret")
+            if entry.get("client_secret_env"):
+                secret = os.environ.get(entry["client_secret_env"])
+            profiles[name] = {
+                "client_id": entry.get("client_id"),
+                "client_secret": secret,
+                "tenant_id": entry.get("tenant_id"),
+            }
+        logger.info("Loaded %s tenant profile(s) from %s", len(profiles), path)
+    return profiles
+
+
+def _get_profiles() -> Dict[str, Dict[str, str]]:
+    global _profiles
+    if _profiles is None:
+        with _profiles_lock:
+            if _profiles is None:
+                _profiles = _load_profiles()
+    return _profiles
+
+
+def get_tenant_profile(name: Optional[str] = None) -> Dict[str, str]:
+    """Return ``client_id`` / ``client_secret`` / ``tenant_id`` for tenant *name*."""
+    if name is None or name == DEFAULT_TENANT:
+        # Read on every call so changes to the environment (and tests) are honoured
+        return _env_profile()
+    try:
+        return dict(_get_profiles()[name])
+    except KeyError:
+        raise UnknownTenantError(name) from None
+
+
+def list_tenants() -> List[str]:
+    """Names of all configured tenant profiles, ``"default"`` first."""
+    return [DEFAULT_TENANT, *sorted(n for n in _get_profiles() if n != DEFAULT_TENANT)]
+
+
+def reload_profiles() -> None:
+    """Forget the loaded profile file so it is read again on next use."""
+    global _profiles
+    with _profiles_lock:
+        _profiles = None
+
+
+def get_current_tenant() -> Optional[str]:
+    """The tenant Graph calls in this context authenticate against (None = default)."""
+    return _current_tenant.get()
+
+
+@contextlib.contextmanager
+def use_tenant(name: Optional[str]) -> Iterator[None]:
+    """Route Graph calls made inside the block to tenant *name*."""
+    if name not in (None, DEFAULT_TENANT):
+        get_tenant_profile(name)  # fail fast on typos
+    token = _current_tenant.set(None if name == DEFAULT_TENANT else name)
+    try:
+        yield
+    finally:
+        _current_tenant.reset(token)
+
+
+@contextlib.contextmanager
+def tenant_deploy_slot(name: Optional[str]) -> Iterator[None]:
+    """Hold one of the tenant's TENANT_MAX_CONCURRENT_DEPLOYS deploy slots."""
+    key = name or DEFAULT_TENANT
+    with _profiles_lock:
+        slot = _deploy_slots.setdefault(key, threading.BoundedSemaphore(TENANT_MAX_CONCURRENT_DEPLOYS))
+    with slot:
+        yield
@@ -0,0 +1,216 @@
+"""
+Persistent checkpoints that let an interrupted Intune upload resume.
+
+A deploy creates an app shell, a content version and a file placeholder
+before the encrypted payload is PUT to Azure Blob in blocks.  If the upload
+dies half way (a flaky link, a restart) the next attempt used to start over
+with a brand new app, orphaning the first one.  The uploaders now record the
+app, content version and file IDs, the SAS URI and every stored block under a
+key derived from the tenant and the package, so deploying the same package
+again picks up where the last attempt stopped and sends only the missing
+blocks.  A checkpoint is removed once the deploy has been published.
+
+Configuration
+-------------
+UPLOAD_CHECKPOINT_PATH      SQLite file (default ``~/.intune-deployment/upload_checkpoints.sqlite``);
+                            set to an empty string to disable resuming.
+UPLOAD_CHECKPOINT_TTL       Seconds a checkpoint may be resumed (default 2 days).
+UPLOAD_SAS_RENEW_AFTER      Age in seconds after which a stored SAS URI is renewed
+                            before resuming (default 420).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import xml.etree.ElementTree as ET
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import requests
+
+from .blob_uploader import get_uncommitted_blocks
+from .deploy_jobs import STAGE_UPLOADING
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_CHECKPOINT_PATH = os.environ.get(
+    "UPLOAD_CHECKPOINT_PATH",
+    os.path.join(os.path.expanduser("~"), ".intune-deployment", "upload_checkpoints.sqlite"),
+)
+UPLOAD_CHECKPOINT_TTL = float(os.environ.get("UPLOAD_CHECKPOINT_TTL", 2 * 24 * 60 * 60))
+UPLOAD_SAS_RENEW_AFTER = float(os.environ.get("UPLOAD_SAS_RENEW_AFTER", 7 * 60))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS upload_checkpoints (
+    checkpoint_key TEXT PRIMARY KEY,
+    app_id         TEXT NOT NULL,
+    version_id     TEXT NOT NULL,
+    file_id        TEXT NOT NULL,
+    sas_uri        TEXT NOT NULL,
+    sas_issued_at  REAL NOT NULL,
+    stage          TEXT NOT NULL,
+    created_at     REAL NOT NULL,
+    updated_at     REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS upload_blocks (
+    checkpoint_key TEXT NOT NULL,
+    block_id       TEXT NOT NULL,
+    size           INTEGER NOT NULL,
+    PRIMARY KEY (checkpoint_key, block_id)
+);
+"""
+
+
+def checkpoint_key(*parts: Optional[str]) -> str:
+    """Stable key for one package deployed to one tenant, e.g. (pipeline, tenant, package, digest)."""
+    raw = "\x1f".join("" if part is None else str(part) for part in parts)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class UploadCheckpoint:
+    """Where an interrupted upload stopped."""
+
+    def __init__(self, key: str, app_id: str, version_id: str, file_id: str, sas_uri: str,
+                 sas_issued_at: float, stage: str = STAGE_UPLOADING,
+                 blocks: Optional[Dict[str, int]] = None, created_at: float = 0.0,
+                 updated_at: float = 0.0):
+        self.key = key
+        self.app_id = app_id
+        self.version_id = version_id
+        self.file_id = file_id
+        self.sas_uri = sas_uri
+        self.sas_issued_at = sas_issued_at
+        # STAGE_UPLOADING while blocks are stored, STAGE_COMMITTING once the file commit was requested
+        self.stage = stage
+        # block id -> size of the blocks known to be stored on the blob
+        self.blocks: Dict[str, int] = dict(blocks or {})
+        self.created_at = created_at
+        self.updated_at = updated_at
+
+    def sas_expired(self, now: Optional[float] = None) -> bool:
+        return (now if now is not None else time.time()) - self.sas_issued_at >= UPLOAD_SAS_RENEW_AFTER
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "key": self.key,
+            "app_id": self.app_id,
+            "version_id": self.version_id,
+            "file_id": self.file_id,
+            "stage": self.stage,
+            "blocks": len(self.blocks),
+            "bytes": sum(self.blocks.values()),
+            "sas_issued_at": self.sas_issued_at,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+
+class UploadCheckpointStore:
+    """SQLite-backed checkpoint store with TTL (thread-safe)."""
+
+    def __init__(self, path: str, ttl: float = UPLOAD_CHECKPOINT_TTL,
+                 clock: Callable[[], float] = time.time):
+        self.path = path
+        self.ttl = ttl
+        self._clock = clock
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[UploadCheckpoint]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT app_id, version_id, file_id, sas_uri, sas_issued_at, stage, created_at, updated_at "
+                "FROM upload_checkpoints WHERE checkpoint_key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[7] + self.ttl <= self._clock():
+                self._delete(key)
+                return None
+            blocks = dict(self._conn.execute(
+                "SELECT block_id, size FROM upload_blocks WHERE checkpoint_key = ?", (key,)
+            ).fetchall())
+        return UploadCheckpoint(key, *row[:6], blocks=blocks, created_at=row[6], updated_at=row[7])
+
+    def save(self, checkpoint: UploadCheckpoint) -> None:
+        """Insert or update *checkpoint* (its block list is written by :meth:`add_block`)."""
+        now = self._clock()
+        checkpoint.created_at = checkpoint.created_at or now
+        checkpoint.updated_at = now
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO upload_checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (checkpoint.key, checkpoint.app_id, checkpoint.version_id, checkpoint.file_id,
+                 checkpoint.sas_uri, checkpoint.sas_issued_at, checkpoint.stage,
+                 checkpoint.created_at, checkpoint.updated_at),
+            )
+
+    def add_block(self, key: str, block_id: str, size: int) -> None:
+        self.add_blocks(key, [(block_id, size)])
+
+    def add_blocks(self, key: str, blocks: Iterable[Tuple[str, int]]) -> None:
+        """Record several stored ``(block id, size)`` pairs in one transaction."""
+        with self._lock, self._conn:
+            # autocommit connection: open the transaction explicitly; the context commits it
+            self._conn.execute("BEGIN")
+            self._conn.executemany("INSERT OR REPLACE INTO upload_blocks VALUES (?, ?, ?)",
+                                   [(key, block_id, size) for block_id, size in blocks])
+            self._conn.execute("UPDATE upload_checkpoints SET updated_at = ? WHERE checkpoint_key = ?",
+                               (self._clock(), key))
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._delete(key)
+
+    def _delete(self, key: str) -> None:
+        self._conn.execute("DELETE FROM upload_blocks WHERE checkpoint_key = ?", (key,))
+        self._conn.execute("DELETE FROM upload_checkpoints WHERE checkpoint_key = ?", (key,))
+
+    def list(self) -> List[UploadCheckpoint]:
+        with self._lock:
+            keys = [row[0] for row in self._conn.execute(
+                "SELECT checkpoint_key FROM upload_checkpoints ORDER BY updated_at DESC")]
+        return [cp for cp in (self.get(key) for key in keys) if cp is not None]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def staged_blocks(checkpoint: UploadCheckpoint) -> Dict[str, int]:
+    """
+    Blocks of an interrupted upload that are still staged on its blob.
+
+    The blob's own uncommitted block list is authoritative (a block may have
+    been stored after the last checkpoint write); the checkpoint is only
+    trusted when the list cannot be read.
+    """
+    try:
+        with requests.Session() as session:
+            return get_uncommitted_blocks(session, checkpoint.sas_uri)
+    except (requests.RequestException, ET.ParseError) as exc:
+        logger.warning("Could not list the staged blocks (%s); using the %s checkpointed blocks",
+                       exc, len(checkpoint.blocks))
+        return dict(checkpoint.blocks)
+
+
+_store: Optional[UploadCheckpointStore] = None
+_store_lock = threading.Lock()
+
+
+def get_checkpoint_store() -> Optional[UploadCheckpointStore]:
+    """Return the process-wide checkpoint store, or None when UPLOAD_CHECKPOINT_PATH is empty."""
+    global _store
+    if UPLOAD_CHECKPOINT_PATH and _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = UploadCheckpointStore(UPLOAD_CHECKPOINT_PATH)
+    return _store
@@ -1,97 +1,284 @@
+import asyncio
+import logging
+import os
 import subprocess
 import re
-from typing import List, Dict, Any
+import tempfile
+from typing import Any, List, Dict, Iterable, Iterator, Optional
+
+from .winget_index import get_winget_index
+
+logger = logging.getLogger(__name__)
+
+def _winget_command(search_term: str) -> List[str]:
+    # Ensure the search term is quoted if it contains whitespace so that winget
+    # treats it as a single argument (without the user having to type quotes).
+    quoted_term = search_term
+    if " " in search_term and not (search_term.startswith("\"") or search_term.startswith("'")):
+        quoted_term = f'"{search_term}"'
+    return ["powershell", "-Command", f"winget search {quoted_term} --accept-source-agreements"]
+
+def parse_winget_table(lines: Iterable[str]) -> Iterator[Dict[str, str]]:
+    """
+    Parse the fixed-width table printed by ``winget search``, one row at a time.
+
+    Args:
+        lines: Output lines, consumed lazily (e.g. straight from the process pipe)
+
+    Yields:
+        Dict[str, str]: One application per table row with keys "Name", "Id",
+                        "Version", and "Source".
+    """
+    lines = iter(lines)
+
+    # Find the header line containing column names
+    header_line = None
+    for line in lines:
+        # winget draws a progress spinner with carriage returns before the table
+        line = line.rstrip("\r\n").rsplit("\r", 1)[-1]
+        if re.search(r'\bName\b.*\bId\b.*\bVersion\b.*\bSource\b', line, re.IGNORECASE):
+            header_line = line
+            break
+
+    if header_line is None:
+        print("Could not find header line in winget output")
+        return
+
+    # Find column positions from header
+    name_match = re.search(r'\bName\b', header_line, re.IGNORECASE)
+    id_match = re.search(r'\bId\b', header_line, re.IGNORECASE)
+    version_match = re.search(r'\bVersion\b', header_line, re.IGNORECASE)
+    source_match = re.search(r'\bSource\b', header_line, re.IGNORECASE)
+
+    if not all([name_match, id_match, version_match, source_match]):
+        print("Could not find all required column names in header")
+        return
+
+    # Get column start positions
+    name_start = name_match.start()
+    id_start = id_match.start()
+    version_start = version_match.start()
+    source_start = source_match.start()
+
+    # Skip the separator line below the header
+    next(lines, None)
+
+    # Process data lines
+    for line in lines:
+        line = line.rstrip()
+        if not line.strip():
+            continue
+
+        # Extract fields based on column positions
+        name = line[name_start:id_start].strip()
+        id_part = line[id_start:version_start].strip()
+        version = line[version_start:source_start].strip()
+        source = line[source_start:].strip()
+
+        # Only include entries with both name and id
+        if name and id_part:
+            yield {
+                "Name": name,
+                "Id": id_part,
+                "Version": version,
+                "Source": source
+            }
+
+class WingetSearchError(RuntimeError):
+    """``winget search`` could not be run or exited with an error."""
+
+def iter_winget_packages(search_term: str) -> Iterator[Dict[str, str]]:
+    """
+    Search for packages and yield results as they become available.
+
+    When a local catalog index is configured (see ``winget_index.py``) the
+    search is answered from memory; otherwise ``winget search`` is run and
+    its output is parsed while the process is still writing it.
+
+    The exit code is only known once the output is exhausted, so rows may be
+    yielded before a failure is reported; callers that need all-or-nothing
+    results should use :func:`search_winget_packages`.
+
+    Args:
+        search_term (str): The term to search for in winget
+
+    Yields:
+        Dict[str, str]: Applications with keys "Name", "Id", "Version", and "Source".
+
+    Raises:
+        WingetSearchError: after the last row, if winget could not be run or failed
+    """
+    index = get_winget_index()
+    if index is not None:
+        yield from index.search(search_term)
+        return
+
+    # stderr goes to a file: an undrained pipe would block winget (and us) once it fills
+    with tempfile.TemporaryFile(mode="w+", encoding="utf-8", errors="ignore") as stderr:
+        try:
+            # Execute winget search command
+            process = subprocess.Popen(
+                _winget_command(search_term),
+                stdout=subprocess.PIPE,
+                stderr=stderr,
+                text=True,
+                encoding='utf-8',
+                errors='ignore'
+            )
+        except Exception as e:
+            raise WingetSearchError(f"Error searching winget packages: {str(e)}") from e
+
+        completed = False
+        try:
+            with process.stdout:
+                yield from parse_winget_table(process.stdout)
+            completed = True
+        except Exception as e:
+            raise WingetSearchError(f"Error searching winget packages: {str(e)}") from e
+        finally:
+            # Stop winget if the consumer gave up early (e.g. a closed stream)
+            if not completed and process.poll() is None:
+                process.kill()
+            process.wait()
+
+        if process.returncode != 0:
+            stderr.seek(0)
+            raise WingetSearchError(f"Winget search failed with error: {stderr.read().strip()[:500]}")
 
 def search_winget_packages(search_term: str) -> List[Dict[str, str]]:
     """
     Search for packages using winget and return structured JSON data.
-    
+
+    When a local catalog index is configured (see ``winget_index.py``) the
+    search is answered from memory; otherwise ``winget search`` is run.
+
     Args:
         search_term (str): The term to search for in winget
-        
+
     Returns:
         List[Dict[str, str]]: A list of applications, each represented as a dictionary
                               with keys "Name", "Id", "Version", and "Source".
+                              Empty if winget failed.
     """
     try:
-        # Ensure the search term is quoted if it contains whitespace so that winget
-        # treats it as a single argument (without the user having to type quotes).
-        quoted_term = search_term
-        if " " in search_term and not (search_term.startswith("\"") or search_term.startswith("'")):
-            quoted_term = f'"{search_term}"'
-
-        # Execute winget search command
-        result = subprocess.run(
-            ["powershell", "-Command", f"winget search {quoted_term} --accept-source-agreements"],
-            capture_output=True,
-            text=True,
-            encoding='utf-8',
-            errors='ignore'
-        )
-        
-        if result.returncode != 0:
-            print(f"Winget search failed with error: {result.stderr}")
-            return []
-            
-        raw_output = result.stdout
-        if not raw_output:
-            return []
-            
-        # Split output into lines and find the header
-        lines = raw_output.strip().split('\n')
-        header_index = -1
-        
-        # Find the header line containing column names
-        for i, line in enumerate(lines):
-            if re.search(r'\bName\b.*\bId\b.*\bVersion\b.*\bSource\b', line, re.IGNORECASE):
-                header_index = i
-                break
-                
-        if header_index == -1:
-            print("Could not find header line in winget output")
-            return []
-            
-        # Find column positions from header
-        header_line = lines[header_index]
-        name_match = re.search(r'\bName\b', header_line, re.IGNORECASE)
-        id_match = re.search(r'\bId\b', header_line, re.IGNORECASE)
-        version_match = re.search(r'\bVersion\b', header_line, re.IGNORECASE)
-        source_match = re.search(r'\bSource\b', header_line, re.IGNORECASE)
-        
-        if not all([name_match, id_match, version_match, source_match]):
-            print("Could not find all required column names in header")
-            return []
-            
-        # Get column start positions
-        name_start = name_match.start()
-        id_start = id_match.start()
-        version_start = version_match.start()
-        source_start = source_match.start()
-        
-        # Process data lines (skip header and separator)
-        apps = []
-        for line in lines[header_index + 2:]:
-            line = line.rstrip()
-            if not line.strip():
-                continue
-                
-            # Extract fields based on column positions
-            name = line[name_start:id_start].strip()
-            id_part = line[id_start:version_start].strip()
-            version = line[version_start:source_start].strip()
-            source = line[source_start:].strip()
-            
-            # Only include entries with both name and id
-            if name and id_part:
-                apps.append({
-                    "Name": name,
-                    "Id": id_part,
-                    "Version": version,
-                    "Source": source
-                })
-                
-        return apps
-        
-    except Exception as e:
-        print(f"Error searching winget packages: {str(e)}")
+        return list(iter_winget_packages(search_term))
+    except WingetSearchError as e:
+        logger.warning("winget search for '%s' failed: %s", search_term, e)
         return []
+
+# ---------------------------------------------------------------------------
+# Package metadata (latest version, publisher, installers)
+# ---------------------------------------------------------------------------
+
+# Concurrent `winget show` processes when resolving many IDs without an index
+WINGET_RESOLVE_CONCURRENCY = int(os.environ.get("WINGET_RESOLVE_CONCURRENCY", 8))
+
+# winget package identifiers; anything else never reaches the shell
+_PACKAGE_ID = re.compile(r'^[A-Za-z0-9][A-Za-z0-9.+_\-]*$')
+_FOUND_LINE = re.compile(r'^Found (?P<name>.+) \[(?P<id>[^\]]+)\]\s*$')
+_INSTALLER_FIELDS = {
+    "installer type": "type",
+    "installer url": "url",
+    "installer sha256": "sha256",
+    "architecture": "architecture",
+    "scope": "scope",
+}
+
+def parse_winget_show(lines: Iterable[str]) -> Optional[Dict[str, Any]]:
+    """
+    Parse the output of ``winget show --id <id> --exact``.
+
+    Returns:
+        Dict with keys "id", "name", "version", "publisher" and "installers"
+        (a list with the installer winget selected for this machine), or None
+        if no package was found.
+    """
+    package: Optional[Dict[str, Any]] = None
+    installer: Dict[str, Any] = {}
+    in_installer = False
+    for line in lines:
+        line = line.rstrip("\r\n").rsplit("\r", 1)[-1]
+        found = _FOUND_LINE.match(line.strip())
+        if found:
+            package = {"id": found.group("id"), "name": found.group("name"),
+                       "version": None, "publisher": None, "installers": []}
+            continue
+        if package is None or ":" not in line:
+            continue
+        key, value = (part.strip() for part in line.split(":", 1))
+        lowered = key.lower()
+        if not line.startswith(" "):
+            in_installer = lowered == "installer"
+            if lowered == "version":
+                package["version"] = value
+            elif lowered == "publisher":
+                package["publisher"] = value
+        elif in_installer and lowered in _INSTALLER_FIELDS:
+            installer[_INSTALLER_FIELDS[lowered]] = value
+    if package is not None and installer:
+        package["installers"].append(installer)
+    return package
+
+def show_winget_package(package_id: str) -> Dict[str, Any]:
+    """
+    Return the latest version, publisher and installers of one package.
+
+    Answered from the local catalog index when configured, otherwise from
+    ``winget show``.
+
+    Raises:
+        LookupError: if the package does not exist
+        ValueError: if *package_id* is not a valid winget identifier
+        RuntimeError: if winget could not be run
+    """
+    if not _PACKAGE_ID.match(package_id):
+        raise ValueError(f"Invalid package ID: {package_id!r}")
+    index = get_winget_index()
+    if index is not None:
+        record = index.get(package_id)
+        if record is None:
+            raise LookupError(f"Package not found: {package_id}")
+        return {key: record[key] for key in ("id", "name", "version", "publisher", "installers")}
+
+    result = subprocess.run(
+        ["powershell", "-Command",
+         f"winget show --id '{package_id}' --exact --accept-source-agreements"],
+        capture_output=True,
+        text=True,
+        encoding='utf-8',
+        errors='ignore'
+    )
+    package = parse_winget_show(result.stdout.splitlines())
+    if package is None:
+        if result.returncode != 0 and "No package found" not in result.stdout:
+            raise RuntimeError(f"winget show failed: {(result.stderr or result.stdout).strip()[:500]}")
+        raise LookupError(f"Package not found: {package_id}")
+    return package
+
+async def resolve_winget_packages(package_ids: List[str],
+                                  max_concurrency: Optional[int] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Resolve many package IDs at once, at most *max_concurrency* at a time.
+
+    Returns:
+        {"resolved": {id: metadata}, "failed": {id: error message}}; one
+        unknown or failing ID never fails the whole batch.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency or WINGET_RESOLVE_CONCURRENCY)
+    resolved: Dict[str, Any] = {}
+    failed: Dict[str, str] = {}
+
+    async def _one(package_id: str) -> None:
+        async with semaphore:
+            try:
+                resolved[package_id] = await asyncio.to_thread(show_winget_package, package_id)
+            except Exception as e:
+                failed[package_id] = str(e)
+
+    unique_ids = list(dict.fromkeys(package_ids))
+    await asyncio.gather(*(_one(package_id) for package_id in unique_ids))
+    # Report in request order, not completion order
+    return {
+        "resolved": {i: resolved[i] for i in unique_ids if i in resolved},
+        "failed": {i: failed[i] for i in unique_ids if i in failed},
+    }
@@ -0,0 +1,411 @@
+"""
+Local, in-process index of the winget package catalog.
+
+``winget search`` needs a Windows host and costs seconds per query.  This
+module indexes a checkout of the winget-pkgs manifest tree
+(``manifests/<letter>/<Publisher>/<Package>/<Version>/*.yaml``) and answers
+searches from memory in milliseconds, returning the same
+``Name`` / ``Id`` / ``Version`` / ``Source`` dicts as ``winget.py``.
+
+Matching covers Name, Id, Moniker and Tags: exact and prefix matches rank
+first, then substrings, then fuzzy (typo-tolerant) matches on single words.
+Only the latest version of each package is searched.
+
+The index is persisted as a gzip-compressed JSON snapshot that loads in well
+under a second, so API start-up never walks the manifest tree.  A snapshot
+built elsewhere (e.g. in CI) can be shipped on its own.  :meth:`refresh`
+re-reads only the version directories whose manifests changed since the
+snapshot was taken.
+
+Configuration
+-------------
+WINGET_MANIFEST_DIR     Path to the winget-pkgs ``manifests`` directory.
+WINGET_INDEX_FILE       Snapshot path (default ``<manifest dir>/../.winget-index.json.gz``).
+                        The index is used for ``/search`` when either is set.
+
+Build a snapshot from the command line with::
+
+    python -m api.functions.winget_index <manifests dir> <snapshot file>
+"""
+
+from __future__ import annotations
+
+import difflib
+import gzip
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+WINGET_MANIFEST_DIR = os.environ.get("WINGET_MANIFEST_DIR")
+WINGET_INDEX_FILE = os.environ.get("WINGET_INDEX_FILE")
+
+SOURCE_NAME = "winget"
+_SNAPSHOT_FORMAT = 1
+# Compact record layout used in the snapshot (and in memory)
+FIELDS = ("id", "name", "version", "publisher", "moniker", "tags", "description", "installers")
+_ID, _NAME, _VERSION, _PUBLISHER, _MONIKER, _TAGS, _DESCRIPTION, _INSTALLERS = range(len(FIELDS))
+
+_WORD_SPLIT = re.compile(r"[^0-9a-z]+")
+_VERSION_SPLIT = re.compile(r"[.\-_+]")
+
+# Ranking, best first
+_SCORE_EXACT = 0
+_SCORE_PREFIX = 1
+_SCORE_WORD_PREFIX = 2
+_SCORE_SUBSTRING = 3
+_SCORE_FUZZY = 4
+
+
+def version_key(version: str) -> Tuple:
+    """Sort key for winget versions: numeric parts numerically, the rest as text."""
+    return tuple((1, int(p), "") if p.isdigit() else (0, 0, p.lower())
+                 for p in _VERSION_SPLIT.split(str(version)) if p)
+
+
+def _yaml_loader():
+    import yaml  # only needed when (re)building from manifests
+    # The base loader keeps every scalar a string, so version 1.10 does not become 1.1
+    return getattr(yaml, "CBaseLoader", yaml.BaseLoader), yaml
+
+
+def parse_version_dir(path: str) -> Optional[List[Any]]:
+    """Merge the manifests of one package version directory into a compact record."""
+    loader, yaml = _yaml_loader()
+    merged: Dict[str, Any] = {}
+    default_locale: Dict[str, Any] = {}
+    installer: Dict[str, Any] = {}
+    for entry in os.scandir(path):
+        if not entry.name.endswith(".yaml"):
+            continue
+        with open(entry.path, "rb") as fh:
+            doc = yaml.load(fh, Loader=loader) or {}
+        kind = str(doc.get("ManifestType", "")).lower()
+        if kind == "singleton":
+            merged.update(doc)
+            default_locale.update(doc)
+            installer.update(doc)
+        elif kind == "defaultlocale":
+            default_locale.update(doc)
+        elif kind == "installer":
+            installer.update(doc)
+        elif kind == "version":
+            merged.update(doc)
+    package_id = merged.get("PackageIdentifier") or default_locale.get("PackageIdentifier")
+    if not package_id:
+        return None
+
+    installers = []
+    for item in installer.get("Installers") or []:
+        installers.append({
+            "url": item.get("InstallerUrl"),
+            "architecture": item.get("Architecture"),
+            "type": item.get("InstallerType") or installer.get("InstallerType"),
+            "scope": item.get("Scope") or installer.get("Scope"),
+            "sha256": item.get("InstallerSha256"),
+            **_detection_facts(item, installer),
+        })
+    record: List[Any] = [None] * len(FIELDS)
+    record[_ID] = str(package_id)
+    record[_NAME] = str(default_locale.get("PackageName") or package_id)
+    record[_VERSION] = str(merged.get("PackageVersion") or installer.get("PackageVersion") or "")
+    record[_PUBLISHER] = default_locale.get("Publisher")
+    record[_MONIKER] = default_locale.get("Moniker")
+    record[_TAGS] = [str(t) for t in default_locale.get("Tags") or []]
+    record[_DESCRIPTION] = default_locale.get("ShortDescription")
+    record[_INSTALLERS] = installers
+    return record
+
+
+def _detection_facts(item: Dict[str, Any], root: Dict[str, Any]) -> Dict[str, Any]:
+    """What an installed copy looks like: uninstall key names, ARP display names, install path."""
+    entries = item.get("AppsAndFeaturesEntries") or root.get("AppsAndFeaturesEntries") or []
+    metadata = item.get("InstallationMetadata") or root.get("InstallationMetadata") or {}
+    product_codes = [item.get("ProductCode") or root.get("ProductCode")]
+    product_codes += [entry.get("ProductCode") for entry in entries]
+    return {
+        "product_codes": [str(c) for c in dict.fromkeys(product_codes) if c],
+        "display_names": [str(n) for n in dict.fromkeys(e.get("DisplayName") for e in entries) if n],
+        "install_location": metadata.get("DefaultInstallLocation"),
+        "files": [str(f["RelativeFilePath"]) for f in metadata.get("Files") or []
+                  if f.get("RelativeFilePath") and str(f.get("FileType", "launch")).lower() == "launch"],
+    }
+
+
+def _scan_version_dirs(root: str) -> Dict[str, float]:
+    """Map every version directory (relative to *root*) to the newest mtime of its manifests."""
+    found: Dict[str, float] = {}
+    stack = [root]
+    while stack:
+        current = stack.pop()
+        newest = 0.0
+        has_manifest = False
+        for entry in os.scandir(current):
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(entry.path)
+            elif entry.name.endswith(".yaml"):
+                has_manifest = True
+                newest = max(newest, entry.stat().st_mtime)
+        if has_manifest:
+            found[os.path.relpath(current, root)] = newest
+    return found
+
+
+class WingetIndex:
+    """In-memory search index over the latest version of every winget package."""
+
+    def __init__(self, manifest_dir: Optional[str] = None):
+        self.manifest_dir = manifest_dir
+        # version directory -> (manifest mtime, record)
+        self._dirs: Dict[str, Tuple[float, List[Any]]] = {}
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self.built_at = 0.0
+        self._rebuild_search_structures()
+
+    # -- persistence ---------------------------------------------------------------
+
+    @classmethod
+    def load(cls, snapshot: str, manifest_dir: Optional[str] = None) -> "WingetIndex":
+        """Load an index from a snapshot written by :meth:`save`."""
+        start = time.perf_counter()
+        with gzip.open(snapshot, "rt", encoding="utf-8") as fh:
+            data = json.load(fh)
+        if data.get("format") != _SNAPSHOT_FORMAT or data.get("fields") != list(FIELDS):
+            raise ValueError(f"Unsupported winget index snapshot: {snapshot}")
+        index = cls(manifest_dir or data.get("manifest_dir"))
+        index._dirs = {d: (mtime, record) for d, mtime, record in data["dirs"]}
+        index.built_at = data.get("built_at", 0.0)
+        index._rebuild_search_structures()
+        logger.info("Loaded winget index (%s packages) in %.0f ms",
+                    len(index), (time.perf_counter() - start) * 1000)
+        return index
+
+    def save(self, snapshot: str) -> None:
+        """Atomically write the index to *snapshot*."""
+        with self._lock:
+            data = {
+                "format": _SNAPSHOT_FORMAT,
+                "fields": list(FIELDS),
+                "manifest_dir": self.manifest_dir,
+                "built_at": self.built_at,
+                "dirs": [[d, mtime, record] for d, (mtime, record) in self._dirs.items()],
+            }
+        tmp = f"{snapshot}.tmp-{os.getpid()}"
+        with gzip.open(tmp, "wt", encoding="utf-8", compresslevel=6) as fh:
+            json.dump(data, fh, separators=(",", ":"))
+        os.replace(tmp, snapshot)
+
+    # -- building ------------------------------------------------------------------
+
+    def refresh(self) -> Dict[str, int]:
+        """
+        Bring the index up to date with the manifest directory.
+
+        Only version directories that are new or whose manifests changed are
+        parsed again; directories that disappeared are dropped.
+        """
+        if not self.manifest_dir:
+            raise IndexNotConfiguredError("No manifest directory configured for the winget index "
+                                          "(set WINGET_MANIFEST_DIR)")
+        with self._refresh_lock:
+            return self._refresh()
+
+    def _refresh(self) -> Dict[str, int]:
+        start = time.perf_counter()
+        current = _scan_version_dirs(self.manifest_dir)
+        with self._lock:
+            known = dict(self._dirs)
+        stale = [d for d, mtime in current.items() if d not in known or known[d][0] != mtime]
+        removed = [d for d in known if d not in current]
+
+        updated: Dict[str, Tuple[float, List[Any]]] = {}
+        failed = 0
+        for rel in stale:
+            try:
+                record = parse_version_dir(os.path.join(self.manifest_dir, rel))
+            except Exception as exc:
+                failed += 1
+                logger.warning("Skipping unreadable winget manifest %s: %s", rel, exc)
+                continue
+            if record is not None:
+                updated[rel] = (current[rel], record)
+
+        with self._lock:
+            for rel in removed:
+                self._dirs.pop(rel, None)
+            self._dirs.update(updated)
+            self.built_at = time.time()
+        self._rebuild_search_structures()
+        stats = {"parsed": len(updated), "removed": len(removed), "failed": failed,
+                 "packages": len(self)}
+        logger.info("Refreshed winget index in %.1f s: %s", time.perf_counter() - start, stats)
+        return stats
+
+    def _rebuild_search_structures(self) -> None:
+        with self._lock:
+            records = [record for _, record in self._dirs.values()]
+        latest: Dict[str, List[Any]] = {}
+        for record in records:
+            key = record[_ID].lower()
+            best = latest.get(key)
+            if best is None or version_key(record[_VERSION]) > version_key(best[_VERSION]):
+                latest[key] = record
+        packages = sorted(latest.values(), key=lambda r: r[_NAME].lower())
+
+        # Lower-cased search fields and a word -> packages map for prefix/fuzzy lookups
+        fields: List[Tuple[str, str, str, Tuple[str, ...]]] = []
+        words: Dict[str, List[int]] = {}
+        for i, record in enumerate(packages):
+            name, pid = record[_NAME].lower(), record[_ID].lower()
+            moniker = (record[_MONIKER] or "").lower()
+            tags = tuple(t.lower() for t in record[_TAGS])
+            fields.append((name, pid, moniker, tags))
+            for word in set(_WORD_SPLIT.split(" ".join((name, pid, moniker, *tags)))):
+                if word:
+                    words.setdefault(word, []).append(i)
+        by_id = {record[_ID].lower(): record for record in packages}
+        # Swapped in one assignment so concurrent searches never see a half-built view
+        self._view = (packages, fields, words, list(words), by_id)
+
+    # -- queries -------------------------------------------------------------------
+
+    def __len__(self) -> int:
+        return len(self._view[0])
+
+    def get(self, package_id: str) -> Optional[Dict[str, Any]]:
+        """Full record (latest version) for an exact package ID, case-insensitive."""
+        record = self._view[4].get(package_id.lower())
+        return dict(zip(FIELDS, record)) if record is not None else None
+
+    def _score(self, term: str, fields: Tuple[str, str, str, Tuple[str, ...]]) -> Optional[int]:
+        name, pid, moniker, tags = fields
+        if term in (name, pid, moniker) or term in tags:
+            return _SCORE_EXACT
+        if name.startswith(term) or pid.startswith(term) or moniker.startswith(term):
+            return _SCORE_PREFIX
+        if any(t.startswith(term) for t in tags):
+            return _SCORE_WORD_PREFIX
+        if term in name or term in pid or term in moniker or any(term in t for t in tags):
+            return _SCORE_SUBSTRING
+        return None
+
+    def search(self, term: str, limit: Optional[int] = None, fuzzy: bool = True) -> List[Dict[str, str]]:
+        """
+        Search Name, Id, Moniker and Tags for *term*.
+
+        Returns ``winget search``-shaped dicts (``Name``, ``Id``, ``Version``,
+        ``Source``) ranked exact → prefix → substring → fuzzy, alphabetically
+        within a rank.
+        """
+        term = term.strip().strip("\"'").lower()
+        if not term:
+            return []
+        packages, all_fields, words, vocabulary, _ = self._view
+
+        scored: List[Tuple[int, int]] = []
+        for i, fields in enumerate(all_fields):
+            score = self._score(term, fields)
+            if score is not None:
+                scored.append((score, i))
+
+        if fuzzy and (limit is None or len(scored) < limit):
+            matched = {i for _, i in scored}
+            for word in self._fuzzy_words(term, vocabulary):
+                for i in words[word]:
+                    if i not in matched:
+                        matched.add(i)
+                        scored.append((_SCORE_FUZZY, i))
+
+        scored.sort()
+        if limit is not None:
+            scored = scored[:limit]
+        return [to_search_result(packages[i]) for _, i in scored]
+
+    @staticmethod
+    def _fuzzy_words(term: str, vocabulary: List[str]) -> Iterable[str]:
+        # Fuzzy matching is per word, so only single-word queries of some length qualify
+        if len(term) < 4 or _WORD_SPLIT.search(term):
+            return []
+        return difflib.get_close_matches(term, vocabulary, n=10, cutoff=0.8)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "packages": len(self),
+            "versions": len(self._dirs),
+            "built_at": self.built_at,
+            "manifest_dir": self.manifest_dir,
+        }
+
+
+class IndexNotConfiguredError(RuntimeError):
+    """The index cannot be refreshed because no manifest directory is configured."""
+
+
+def to_search_result(record: List[Any]) -> Dict[str, str]:
+    return {
+        "Name": record[_NAME],
+        "Id": record[_ID],
+        "Version": record[_VERSION],
+        "Source": SOURCE_NAME,
+    }
+
+
+def default_snapshot_path() -> Optional[str]:
+    if WINGET_INDEX_FILE:
+        return WINGET_INDEX_FILE
+    if WINGET_MANIFEST_DIR:
+        return os.path.join(os.path.dirname(os.path.abspath(WINGET_MANIFEST_DIR)), ".winget-index.json.gz")
+    return None
+
+
+_index: Optional[WingetIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_winget_index() -> Optional[WingetIndex]:
+    """
+    Return the process-wide index, or None when no index is configured.
+
+    The snapshot is loaded if it exists; otherwise the index is built from
+    WINGET_MANIFEST_DIR (slow, once) and the snapshot written for next time.
+    """
+    global _index
+    snapshot = default_snapshot_path()
+    if _index is None and snapshot:
+        with _index_lock:
+            if _index is None:
+                if os.path.exists(snapshot):
+                    _index = WingetIndex.load(snapshot, WINGET_MANIFEST_DIR)
+                elif WINGET_MANIFEST_DIR:
+                    index = WingetIndex(WINGET_MANIFEST_DIR)
+                    index.refresh()
+                    index.save(snapshot)
+                    _index = index
+    return _index
+
+
+def refresh_winget_index() -> Dict[str, int]:
+    """Incrementally refresh the process-wide index and persist the snapshot."""
+    index = get_winget_index()
+    if index is None:
+        raise IndexNotConfiguredError("The winget index is not configured (set WINGET_MANIFEST_DIR)")
+    stats = index.refresh()
+    index.save(default_snapshot_path())
+    return stats
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) != 3:
+        sys.exit("usage: python -m api.functions.winget_index <manifests dir> <snapshot file>")
+    manifests, out = sys.argv[1:]
+    idx = WingetIndex.load(out, manifests) if os.path.exists(out) else WingetIndex(manifests)
+    print(idx.refresh())
+    idx.save(out)
@@ -1,5 +1,8 @@
+import asyncio
 import json
 import os
+import sys
+
 import pytest
 
 from api.functions import ai_detection
@@ -43,6 +46,7 @@ class _DummyClient:
 def mock_openai(monkeypatch):
     """Monkey-patch `ai_detection.OpenAI` with dummy client for unit tests."""
     monkeypatch.setattr(ai_detection, "OpenAI", _DummyClient)
+    monkeypatch.setattr(ai_detection, "_clients", {})  # clients are reused across calls
     yield  # test runs
 
 
@@ -75,6 +79,65 @@ def test_generate_detection_script_invalid_json(mock_openai, monkeypatch):
         ai_detection.generate_detection_script("SampleApp", openai_api_key="dummy")
 
 
+@pytest.fixture
+def fake_llm_server(monkeypatch, tmp_path):
+    """Point the openai provider at the local stub server, with no API key."""
+    from api.benchmarks.fake_llm_server import FakeLLMServer
+    from api.functions import detection_cache
+
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    monkeypatch.setattr(ai_detection, "_clients", {})
+    monkeypatch.setattr(detection_cache, "DETECTION_CACHE_PATH", str(tmp_path / "cache.sqlite"))
+    monkeypatch.setattr(detection_cache, "_cache", None)
+    with FakeLLMServer(rate_limit_every=3) as server:
+        monkeypatch.setattr(ai_detection, "DETECTION_LLM_BASE_URL", server.url)
+        yield server
+
+
+def test_openai_provider_talks_to_a_local_server(fake_llm_server):
+    script = ai_detection.generate_detection_script("Contoso Agent")
+    assert "Contoso Agent*" in script and "exit 0" in script
+
+    async def _batch():
+        return [r async for r in ai_detection.generate_detection_scripts(["A", "B", "C", "D"])]
+
+    results = asyncio.run(_batch())
+    # Every third request is rate limited and retried
+    assert sorted(r["app_name"] for r in results if "script" in r) == ["A", "B", "C", "D"]
+    assert fake_llm_server.rate_limited >= 1
+
+
+def test_custom_provider_and_unknown_provider(monkeypatch):
+    created = []
+
+    def _provider(api_key, asynchronous):
+        created.append((api_key, asynchronous))
+        client = _DummyClient()
+        client.chat.completions.create = lambda **kwargs: _DummyCompletion('{"script": "exit 0"}')
+        return client
+
+    monkeypatch.setattr(ai_detection, "_clients", {})
+    monkeypatch.setitem(ai_detection._providers, "custom", _provider)
+    monkeypatch.setattr(ai_detection, "DETECTION_LLM_PROVIDER", "custom")
+    assert ai_detection.generate_detection_script("App", openai_api_key="k") == "exit 0"
+    assert ai_detection.generate_detection_script("App", openai_api_key="k") == "exit 0"
+    assert created == [("k", False)]  # the client is reused
+
+    monkeypatch.setattr(ai_detection, "DETECTION_LLM_PROVIDER", "nope")
+    with pytest.raises(ValueError):
+        ai_detection.generate_detection_script("App", openai_api_key="k")
+
+
+def test_openai_package_is_only_needed_when_a_script_is_requested(monkeypatch):
+    monkeypatch.setattr(ai_detection, "OpenAI", None)
+    monkeypatch.setattr(ai_detection, "AsyncOpenAI", None)
+    monkeypatch.setattr(ai_detection, "_clients", {})
+    monkeypatch.setitem(sys.modules, "openai", None)  # makes `import openai` fail
+
+    with pytest.raises(RuntimeError, match="pip install openai"):
+        ai_detection.generate_detection_script("App", openai_api_key="k")
+
+
 # Mark these tests separately so they only run with the live flag
 @pytest.mark.live
 @pytest.mark.parametrize(
@@ -0,0 +1,186 @@
+import sqlite3
+
+import pytest
+
+from api.benchmarks.bench_deploy import _make_package
+from api.benchmarks.fake_intune_server import FakeIntuneServer
+from api.functions import app_inventory, auth, deploy_pipeline, graph_client
+from api.functions import intune_win32_uploader as uploader
+from api.functions.app_inventory import AppInventory, DuplicateAppError, check_duplicate
+
+
+@pytest.fixture
+def server(monkeypatch):
+    with FakeIntuneServer() as server:
+        monkeypatch.setattr(auth, "GRAPH_STATIC_TOKEN", "test-token")
+        monkeypatch.setattr(graph_client, "GRAPH_BASE", server.graph_base)
+        yield server
+
+
+@pytest.fixture
+def inventory(monkeypatch, tmp_path):
+    path = str(tmp_path / "inventory.sqlite")
+    monkeypatch.setattr(app_inventory, "APP_INVENTORY_PATH", path)
+    monkeypatch.setattr(app_inventory, "_inventory", None)
+    yield app_inventory.get_app_inventory()
+    app_inventory.get_app_inventory().close()
+
+
+def _add_app(server, name, package_id):
+    return server._create_app({"displayName": name, "notes": f"Winget Package ID: {package_id}"})["id"]
+
+
+def test_full_sync_pages_and_incremental_sync_fetches_changes(server, tmp_path):
+    ids = [_add_app(server, f"App {i}", f"Vendor.App{i}") for i in range(230)]
+    now = [1000.0]
+    inventory = AppInventory(str(tmp_path / "inv.sqlite"), sync_interval=60, full_sync_interval=3600,
+                             clock=lambda: now[0])
+
+    [app] = inventory.find(package_id="Vendor.App7")
+    assert (app["id"], app["displayName"]) == (ids[7], "App 7")
+    assert inventory.find(display_name="app 12", refresh=False)[0]["id"] == ids[12]
+    assert inventory.stats()[""]["apps"] == 230
+    listings = server.request_counts()["graph"]
+    assert listings == 3  # 100 + 100 + 30
+
+    # Fresh inventory: no Graph call; stale: only apps modified since the high-water mark
+    inventory.find(package_id="Vendor.App1")
+    assert server.request_counts()["graph"] == listings
+    new_id = _add_app(server, "New App", "Vendor.New")
+    server._patch_app(ids[0], {"displayName": "Renamed"})
+    now[0] += 61
+    assert inventory.find(package_id="Vendor.New")[0]["id"] == new_id
+    assert inventory.find(package_id="Vendor.App0", refresh=False)[0]["displayName"] == "Renamed"
+    assert server.request_counts()["graph"] == listings + 1
+
+    # Deletions only show up in a full listing
+    server._delete_app(ids[1], {})
+    assert inventory.sync(full=True)["removed"] == 1
+    assert inventory.find(package_id="Vendor.App1", refresh=False) == []
+    inventory.close()
+
+
+def test_check_duplicate_policies(server, inventory):
+    app_id = _add_app(server, "Existing", "Vendor.Existing")
+
+    assert check_duplicate("Vendor.Existing", "create") is None
+    assert check_duplicate("Vendor.Existing", "skip") == app_id
+    assert check_duplicate("Vendor.Other", "skip") is None
+    with pytest.raises(DuplicateAppError) as excinfo:
+        check_duplicate("Vendor.Existing", "FAIL")
+    assert excinfo.value.app_ids == [app_id]
+    with pytest.raises(ValueError):
+        check_duplicate("Vendor.Existing", "overwrite")
+
+
+@pytest.mark.parametrize("with_inventory", [True, False])
+def test_check_duplicate_picks_the_most_recently_modified_app(server, monkeypatch, tmp_path, caplog,
+                                                              with_inventory):
+    monkeypatch.setattr(app_inventory, "APP_INVENTORY_PATH",
+                        str(tmp_path / "inventory.sqlite") if with_inventory else "")
+    monkeypatch.setattr(app_inventory, "_inventory", None)
+    older, newer = sorted(_add_app(server, f"Copy {i}", "Vendor.Twice") for i in range(2))
+    server.apps[older]["lastModifiedDateTime"] = "2024-05-02T00:00:00Z"
+    server.apps[newer]["lastModifiedDateTime"] = "2024-06-01T00:00:00Z"
+
+    with caplog.at_level("WARNING", logger=app_inventory.__name__):
+        assert check_duplicate("Vendor.Twice", "skip") == newer
+    assert f"using the most recently modified, {newer}" in caplog.text
+    with pytest.raises(DuplicateAppError) as excinfo:
+        check_duplicate("Vendor.Twice", "fail")
+    assert excinfo.value.app_ids == [newer, older]
+    if with_inventory:
+        app_inventory.get_app_inventory().close()
+
+
+def test_winget_and_app_library_ids_do_not_collide(server, inventory):
+    winget_id = _add_app(server, "Shared", "SHARED")
+    library_id = server._create_app({"displayName": "Shared", "notes": "App Library ID: SHARED"})["id"]
+
+    assert check_duplicate("SHARED", "skip") == winget_id
+    assert check_duplicate("SHARED", "skip", app_inventory.APP_LIBRARY_NOTES_TAG) == library_id
+    server._delete_app(winget_id, {})
+    inventory.sync(full=True)
+    assert check_duplicate("SHARED", "skip") is None
+
+
+def test_inventory_without_the_tag_column_is_migrated_and_relisted(server, tmp_path):
+    path = str(tmp_path / "old.sqlite")
+    conn = sqlite3.connect(path)
+    conn.executescript(app_inventory._SCHEMA.replace("    package_tag       TEXT,\n", "")
+                       + "INSERT INTO inventory_sync VALUES ('', 1e12, 1e12, NULL);")
+    conn.close()
+    app_id = _add_app(server, "Existing", "Vendor.Existing")
+
+    inventory = AppInventory(path, clock=lambda: 1e12)
+    [app] = inventory.find(package_id="Vendor.Existing", package_tag=app_inventory.WINGET_NOTES_TAG)
+    assert app["id"] == app_id
+    inventory.close()
+
+
+def test_check_duplicate_without_inventory_queries_graph(server, monkeypatch):
+    monkeypatch.setattr(app_inventory, "APP_INVENTORY_PATH", "")
+    monkeypatch.setattr(app_inventory, "_inventory", None)
+    app_id = _add_app(server, "Existing", "Vendor.Existing")
+    _add_app(server, "Longer", "Vendor.Existing.Beta")
+
+    assert check_duplicate("Vendor.Existing", "update") == app_id
+    assert check_duplicate("Vendor.Existing", "skip", app_inventory.APP_LIBRARY_NOTES_TAG) is None
+    with pytest.raises(DuplicateAppError) as excinfo:
+        check_duplicate("Vendor.Existing", "fail")
+    assert excinfo.value.app_ids == [app_id]
+
+    # Graph rejecting the notes filter falls back to a full listing
+    listed = []
+    original = app_inventory._list_win32_apps
+
+    def _strict(condition=None):
+        listed.append(condition)
+        if condition and "notes" in condition:
+            raise graph_client.GraphRequestError("400", status_code=400)
+        return original(condition)
+
+    monkeypatch.setattr(app_inventory, "_list_win32_apps", _strict)
+    assert check_duplicate("Vendor.Existing", "skip") == app_id
+    assert listed[-1] is None
+
+
+def test_skip_deploy_reuses_the_app_created_by_the_first_one(server, inventory, monkeypatch, tmp_path):
+    monkeypatch.setattr(deploy_pipeline, "get_checkpoint_store", lambda: None)
+    package = _make_package(str(tmp_path), 1)
+    inventory.ensure_fresh()
+
+    app_id = uploader.upload_intunewin(str(package), "Bench App", "Bench.App", if_exists="skip")
+    graph_calls = server.request_counts()["graph"]
+    again = uploader.upload_intunewin(str(package), "Bench App", "Bench.App", if_exists="skip")
+
+    assert again == app_id
+    assert list(server.apps) == [app_id]
+    assert server.request_counts()["graph"] == graph_calls
+    assert app_inventory.package_id_from_notes(server.apps[app_id]["notes"]) == "Bench.App"
+    with pytest.raises(DuplicateAppError):
+        uploader.upload_intunewin(str(package), "Bench App", "Bench.App", if_exists="fail")
+
+
+def test_update_commits_a_new_content_version_only_when_the_package_changed(server, inventory, monkeypatch,
+                                                                             tmp_path):
+    monkeypatch.setattr(deploy_pipeline, "get_checkpoint_store", lambda: None)
+    package = _make_package(str(tmp_path), 1)
+    inventory.ensure_fresh()
+
+    app_id = uploader.upload_intunewin(str(package), "Bench App", "Bench.App", if_exists="update")
+    blob_requests = server.request_counts()["blob"]
+    assert uploader.upload_intunewin(str(package), "Bench App", "Bench.App", if_exists="update") == app_id
+    assert server.request_counts()["blob"] == blob_requests
+    assert server.apps[app_id]["committedContentVersion"] == "1"
+
+    parse = uploader._parse_detection_xml
+    monkeypatch.setattr(uploader, "_parse_detection_xml",
+                        lambda path: ({**parse(path)[0], "file_digest": "new-digest"}, parse(path)[1]))
+    assert uploader.upload_intunewin(str(package), "Bench App 2", "Bench.App", if_exists="update") == app_id
+
+    app = server.apps[app_id]
+    assert list(server.apps) == [app_id]
+    assert (app["committedContentVersion"], app["publishingState"]) == ("2", "published")
+    assert app_inventory.digest_from_notes(app["notes"]) == "new-digest"
+    assert server.request_counts()["blob"] > blob_requests
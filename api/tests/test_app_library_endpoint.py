@@ -0,0 +1,59 @@
+import asyncio
+import contextlib
+import io
+import threading
+
+import pytest
+
+from api import app_library_endpoint
+from api.functions import remote_intunewin
+
+from .test_remote_intunewin import _serve
+
+
+def test_download_resumes_a_broken_stream_from_the_last_byte(monkeypatch):
+    monkeypatch.setattr(remote_intunewin, "REMOTE_RETRY_BACKOFF", 0)
+    data = bytes(range(256)) * 4096
+    httpd, url = _serve(data, cut_after=300_000)
+    try:
+        fh = io.BytesIO()
+        app_library_endpoint._download_to(url, fh)
+        assert fh.getvalue() == data
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_download_gives_up_after_the_retries(monkeypatch):
+    monkeypatch.setattr(remote_intunewin, "REMOTE_RETRY_BACKOFF", 0)
+    monkeypatch.setattr(remote_intunewin, "REMOTE_RETRIES", 1)
+    monkeypatch.setattr(remote_intunewin, "REMOTE_CONNECT_TIMEOUT", 0.5)
+    with pytest.raises(app_library_endpoint.requests.ConnectionError):
+        # nothing listens on port 1
+        app_library_endpoint._download_to("http://127.0.0.1:1/file", io.BytesIO())
+
+
+def test_async_deploy_enters_and_leaves_the_package_off_the_loop(monkeypatch):
+    threads = []
+
+    @contextlib.contextmanager
+    def _package(file_info, backblaze_path):
+        threads.append(threading.get_ident())
+        yield "/tmp/app.intunewin"
+        threads.append(threading.get_ident())
+
+    async def _upload(path, **kwargs):
+        return "app-1"
+
+    monkeypatch.setattr(app_library_endpoint, "_local_package", _package)
+    monkeypatch.setattr(app_library_endpoint, "upload_app_library_intunewin_async", _upload)
+    body = app_library_endpoint.AppLibraryDeployRequest(
+        backblaze_path="apps/app.intunewin", display_name="App", package_id="APP1")
+
+    async def _run():
+        return await app_library_endpoint._deploy_from_backblaze_async({}, body), threading.get_ident()
+
+    app_id, loop_thread = asyncio.run(_run())
+
+    assert app_id == "app-1"
+    assert len(threads) == 2 and loop_thread not in threads
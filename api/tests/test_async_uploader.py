@@ -0,0 +1,209 @@
+import asyncio
+import re
+import threading
+
+import aiohttp
+import pytest
+import requests
+
+from api.benchmarks.fake_blob_server import FakeBlobServer
+from api.functions import async_uploader, blob_uploader, deploy_jobs
+from api.functions.graph_client import GraphRequestError
+from api.functions.metrics import DeployTimer
+from api.functions.polling import Poller
+from api.functions.upload_checkpoints import UploadCheckpointStore
+
+
+@pytest.fixture
+def blob_server():
+    with FakeBlobServer() as server:
+        yield server
+
+
+def _upload(blocks, sas_uri, **kwargs):
+    async def _run():
+        async with aiohttp.ClientSession() as session:
+            return await blob_uploader.upload_blocks_async(iter(blocks), sas_uri, session=session, **kwargs)
+    return asyncio.run(_run())
+
+
+def test_upload_blocks_async_commits_in_order_and_retries(blob_server, monkeypatch):
+    monkeypatch.setattr(blob_uploader, "BLOB_RETRY_BACKOFF", 0)
+    blob_server.fail_block_puts = 2
+    blocks = [bytes([i]) * 100 for i in range(25)]
+
+    assert _upload(blocks, blob_server.sas_uri(), max_workers=4) == 2500
+
+    assert blob_server.committed["/container/payload"] == [blob_uploader.block_id(i) for i in range(25)]
+
+
+def test_upload_blocks_async_skips_staged_blocks(blob_server):
+    with requests.Session() as session:
+        blob_uploader._put_block(session, blob_server.sas_uri(), blob_uploader.block_id(0), b"a" * 10)
+    staged = {blob_uploader.block_id(0): 10, blob_uploader.block_id(1): 999}  # block 1 has the wrong size
+    stored = []
+
+    _upload([b"a" * 10] * 3, blob_server.sas_uri(), staged=staged, on_block=lambda b, n: stored.append(b))
+
+    assert sorted(stored) == [blob_uploader.block_id(1), blob_uploader.block_id(2)]
+    assert blob_server.committed["/container/payload"] == [blob_uploader.block_id(i) for i in range(3)]
+
+
+def test_graph_request_async_raises_graph_errors(blob_server, monkeypatch):
+    monkeypatch.setattr(async_uploader, "get_auth_headers", lambda: {})
+
+    async def _run():
+        try:
+            # The fake blob server rejects GETs without comp=blocklist
+            return await async_uploader.graph_request_async("GET", f"{blob_server.url}/container/x")
+        finally:
+            await async_uploader.close_session()
+
+    with pytest.raises(GraphRequestError) as excinfo:
+        asyncio.run(_run())
+    assert excinfo.value.status_code == 400
+
+
+class _FakeIntune:
+    """In-memory Graph: every file gets a SAS URI on a FakeBlobServer; no app is published
+    before *concurrent* deploys are all waiting for it at the same time.  Polls arrive
+    merged into ``$batch`` calls."""
+
+    def __init__(self, blob_server, concurrent):
+        self.blob_server = blob_server
+        self.concurrent = concurrent
+        self.apps = {}
+        self.waiting = set()
+        self.peak_waiting = 0
+        self.batched = 0
+
+    async def request(self, method, url, json=None, **kwargs):
+        await asyncio.sleep(0)
+        path = url.split("/beta", 1)[1]
+        if method == "POST" and path == "/$batch":
+            self.batched += len(json["requests"])
+            return {"responses": [
+                {"id": r["id"], "status": 200, "body": await self.request(r["method"], "/beta" + r["url"])}
+                for r in json["requests"]
+            ]}
+        if method == "POST" and path == "/deviceAppManagement/mobileApps":
+            app_id = f"app-{len(self.apps)}"
+            self.apps[app_id] = json
+            return {"id": app_id}
+        if method == "POST" and path.endswith("/contentVersions"):
+            return {"id": "1"}
+        if method == "POST" and path.endswith("/files"):
+            return {"id": "file-1"}
+        app_id = re.search(r"/mobileApps/([^/]+)", path).group(1)
+        if method == "GET" and path.endswith("/files/file-1"):
+            return {"azureStorageUri": self.blob_server.sas_uri(app_id), "isCommitted": True}
+        if method == "GET":
+            self.waiting.add(app_id)
+            self.peak_waiting = max(self.peak_waiting, len(self.waiting))
+            if self.peak_waiting < self.concurrent:
+                return {"publishingState": "processing"}
+            return {"publishingState": "published"}
+        return None
+
+
+class _Payload:
+    def __init__(self, blocks):
+        self.blocks = blocks
+        self.size = sum(len(b) for b in blocks)
+
+    def iter_blocks(self, block_size):
+        return iter(self.blocks)
+
+
+META = {"file_name": "setup.exe", "unencrypted_size": 10, "encryption_key": "k", "iv": "iv", "mac": "m",
+        "mac_key": "mk", "profile_identifier": "ProfileVersion1", "file_digest": "d",
+        "digest_algorithm": "SHA256"}
+
+
+def test_concurrent_async_deploys_share_one_loop(blob_server, monkeypatch):
+    """Twenty deploys wait on Intune at the same time without a thread each."""
+    intune = _FakeIntune(blob_server, concurrent=20)
+    monkeypatch.setattr(async_uploader, "graph_request_async", intune.request)
+    monkeypatch.setattr(async_uploader, "get_checkpoint_store", lambda: None)
+    monkeypatch.setattr(async_uploader, "Poller",
+                        lambda **kwargs: Poller(**dict(kwargs, initial=0.01, max_interval=0.01, deadline=10)))
+    stages = []
+
+    async def _deploy(i):
+        with DeployTimer("test_async").run() as timer:
+            return await async_uploader.upload_package_async(
+                META, _Payload([b"x" * 4, b"y" * 4]), app_body={"displayName": f"App {i}"},
+                checkpoint_pipeline="win32", package_id=f"Vendor.App{i}", display_name=f"App {i}",
+                report=stages.append, timer=timer,
+            )
+
+    async def _run():
+        try:
+            return await asyncio.gather(*(_deploy(i) for i in range(20)))
+        finally:
+            await async_uploader.close_session()
+
+    app_ids = asyncio.run(_run())
+
+    assert sorted(app_ids) == sorted(f"app-{i}" for i in range(20))
+    assert len(blob_server.committed) == 20
+    assert stages.count(deploy_jobs.STAGE_PUBLISHING) == 20
+    assert intune.batched >= 20
+
+
+class _ThreadCheckingStore(UploadCheckpointStore):
+    """Checkpoint store that records the thread of every call and the size of every block batch."""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.threads = set()
+        self.batches = []
+
+    def get(self, key):
+        self.threads.add(threading.get_ident())
+        return super().get(key)
+
+    def save(self, checkpoint):
+        self.threads.add(threading.get_ident())
+        super().save(checkpoint)
+
+    def delete(self, key):
+        self.threads.add(threading.get_ident())
+        super().delete(key)
+
+    def add_block(self, key, block_id, size):
+        pytest.fail("blocks are checkpointed one at a time")
+
+    def add_blocks(self, key, blocks):
+        self.threads.add(threading.get_ident())
+        self.batches.append(len(blocks))
+        super().add_blocks(key, blocks)
+
+
+def test_async_deploy_keeps_checkpoint_writes_off_the_loop(blob_server, monkeypatch, tmp_path):
+    store = _ThreadCheckingStore(str(tmp_path / "cp.sqlite"))
+    monkeypatch.setattr(async_uploader, "graph_request_async", _FakeIntune(blob_server, concurrent=1).request)
+    monkeypatch.setattr(async_uploader, "get_checkpoint_store", lambda: store)
+    monkeypatch.setattr(async_uploader, "ASYNC_CHECKPOINT_BATCH", 8)
+    monkeypatch.setattr(async_uploader, "Poller",
+                        lambda **kwargs: Poller(**dict(kwargs, initial=0.01, max_interval=0.01, deadline=10)))
+
+    async def _run():
+        try:
+            with DeployTimer("test_async").run() as timer:
+                app_id = await async_uploader.upload_package_async(
+                    META, _Payload([bytes([i]) * 4 for i in range(30)]), app_body={"displayName": "App"},
+                    checkpoint_pipeline="win32", package_id="Vendor.App", display_name="App",
+                    report=lambda stage: None, timer=timer,
+                )
+            return app_id, threading.get_ident()
+        finally:
+            await async_uploader.close_session()
+
+    app_id, loop_thread = asyncio.run(_run())
+
+    assert app_id == "app-0"
+    assert store.threads and loop_thread not in store.threads
+    assert sum(store.batches) == 30 and len(store.batches) < 30
+    assert store.list() == []
+    store.close()
@@ -0,0 +1,80 @@
+import asyncio
+from collections import Counter
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from api.functions import backblaze_utils
+
+
+def _fake_b2(calls: Counter):
+    async def authorize(request):
+        calls["authorize"] += 1
+        base = str(request.url.origin())
+        return web.json_response({
+            "authorizationToken": "acct-token",
+            "apiUrl": base,
+            "downloadUrl": base,
+        })
+
+    async def list_files(request):
+        calls["list"] += 1
+        body = await request.json()
+        return web.json_response({"files": [{
+            "fileId": f"id-{body['prefix']}",
+            "fileName": body["prefix"],
+            "contentLength": 10,
+            "contentSha1": "unverified:ABC",
+        }]})
+
+    async def download_auth(request):
+        calls["download_auth"] += 1
+        body = await request.json()
+        return web.json_response({"authorizationToken": f"dl-{body['fileNamePrefix']}"})
+
+    app = web.Application()
+    app.router.add_get("/b2api/v2/b2_authorize_account", authorize)
+    app.router.add_post("/b2api/v2/b2_list_file_names", list_files)
+    app.router.add_post("/b2api/v2/b2_get_download_authorization", download_auth)
+    return app
+
+
+@pytest.fixture
+def fresh_caches(monkeypatch):
+    monkeypatch.setattr(backblaze_utils, "auth_cache", {
+        "authorization_token": None, "api_url": None, "download_url": None, "expires_at": 0})
+    monkeypatch.setattr(backblaze_utils, "_download_auth_cache", {})
+    monkeypatch.setattr(backblaze_utils, "_file_listing_cache", {})
+    monkeypatch.setattr(backblaze_utils, "BACKBLAZE_BUCKET_NAME", "bucket")
+
+
+def test_warm_lookups_make_no_network_calls(monkeypatch, fresh_caches):
+    calls = Counter()
+
+    async def _run():
+        async with TestServer(_fake_b2(calls)) as server:
+            monkeypatch.setattr(backblaze_utils, "BACKBLAZE_ENDPOINT", str(server.make_url("")).rstrip("/"))
+            await backblaze_utils.open_session()
+            try:
+                first = await backblaze_utils.get_file_download_info("apps/7zip/7z-1.intunewin")
+                again = await backblaze_utils.get_file_download_info("apps/7zip/7z-1.intunewin")
+                sibling = await backblaze_utils.get_file_download_info("apps/7zip/7z-2.intunewin")
+            finally:
+                await backblaze_utils.close_session()
+        return first, again, sibling
+
+    first, again, sibling = asyncio.run(_run())
+
+    assert first == again
+    assert first["content_sha1"] == "abc"
+    assert first["download_url"].endswith("/file/bucket/apps/7zip/7z-1.intunewin?Authorization=dl-apps/7zip/")
+    assert sibling["file_id"] == "id-apps/7zip/7z-2.intunewin"
+    # One account authorization and one download authorization for the whole folder;
+    # only the never-seen sibling needed a listing
+    assert calls == Counter(authorize=1, download_auth=1, list=2)
+
+
+def test_download_auth_prefix():
+    assert backblaze_utils._download_auth_prefix("apps/7zip/7z.intunewin") == "apps/7zip/"
+    assert backblaze_utils._download_auth_prefix("7z.intunewin") == "7z.intunewin"
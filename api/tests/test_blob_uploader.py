@@ -0,0 +1,88 @@
+import io
+
+import pytest
+import requests
+
+from api.benchmarks.fake_blob_server import FakeBlobServer
+from api.functions import blob_uploader
+
+
+@pytest.fixture
+def blob_server():
+    with FakeBlobServer() as server:
+        yield server
+
+
+@pytest.mark.parametrize("workers", [1, 4, 16])
+def test_upload_blocks_commits_in_order(blob_server, workers):
+    """Concurrent uploads must still commit every block in source order."""
+    payload = bytes(range(256)) * 400  # 102400 bytes
+    blocks = blob_uploader.iter_blocks(io.BytesIO(payload), 1000)
+
+    total = blob_uploader.upload_blocks(blocks, blob_server.sas_uri(), max_workers=workers)
+
+    assert total == len(payload)
+    committed = blob_server.committed["/container/payload"]
+    assert committed == [blob_uploader.block_id(i) for i in range(103)]
+    staged = blob_server.staged["/container/payload"]
+    assert sum(staged[b] for b in committed) == len(payload)
+
+
+def test_upload_blocks_surfaces_put_errors(blob_server, monkeypatch):
+    """A failed block PUT must propagate and the block list must not be committed."""
+    real_put = blob_uploader._put_block
+
+    def _flaky_put(session, sas_uri, blk_id, chunk):
+        if blk_id == blob_uploader.block_id(3):
+            raise requests.HTTPError("boom")
+        real_put(session, sas_uri, blk_id, chunk)
+
+    monkeypatch.setattr(blob_uploader, "_put_block", _flaky_put)
+
+    with pytest.raises(requests.HTTPError):
+        blob_uploader.upload_blocks(
+            blob_uploader.iter_blocks(io.BytesIO(b"x" * 10000), 1000),
+            blob_server.sas_uri(),
+            max_workers=4,
+        )
+    assert "/container/payload" not in blob_server.committed
+
+
+def test_put_block_retries_transient_failures(blob_server, monkeypatch):
+    """503s from the storage account are retried until the block is stored."""
+    monkeypatch.setattr(blob_uploader, "BLOB_RETRY_BACKOFF", 0)
+    blob_server.fail_block_puts = 3
+
+    blob_uploader.upload_blocks(iter([b"x" * 10, b"y" * 10]), blob_server.sas_uri(), max_workers=1)
+
+    assert blob_server.committed["/container/payload"] == [blob_uploader.block_id(0), blob_uploader.block_id(1)]
+
+
+def test_put_block_gives_up_after_the_retry_budget(blob_server, monkeypatch):
+    monkeypatch.setattr(blob_uploader, "BLOB_RETRY_BACKOFF", 0)
+    monkeypatch.setattr(blob_uploader, "BLOB_PUT_RETRIES", 2)
+    blob_server.fail_block_puts = 3
+
+    with pytest.raises(requests.HTTPError):
+        blob_uploader.upload_blocks(iter([b"x" * 10]), blob_server.sas_uri(), max_workers=1)
+    assert "/container/payload" not in blob_server.committed
+
+
+def test_resume_skips_blocks_already_staged(blob_server):
+    """Only the blocks missing from the blob's uncommitted list are sent again."""
+    sas_uri = blob_server.sas_uri()
+    with requests.Session() as session:
+        assert blob_uploader.get_uncommitted_blocks(session, sas_uri) == {}
+        for idx in (0, 2):
+            blob_uploader._put_block(session, sas_uri, blob_uploader.block_id(idx), b"a" * 5)
+        staged = blob_uploader.get_uncommitted_blocks(session, sas_uri)
+    assert staged == {blob_uploader.block_id(0): 5, blob_uploader.block_id(2): 5}
+
+    stored = []
+    requests_before = blob_server.requests
+    blob_uploader.upload_blocks(iter([b"a" * 5] * 4), sas_uri, max_workers=2, staged=staged,
+                                on_block=lambda blk, size: stored.append(blk))
+
+    assert sorted(stored) == [blob_uploader.block_id(1), blob_uploader.block_id(3)]
+    assert blob_server.requests - requests_before == 3  # two block PUTs + the block list
+    assert blob_server.committed["/container/payload"] == [blob_uploader.block_id(i) for i in range(4)]
@@ -0,0 +1,89 @@
+import asyncio
+import threading
+import time
+
+from api.functions import deploy_jobs
+from api.functions.deploy_jobs import JobManager
+
+
+def _wait(job, timeout=5.0):
+    deadline = time.time() + timeout
+    while job.to_dict()["finished_at"] is None and time.time() < deadline:
+        time.sleep(0.01)
+    return job.to_dict()
+
+
+def test_job_records_stages_and_result():
+    manager = JobManager(max_workers=1)
+
+    def _deploy(on_stage, name):
+        on_stage(deploy_jobs.STAGE_SHELL_CREATED)
+        on_stage(deploy_jobs.STAGE_UPLOADING)
+        return f"app-{name}"
+
+    job = manager.submit("win32", _deploy, label="Demo", name="demo")
+    state = _wait(job)
+
+    assert state["status"] == deploy_jobs.STATUS_SUCCEEDED
+    assert state["result"] == "app-demo"
+    assert [h["stage"] for h in state["history"]] == [
+        deploy_jobs.STAGE_QUEUED,
+        deploy_jobs.STAGE_SHELL_CREATED,
+        deploy_jobs.STAGE_UPLOADING,
+        deploy_jobs.STAGE_COMPLETED,
+    ]
+    assert manager.get(job.job_id) is job
+    manager.shutdown()
+
+
+def test_failed_job_reports_error():
+    manager = JobManager(max_workers=1)
+
+    def _deploy(on_stage):
+        raise RuntimeError("Graph said no")
+
+    state = _wait(manager.submit("win32", _deploy))
+    assert state["status"] == deploy_jobs.STATUS_FAILED
+    assert state["stage"] == deploy_jobs.STAGE_FAILED
+    assert "Graph said no" in state["error"]
+    manager.shutdown()
+
+
+def test_jobs_run_concurrently_up_to_pool_size():
+    manager = JobManager(max_workers=3)
+    barrier = threading.Barrier(3, timeout=5)
+
+    # All three jobs must be running at the same time to pass the barrier
+    jobs = [manager.submit("win32", lambda on_stage: barrier.wait()) for _ in range(3)]
+    states = [_wait(job) for job in jobs]
+    assert all(s["status"] == deploy_jobs.STATUS_SUCCEEDED for s in states)
+    manager.shutdown()
+
+
+def test_async_jobs_run_as_tasks_on_the_loop():
+    manager = JobManager(max_workers=1, max_async=2)
+    running = []
+    peak = []
+
+    async def _deploy(on_stage, name):
+        running.append(name)
+        peak.append(len(running))
+        on_stage(deploy_jobs.STAGE_UPLOADING)
+        await asyncio.sleep(0.05)
+        running.remove(name)
+        if name == "broken":
+            raise RuntimeError("boom")
+        return f"app-{name}"
+
+    async def _run():
+        jobs = [manager.submit_async("win32", _deploy, name=name) for name in ("a", "b", "c", "broken")]
+        while any(job.to_dict()["finished_at"] is None for job in jobs):
+            await asyncio.sleep(0.01)
+        return [job.to_dict() for job in jobs]
+
+    states = asyncio.run(_run())
+    assert [s["result"] for s in states[:3]] == ["app-a", "app-b", "app-c"]
+    assert states[3]["status"] == deploy_jobs.STATUS_FAILED and states[3]["error"] == "boom"
+    assert deploy_jobs.STAGE_UPLOADING in [h["stage"] for h in states[0]["history"]]
+    assert max(peak) == 2  # bounded by max_async
+    manager.shutdown()
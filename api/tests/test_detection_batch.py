@@ -0,0 +1,141 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+from api.functions import ai_detection, detection_cache
+
+
+class _RateLimitError(Exception):
+    status_code = 429
+
+    def __init__(self):
+        super().__init__("rate limited")
+        self.response = type("_Resp", (), {"headers": {"retry-after": "0.01"}})()
+
+
+class _FakeAsyncClient:
+    """Async OpenAI stand-in: counts instances, tracks concurrency, fails some calls."""
+
+    instances = 0
+
+    def __init__(self, *args, **kwargs):
+        type(self).instances += 1
+        self.running = 0
+        self.peak = 0
+        self.calls = []
+        self.fail_first = set()
+        self.chat = type("_Chat", (), {"completions": type("_C", (), {"create": self._create})()})()
+
+    async def _create(self, **kwargs):
+        app_name = kwargs["messages"][1]["content"].split('"')[1]
+        self.calls.append(app_name)
+        if app_name in self.fail_first:
+            self.fail_first.discard(app_name)
+            raise _RateLimitError()
+        if app_name == "Broken":
+            raise RuntimeError("model unavailable")
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        await asyncio.sleep(0.05 if app_name != "Slow" else 0.2)
+        self.running -= 1
+        message = type("_Msg", (), {"content": json.dumps({"script": f"# {app_name}"})})()
+        return type("_Completion", (), {"choices": [type("_Choice", (), {"message": message})()]})()
+
+
+@pytest.fixture
+def fake_llm(monkeypatch, tmp_path):
+    monkeypatch.setattr(ai_detection, "AsyncOpenAI", _FakeAsyncClient)
+    monkeypatch.setattr(ai_detection, "_clients", {})
+    monkeypatch.setattr(_FakeAsyncClient, "instances", 0)
+    monkeypatch.setattr(detection_cache, "DETECTION_CACHE_PATH", str(tmp_path / "cache.sqlite"))
+    monkeypatch.setattr(detection_cache, "_cache", None)
+
+
+def _collect(names, **kwargs):
+    async def _run():
+        results = [r async for r in ai_detection.generate_detection_scripts(names, openai_api_key="k", **kwargs)]
+        client = next(iter(ai_detection._clients.values()))
+        return results, client
+    return asyncio.run(_run())
+
+
+def test_batch_streams_results_as_they_complete(fake_llm):
+    names = ["Slow", "7-Zip", "Broken", "Notepad++", "Git", "VLC"]
+
+    results, client = _collect(names, max_concurrency=2)
+
+    assert _FakeAsyncClient.instances == 1
+    assert client.peak <= 2
+    assert {r["app_name"] for r in results} == set(names)
+    assert results[-1]["app_name"] in ("Slow", "VLC", "Git")  # the slow one does not hold up the rest
+    assert results[0]["app_name"] != "Slow"
+    assert next(r for r in results if r["app_name"] == "Broken") == {
+        "app_name": "Broken", "error": "model unavailable"}
+
+
+def test_batch_retries_rate_limited_requests_and_uses_cache(fake_llm, monkeypatch):
+    original_init = _FakeAsyncClient.__init__
+
+    def _init(self, *args, **kwargs):
+        original_init(self, *args, **kwargs)
+        self.fail_first = {"Git"}
+
+    monkeypatch.setattr(_FakeAsyncClient, "__init__", _init)
+
+    results, client = _collect(["Git", "VLC"])
+    assert {r["app_name"]: r["script"] for r in results} == {"Git": "# Git", "VLC": "# VLC"}
+    assert client.calls.count("Git") == 2
+
+    again, client = _collect(["Git", "VLC"])
+    assert all(r["cached"] for r in again)
+    assert client.calls.count("VLC") == 1
+
+
+def test_rate_limiter_spaces_requests():
+    async def _run():
+        limiter = ai_detection._RateLimiter(per_minute=600)  # one every 0.1 s
+        start = time.monotonic()
+        await asyncio.gather(*(limiter.wait() for _ in range(4)))
+        return time.monotonic() - start
+
+    assert asyncio.run(_run()) >= 0.29
+
+
+def test_batch_without_api_key_still_serves_templates(fake_llm, monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    monkeypatch.setattr(ai_detection, "DETECTION_LLM_BASE_URL", None)
+    monkeypatch.setattr(ai_detection, "template_detection_script",
+                        lambda name, package_id=None: "# template" if name == "Git" else None)
+
+    async def _run():
+        return [r async for r in ai_detection.generate_detection_scripts(["Git", "VLC"])]
+
+    results = {r["app_name"]: r for r in asyncio.run(_run())}
+    assert results["Git"]["source"] == "template"
+    assert "OPENAI_API_KEY" in results["VLC"]["error"]
+    assert _FakeAsyncClient.instances == 0
+
+
+def test_batch_reads_and_writes_the_cache_off_the_loop(fake_llm, monkeypatch):
+    cache = detection_cache.get_detection_cache()
+    threads = []
+    for name in ("get", "put"):
+        original = getattr(cache, name)
+
+        def _recording(*args, _original=original):
+            threads.append(threading.get_ident())
+            return _original(*args)
+
+        monkeypatch.setattr(cache, name, _recording)
+
+    async def _run():
+        results = [r async for r in ai_detection.generate_detection_scripts(["Git", "VLC"], openai_api_key="k")]
+        return results, threading.get_ident()
+
+    results, loop_thread = asyncio.run(_run())
+
+    assert {r["script"] for r in results} == {"# Git", "# VLC"}
+    assert len(threads) == 4 and loop_thread not in threads
@@ -0,0 +1,72 @@
+import time
+
+from api.functions import ai_detection, detection_cache
+from api.functions.detection_cache import DetectionScriptCache
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_scripts_are_cached_by_normalised_name_model_and_prompt(tmp_path):
+    cache = DetectionScriptCache(str(tmp_path / "scripts.sqlite"))
+    calls = []
+
+    def _generate():
+        calls.append(1)
+        return "exit 0"
+
+    kwargs = dict(model="gpt-4o-mini", temperature=0.2, prompt_hash="p1")
+    cache.get_or_generate("Google Chrome", _generate, **kwargs)
+    start = time.perf_counter()
+    assert cache.get_or_generate('  "google   CHROME" ', _generate, **kwargs) == "exit 0"
+    assert time.perf_counter() - start < 0.01
+    assert len(calls) == 1
+
+    # A different model, temperature or prompt template is a different entry
+    cache.get_or_generate("Google Chrome", _generate, model="gpt-4o", temperature=0.2, prompt_hash="p1")
+    cache.get_or_generate("Google Chrome", _generate, model="gpt-4o-mini", temperature=0.7, prompt_hash="p1")
+    cache.get_or_generate("Google Chrome", _generate, model="gpt-4o-mini", temperature=0.2, prompt_hash="p2")
+    assert len(calls) == 4
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 4
+
+    # Entries survive a restart
+    cache.close()
+    reopened = DetectionScriptCache(str(tmp_path / "scripts.sqlite"))
+    assert reopened.get("google chrome", **kwargs) == "exit 0"
+
+
+def test_entries_expire_and_can_be_invalidated(tmp_path):
+    clock = _Clock()
+    cache = DetectionScriptCache(str(tmp_path / "scripts.sqlite"), ttl=60, clock=clock)
+    kwargs = dict(model="m", temperature=0.2, prompt_hash="p")
+    cache.put("7-Zip", script="a", **kwargs)
+    cache.put("Notepad++", script="b", **kwargs)
+
+    assert cache.invalidate("7-ZIP") == 1
+    assert cache.get("7-Zip", **kwargs) is None
+    clock.now += 61
+    assert cache.get("Notepad++", **kwargs) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_editing_the_prompt_changes_the_hash(monkeypatch):
+    before = ai_detection.prompt_hash()
+    monkeypatch.setattr(ai_detection, "_USER_PROMPT_TEMPLATE", "Detect {app_name}, please.")
+    assert ai_detection.prompt_hash() != before
+
+
+def test_cached_detection_script_uses_the_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(detection_cache, "DETECTION_CACHE_PATH", str(tmp_path / "s.sqlite"))
+    monkeypatch.setattr(detection_cache, "_cache", None)
+    calls = []
+    monkeypatch.setattr(ai_detection, "generate_detection_script",
+                        lambda app_name, **kw: calls.append(app_name) or f"# {app_name}")
+
+    assert ai_detection.cached_detection_script("7-Zip") == "# 7-Zip"
+    assert ai_detection.cached_detection_script("7-zip") == "# 7-Zip"
+    assert calls == ["7-Zip"]
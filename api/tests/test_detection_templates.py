@@ -0,0 +1,117 @@
+import textwrap
+
+import pytest
+
+from api.functions import ai_detection, detection_cache, detection_templates
+from api.functions.winget_index import WingetIndex
+
+
+def _singleton(root, package_id, name, installer_yaml):
+    publisher, package = package_id.split(".", 1)
+    path = root / package_id[0].lower() / publisher / package / "1.0" / f"{package_id}.yaml"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(textwrap.dedent(f"""\
+        PackageIdentifier: {package_id}
+        PackageVersion: "1.0"
+        PackageName: {name}
+        Publisher: {publisher}
+        ManifestType: singleton
+        """) + textwrap.dedent(installer_yaml), encoding="utf-8")
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    root = tmp_path / "manifests"
+    _singleton(root, "Contoso.Agent", "Contoso Agent", """\
+        InstallerType: msi
+        Installers:
+        - Architecture: x64
+          InstallerUrl: https://example.com/agent.msi
+          ProductCode: '{11111111-2222-3333-4444-555555555555}'
+          AppsAndFeaturesEntries:
+          - DisplayName: Contoso Agent (x64)
+            ProductCode: '{AAAAAAAA-2222-3333-4444-555555555555}'
+        """)
+    _singleton(root, "Igor.SevenZip", "7-Zip", """\
+        InstallerType: exe
+        InstallationMetadata:
+          DefaultInstallLocation: '%ProgramFiles%\\7-Zip'
+          Files:
+          - RelativeFilePath: 7zFM.exe
+            FileType: launch
+          - RelativeFilePath: Uninstall.exe
+            FileType: uninstall
+        Installers:
+        - Architecture: x64
+          InstallerUrl: https://example.com/7z.exe
+        """)
+    _singleton(root, "Fabrikam.Notes", "Fabrikam's Notes", """\
+        InstallerType: nullsoft
+        Installers:
+        - Architecture: x64
+          InstallerUrl: https://example.com/notes.exe
+        """)
+    idx = WingetIndex(str(root))
+    idx.refresh()
+    monkeypatch.setattr(detection_templates, "get_winget_index", lambda: idx)
+    return idx
+
+
+def test_index_keeps_detection_facts(index):
+    installer = index.get("Contoso.Agent")["installers"][0]
+    assert installer["product_codes"] == ["{11111111-2222-3333-4444-555555555555}",
+                                          "{AAAAAAAA-2222-3333-4444-555555555555}"]
+    assert installer["display_names"] == ["Contoso Agent (x64)"]
+
+    installer = index.get("Igor.SevenZip")["installers"][0]
+    assert installer["install_location"] == "%ProgramFiles%\\7-Zip"
+    assert installer["files"] == ["7zFM.exe"]
+
+
+def test_templates_prefer_the_most_specific_detection(index):
+    template, script = detection_templates.render_detection_script(index.get("Contoso.Agent"))
+    assert template == "product_code"
+    assert "'{11111111-2222-3333-4444-555555555555}'" in script
+
+    template, script = detection_templates.render_detection_script(index.get("Igor.SevenZip"))
+    assert template == "file"
+    assert "'%ProgramFiles%\\7-Zip\\7zFM.exe', '%ProgramFiles(x86)%\\7-Zip\\7zFM.exe'" in script
+    assert "Uninstall.exe" not in script
+
+    # No manifest detection data: the bare package name is never used, that is left to the LLM
+    assert detection_templates.render_detection_script(index.get("Fabrikam.Notes")) is None
+    assert detection_templates.template_detection_script("Fabrikam's Notes") is None
+
+    # Apps & Features names match exactly, and quotes are escaped
+    record = {"installers": [{"display_names": ["Fabrikam's Notes"]}]}
+    template, script = detection_templates.render_detection_script(record)
+    assert template == "display_name"
+    assert "@('Fabrikam''s Notes')" in script
+    assert "[string]::Equals($displayName, $_" in script and "StartsWith" not in script
+    assert "exit 0" in script and script.endswith("exit 1")
+
+
+def test_lookup_is_exact_by_name_or_id(index):
+    assert detection_templates.template_detection_script("7-zip") is not None
+    assert detection_templates.template_detection_script("Anything", package_id="igor.sevenzip") is not None
+    assert detection_templates.template_detection_script("7-Zi") is None
+    assert detection_templates.template_detection_script("Unknown App") is None
+
+
+def test_cached_detection_script_skips_the_llm_when_a_template_matches(index, monkeypatch, tmp_path):
+    class _NoLLM:
+        def __init__(self, *args, **kwargs):
+            raise AssertionError("the LLM must not be called")
+
+    monkeypatch.setattr(ai_detection, "OpenAI", _NoLLM)
+    monkeypatch.setattr(ai_detection, "_clients", {})
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    monkeypatch.setattr(detection_cache, "DETECTION_CACHE_PATH", str(tmp_path / "cache.sqlite"))
+    monkeypatch.setattr(detection_cache, "_cache", None)
+
+    script = ai_detection.cached_detection_script("Contoso Agent")
+    assert "{11111111-2222-3333-4444-555555555555}" in script
+
+    monkeypatch.setattr(detection_templates, "DETECTION_TEMPLATES", False)
+    with pytest.raises(AssertionError):
+        ai_detection.cached_detection_script("Contoso Agent")
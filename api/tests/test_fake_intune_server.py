@@ -0,0 +1,108 @@
+import asyncio
+import zipfile
+
+import pytest
+import requests
+
+from api.benchmarks.bench_deploy import _make_package
+from api.benchmarks.fake_intune_server import FakeIntuneServer
+from api.functions import (
+    async_uploader,
+    auth,
+    backblaze_utils,
+    deploy_pipeline,
+    graph_client,
+    intune_win32_uploader as uploader,
+)
+from api.functions.intunewin import CONTENTS_DIR
+
+
+@pytest.fixture
+def server(monkeypatch):
+    """Emulator wired into both upload engines, with checkpoints off."""
+    with FakeIntuneServer() as server:
+        monkeypatch.setattr(auth, "GRAPH_STATIC_TOKEN", "test-token")
+        monkeypatch.setattr(graph_client, "GRAPH_BASE", server.graph_base)
+        for module in (deploy_pipeline, async_uploader):
+            monkeypatch.setattr(module, "get_checkpoint_store", lambda: None)
+        yield server
+
+
+def _payload_size(package):
+    with zipfile.ZipFile(package) as zf:
+        return next(i.file_size for i in zf.infolist() if i.filename.startswith(CONTENTS_DIR))
+
+
+def _assert_published(server, app_id, package):
+    app = server.apps[app_id]
+    assert app["publishingState"] == "published"
+    assert app["committedContentVersion"] == "1"
+    [file_id] = [f for f, entry in server.files.items() if entry["app_id"] == app_id]
+    assert server._committed_size(file_id) == _payload_size(package)
+
+
+def test_sync_deploy_end_to_end(server, tmp_path):
+    package = _make_package(str(tmp_path), 1)
+
+    app_id = uploader.upload_intunewin(str(package), "Bench App", "Bench.App", publisher="Bench")
+
+    _assert_published(server, app_id, package)
+    assert server.apps[app_id]["displayName"] == "Bench App"
+    assert server.request_counts()["graph"] >= 8
+
+
+def test_async_deploy_end_to_end(server, tmp_path):
+    package = _make_package(str(tmp_path), 1)
+
+    async def _run():
+        try:
+            return await uploader.upload_intunewin_async(str(package), "Bench App", "Bench.App")
+        finally:
+            await async_uploader.close_session()
+
+    _assert_published(server, asyncio.run(_run()), package)
+
+
+def test_commit_fails_when_the_blob_is_incomplete(server):
+    headers = {"Authorization": "Bearer t"}
+    apps = f"{server.graph_base}/deviceAppManagement/mobileApps"
+    app_id = requests.post(apps, json={"displayName": "x"}, headers=headers).json()["id"]
+    versions = f"{apps}/{app_id}/microsoft.graph.win32LobApp/contentVersions"
+    version_id = requests.post(versions, json={}, headers=headers).json()["id"]
+    files = f"{versions}/{version_id}/files"
+    file_id = requests.post(files, json={"sizeEncrypted": 10}, headers=headers).json()["id"]
+
+    requests.put(f"{server.url}/container/{file_id}?comp=block&blockid=YQ==", data=b"x" * 4)
+    requests.put(f"{server.url}/container/{file_id}?comp=blocklist",
+                 data="<BlockList><Latest>YQ==</Latest></BlockList>")
+    commit = requests.post(f"{files}/{file_id}/commit", json={"fileEncryptionInfo": {"mac": "m"}},
+                           headers=headers)
+
+    assert commit.status_code == 204
+    assert requests.get(f"{files}/{file_id}", headers=headers).json()["uploadState"] == "commitFileFailed"
+    assert requests.get(f"{apps}/missing", headers=headers).status_code == 404
+    assert requests.get(f"{apps}/{app_id}").status_code == 401
+
+
+def test_b2_listing_and_range_downloads(monkeypatch):
+    with FakeIntuneServer() as server:
+        server.add_b2_file("apps/tool.intunewin", b"0123456789")
+        monkeypatch.setattr(backblaze_utils, "BACKBLAZE_ENDPOINT", server.url)
+        monkeypatch.setattr(backblaze_utils, "BACKBLAZE_BUCKET_NAME", server.bucket_name)
+        monkeypatch.setattr(backblaze_utils, "auth_cache", {"authorization_token": None, "expires_at": 0})
+        monkeypatch.setattr(backblaze_utils, "_file_listing_cache", {})
+        monkeypatch.setattr(backblaze_utils, "_download_auth_cache", {})
+
+        async def _run():
+            try:
+                return await backblaze_utils.get_file_download_info("apps/tool.intunewin")
+            finally:
+                await backblaze_utils.close_session()
+
+        info = asyncio.run(_run())
+        assert info["content_length"] == 10
+        assert requests.get(info["download_url"]).content == b"0123456789"
+        partial = requests.get(info["download_url"], headers={"Range": "bytes=2-4"})
+        assert (partial.status_code, partial.content) == (206, b"234")
+        assert partial.headers["Content-Range"] == "bytes 2-4/10"
+        assert server.request_counts()["b2"] == 5
@@ -0,0 +1,86 @@
+import json
+import threading
+import time
+
+import pytest
+
+from api.functions import auth, tenants
+from api.functions.fanout import deploy_to_tenants
+
+
+@pytest.fixture
+def profiles(tmp_path, monkeypatch):
+    path = tmp_path / "tenants.json"
+    path.write_text(json.dumps({
+        "contoso": {"tenant_id": "t-contoso", "client_id": "c1", "client_secret_env": "CONTOSO_SECRET"},
+        "fabrikam": {"tenant_id": "t-fabrikam", "client_id": "c2", "client_secret": "literal"},
+    }))
+    monkeypatch.setenv("GRAPH_TENANTS_FILE", str(path))
+    monkeypatch.setenv("CONTOSO_SECRET", "from-env")
+    monkeypatch.setenv("GRAPH_TENANT_ID", "t-default")
+    monkeypatch.setenv("GRAPH_CLIENT_ID", "c0")
+    monkeypatch.setenv("GRAPH_CLIENT_SECRET", "s0")
+    tenants.reload_profiles()
+    yield
+    tenants.reload_profiles()
+
+
+def test_profiles_are_loaded_from_file(profiles):
+    assert tenants.list_tenants() == ["default", "contoso", "fabrikam"]
+    assert tenants.get_tenant_profile("contoso")["client_secret"] == "from-env"
+    assert auth.get_auth_config("fabrikam")["authority"] == "https://login.microsoftonline.com/t-fabrikam"
+    with tenants.use_tenant("contoso"):
+        assert auth.get_auth_config()["tenant_id"] == "t-contoso"
+    assert auth.get_auth_config()["tenant_id"] == "t-default"
+    with pytest.raises(tenants.UnknownTenantError):
+        tenants.get_tenant_profile("nope")
+
+
+def test_token_caches_are_per_tenant(profiles, monkeypatch):
+    class _FakeApp:
+        def __init__(self, client_id, client_credential, authority):
+            self.authority = authority
+
+        def acquire_token_for_client(self, scopes):
+            return {"access_token": f"token-for-{self.authority.rsplit('/', 1)[1]}", "expires_in": 3600}
+
+    monkeypatch.setattr(auth, "_token_cache", {})
+    monkeypatch.setattr(auth, "_msal_apps", {})
+    monkeypatch.setattr(auth.msal, "ConfidentialClientApplication", _FakeApp)
+
+    assert auth.get_access_token(tenant="contoso") == "token-for-t-contoso"
+    with tenants.use_tenant("fabrikam"):
+        assert auth.get_access_token() == "token-for-t-fabrikam"
+    assert auth.get_access_token() == "token-for-t-default"
+    assert len(auth._msal_apps) == 3
+
+
+def test_fan_out_aggregates_per_tenant_results(profiles):
+    stages = []
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def _deploy(report):
+        tenant = tenants.get_current_tenant()
+        with lock:
+            running.append(tenant)
+            peak.append(len(running))
+        time.sleep(0.05)
+        report("uploading")
+        with lock:
+            running.remove(tenant)
+        if tenant == "fabrikam":
+            raise RuntimeError("throttled")
+        return f"app-{tenant}"
+
+    results = deploy_to_tenants(["contoso", "fabrikam", "default", "contoso"], _deploy,
+                                max_parallel=2, on_stage=stages.append)
+
+    assert list(results) == ["contoso", "fabrikam", "default"]
+    assert results["contoso"] == {"status": "succeeded", "result": "app-contoso"}
+    # The default profile runs with no tenant override
+    assert results["default"] == {"status": "succeeded", "result": "app-None"}
+    assert results["fabrikam"] == {"status": "failed", "error": "throttled"}
+    assert max(peak) <= 2
+    assert "fabrikam: failed" in stages and "contoso: uploading" in stages
@@ -0,0 +1,173 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+from api.benchmarks.fake_intune_server import FakeIntuneServer
+from api.functions import auth, graph_batch, graph_client, tenants
+from api.functions.graph_batch import BatchRequest, GraphBatcher, send_batch, send_batch_async
+from api.functions.graph_client import GraphRequestError
+
+BASE = "https://graph.example/beta"
+
+
+class _FakeGraph:
+    """Answers ``$batch`` calls; *statuses* maps request IDs to the status of their next answer."""
+
+    def __init__(self, statuses=None):
+        self.calls = []
+        self.statuses = statuses or {}
+        self.lock = threading.Lock()
+
+    def __call__(self, method, url, json=None, **kwargs):
+        with self.lock:
+            self.calls.append((method, url, json, tenants.get_current_tenant()))
+        if not url.endswith("/$batch"):
+            return {"url": url}
+        responses = []
+        for request in json["requests"]:
+            status = self.statuses.pop(request["id"], 200)
+            responses.append({"id": request["id"], "status": status,
+                              "headers": {"Retry-After": "0"} if status == 429 else {},
+                              "body": {"url": request["url"]}})
+        return {"responses": responses}
+
+
+def test_requests_are_sent_twenty_per_call_in_order():
+    graph = _FakeGraph()
+    requests = [BatchRequest("GET", f"{BASE}/deviceAppManagement/mobileApps/{i}?$select=id") for i in range(45)]
+
+    responses = send_batch(requests, send=graph)
+
+    assert [len(call[2]["requests"]) for call in graph.calls] == [20, 20, 5]
+    assert graph.calls[0][1] == f"{BASE}/$batch"
+    assert responses[44].body == {"url": "/deviceAppManagement/mobileApps/44?$select=id"}
+
+
+def test_depends_on_chains_stay_in_one_call():
+    graph = _FakeGraph()
+    requests = [BatchRequest("GET", f"{BASE}/a/{i}") for i in range(19)]
+    requests += [
+        BatchRequest("PATCH", f"{BASE}/apps/x", json={"v": 1}, request_id="patch"),
+        BatchRequest("GET", f"{BASE}/apps/x", depends_on=["patch"], request_id="get"),
+    ]
+
+    send_batch(requests, send=graph)
+
+    [_, _, second, _] = graph.calls[1]
+    assert [r["id"] for r in second["requests"]] == ["patch", "get"]
+    assert second["requests"][0]["headers"] == {"Content-Type": "application/json"}
+    assert second["requests"][1]["dependsOn"] == ["patch"]
+
+
+def test_invalid_dependencies_are_rejected():
+    with pytest.raises(ValueError):
+        send_batch([BatchRequest("GET", f"{BASE}/a", depends_on=["nope"])], send=_FakeGraph())
+    chain = [BatchRequest("GET", f"{BASE}/a", request_id="0")]
+    chain += [BatchRequest("GET", f"{BASE}/a", request_id=str(i), depends_on=[str(i - 1)]) for i in range(1, 21)]
+    with pytest.raises(ValueError):
+        send_batch(chain, send=_FakeGraph())
+
+
+def test_throttled_requests_are_resent_with_their_dependents():
+    graph = _FakeGraph(statuses={"2": 429, "3": 424})
+    requests = [
+        BatchRequest("GET", f"{BASE}/a", request_id="1"),
+        BatchRequest("GET", f"{BASE}/b", request_id="2", depends_on=["1"]),
+        BatchRequest("GET", f"{BASE}/c", request_id="3", depends_on=["2"]),
+    ]
+
+    responses = send_batch(requests, send=graph)
+
+    assert [r.status for r in responses] == [200, 200, 200]
+    retried = graph.calls[1][2]["requests"]
+    assert [(r["id"], r.get("dependsOn")) for r in retried] == [("2", None), ("3", ["2"])]
+
+
+def test_failed_sub_requests_raise_graph_errors():
+    [response] = send_batch([BatchRequest("GET", f"{BASE}/a"), BatchRequest("GET", f"{BASE}/b")],
+                            send=_FakeGraph(statuses={"2": 404}))[1:]
+    with pytest.raises(GraphRequestError) as excinfo:
+        response.result()
+    assert excinfo.value.status_code == 404
+
+
+def test_batcher_merges_concurrent_polls_per_tenant(tmp_path, monkeypatch):
+    path = tmp_path / "tenants.json"
+    path.write_text(json.dumps({"contoso": {"tenant_id": "t", "client_id": "c", "client_secret": "s"}}))
+    monkeypatch.setenv("GRAPH_TENANTS_FILE", str(path))
+    tenants.reload_profiles()
+    graph = _FakeGraph()
+    batcher = GraphBatcher(window=0.2, send=graph)
+    results = {}
+    start = threading.Barrier(12)
+
+    def _poll(i):
+        with tenants.use_tenant("contoso" if i >= 10 else None):
+            start.wait()
+            results[i] = batcher.request("GET", f"{BASE}/apps/{i}")
+
+    threads = [threading.Thread(target=_poll, args=(i,)) for i in range(12)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    tenants.reload_profiles()
+
+    assert results[3] == {"url": "/apps/3"}
+    assert sorted((len(call[2]["requests"]), call[3]) for call in graph.calls) == [(2, "contoso"), (10, None)]
+
+
+def test_async_batcher_merges_coroutine_polls():
+    graph = _FakeGraph()
+
+    async def _send(method, url, json=None, **kwargs):
+        return graph(method, url, json=json)
+
+    async def _run():
+        batcher = graph_batch.AsyncGraphBatcher(_send, window=0.05)
+        return await asyncio.gather(*(batcher.request("GET", f"{BASE}/apps/{i}") for i in range(25)))
+
+    results = asyncio.run(_run())
+
+    assert results[24] == {"url": "/apps/24"}
+    assert [len(call[2]["requests"]) for call in graph.calls] == [20, 5]
+    assert asyncio.run(send_batch_async([BatchRequest("GET", f"{BASE}/x")], send=_send))[0].body == {
+        "url": f"{BASE}/x"}
+
+
+def test_bulk_operations_use_one_call(monkeypatch):
+    with FakeIntuneServer() as server:
+        monkeypatch.setattr(graph_client, "GRAPH_BASE", server.graph_base)
+        monkeypatch.setattr(auth, "GRAPH_STATIC_TOKEN", "test-token")
+        app_ids = [server._create_app({"displayName": f"App {i}"})["id"] for i in range(3)]
+        before = server.request_counts()["graph"]
+
+        statuses = graph_batch.get_app_statuses(app_ids + ["missing"])
+        assigned = graph_batch.assign_apps(app_ids, ["allDevices", "group-1"])
+        deleted = graph_batch.delete_apps(app_ids[:2])
+
+        assert set(statuses["apps"]) == set(app_ids)
+        assert statuses["apps"][app_ids[0]]["publishingState"] == "notPublished"
+        assert list(statuses["failed"]) == ["missing"]
+        assert assigned == {"assigned": app_ids, "failed": {}}
+        assert server.apps[app_ids[2]]["assignments"][1]["target"]["groupId"] == "group-1"
+        assert deleted == {"deleted": app_ids[:2], "failed": {}}
+        assert list(server.apps) == [app_ids[2]]
+        assert server.request_counts()["graph"] - before == 3
+
+
+def test_batch_root_follows_a_graph_base_with_a_deeper_path(monkeypatch):
+    base = "https://proxy.example/tenant-a/graph/beta"
+    monkeypatch.setattr(graph_client, "GRAPH_BASE", base)
+    graph = _FakeGraph()
+
+    requests = [BatchRequest("GET", f"{root}/deviceAppManagement/mobileApps/{i}?$select=id")
+                for root in (base, BASE) for i in range(2)]
+
+    responses = send_batch(requests, send=graph)
+
+    assert sorted(call[1] for call in graph.calls) == [f"{BASE}/$batch", f"{base}/$batch"]
+    assert [r.body["url"] for r in responses] == ["/deviceAppManagement/mobileApps/0?$select=id",
+                                                  "/deviceAppManagement/mobileApps/1?$select=id"] * 2
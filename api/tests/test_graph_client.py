@@ -0,0 +1,84 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from api.functions import graph_client
+from api.functions.graph_client import GraphClient, GraphRequestError, endpoint_key
+
+
+class _GraphHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    peers = set()
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        _GraphHandler.peers.add(self.client_address)
+        if self.path.startswith("/throttled"):
+            body = b'{"error": {"code": "TooManyRequests"}}'
+            self.send_response(429)
+            self.send_header("Retry-After", "7")
+        else:
+            body = b'{"publishingState": "published"}'
+            self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def graph_server(monkeypatch):
+    monkeypatch.setattr(graph_client, "get_auth_headers", lambda: {"Authorization": "Bearer test"})
+    _GraphHandler.peers = set()
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _GraphHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_endpoint_key_collapses_ids():
+    url = ("https://graph.microsoft.com/beta/deviceAppManagement/mobileApps/"
+           "0f8fad5b-d9cb-469f-a165-70867728950e/microsoft.graph.win32LobApp/contentVersions/1")
+    assert endpoint_key("get", url) == (
+        "GET /beta/deviceAppManagement/mobileApps/{id}/microsoft.graph.win32LobApp/contentVersions/{id}"
+    )
+
+
+def test_requests_reuse_one_connection_and_record_latency(graph_server):
+    client = GraphClient(http2=False)
+    for _ in range(5):
+        assert client.request("GET", f"{graph_server}/apps/1")["publishingState"] == "published"
+    client.close()
+
+    assert len(_GraphHandler.peers) == 1
+    stats = client.metrics.snapshot()["GET /apps/{id}"]
+    assert stats["count"] == 5 and stats["errors"] == 0
+    assert stats["max_seconds"] >= stats["avg_seconds"] > 0
+
+
+def test_error_carries_status_and_retry_after(graph_server):
+    client = GraphClient(http2=False)
+    with pytest.raises(GraphRequestError) as info:
+        client.request("GET", f"{graph_server}/throttled")
+    client.close()
+
+    assert info.value.status_code == 429
+    assert info.value.retry_after == 7
+    assert client.metrics.snapshot()["GET /throttled"]["errors"] == 1
+
+
+def test_httpx_transport_errors_surface_as_requests_exceptions(graph_server):
+    pytest.importorskip("httpx")
+    pytest.importorskip("h2")
+    client = GraphClient(http2=True, connect_timeout=0.5, read_timeout=0.5)
+    assert client.backend == "httpx-http2"
+    # Nothing listens on port 1, so the connection is refused
+    with pytest.raises(requests.ConnectionError):
+        client.request("GET", "http://127.0.0.1:1/apps/1")
+    client.close()
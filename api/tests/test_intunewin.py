@@ -0,0 +1,49 @@
+import zipfile
+from pathlib import Path
+
+import pytest
+
+from api.functions.intunewin import CONTENTS_DIR, DETECTION_XML, read_intunewin
+
+SAMPLE = Path(__file__).resolve().parent.parent / "files" / "Winget-InstallPackage.intunewin"
+
+
+def _build_package(tmp_path, payload: bytes, compression: int) -> Path:
+    with zipfile.ZipFile(SAMPLE) as src:
+        detection = src.read(DETECTION_XML)
+        file_name = src.namelist()[0][len(CONTENTS_DIR):]
+    target = tmp_path / "package.intunewin"
+    with zipfile.ZipFile(target, "w") as zf:
+        zf.writestr(zipfile.ZipInfo(CONTENTS_DIR + file_name), payload, compress_type=compression)
+        zf.writestr(DETECTION_XML, detection)
+    return target
+
+
+def test_sample_package_streams_stored_payload_in_place():
+    meta, payload = read_intunewin(SAMPLE)
+    with zipfile.ZipFile(SAMPLE) as zf:
+        expected = zf.read(CONTENTS_DIR + meta["file_name"])
+
+    assert payload.seekable
+    assert payload.size == len(expected)
+    assert b"".join(payload.iter_blocks(64)) == expected
+
+
+@pytest.mark.parametrize("compression", [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED])
+def test_payload_blocks_match_member(tmp_path, compression):
+    data = bytes(range(256)) * 1000
+    meta, payload = read_intunewin(_build_package(tmp_path, data, compression))
+
+    assert payload.seekable == (compression == zipfile.ZIP_STORED)
+    assert payload.size == len(data)
+    blocks = list(payload.iter_blocks(10000))
+    assert all(len(b) == 10000 for b in blocks[:-1])
+    assert b"".join(blocks) == data
+
+
+def test_missing_payload_member_raises(tmp_path):
+    target = tmp_path / "broken.intunewin"
+    with zipfile.ZipFile(SAMPLE) as src, zipfile.ZipFile(target, "w") as zf:
+        zf.writestr(DETECTION_XML, src.read(DETECTION_XML))
+    with pytest.raises(FileNotFoundError):
+        read_intunewin(target)
@@ -0,0 +1,90 @@
+import pytest
+
+from api.benchmarks.fake_blob_server import FakeBlobServer
+from api.functions import deploy_pipeline, metrics
+from api.functions import intune_win32_uploader as uploader
+from api.functions.blob_uploader import upload_blocks
+
+WIN32_STAGES = ["parse_package", "create_app", "create_content_version", "create_file",
+                "wait_storage_uri", "upload_blob", "commit_file", "wait_commit",
+                "commit_content_version", "wait_published"]
+
+
+def test_render_prometheus_text_format():
+    registry = metrics.Registry()
+    requests = registry.counter("demo_requests_total", "Requests.", ("path",))
+    latency = registry.histogram("demo_seconds", "Latency.", ("path",), buckets=(0.1, 1))
+    requests.inc(path='/a"b')
+    requests.inc(2, path='/a"b')
+    for value in (0.05, 0.5, 5):
+        latency.observe(value, path="/x")
+
+    assert registry.render().splitlines() == [
+        "# HELP demo_requests_total Requests.",
+        "# TYPE demo_requests_total counter",
+        'demo_requests_total{path="/a\\"b"} 3',
+        "# HELP demo_seconds Latency.",
+        "# TYPE demo_seconds histogram",
+        'demo_seconds_bucket{path="/x",le="0.1"} 1',
+        'demo_seconds_bucket{path="/x",le="1"} 2',
+        'demo_seconds_bucket{path="/x",le="+Inf"} 3',
+        'demo_seconds_sum{path="/x"} 5.55',
+        'demo_seconds_count{path="/x"} 3',
+    ]
+    with pytest.raises(ValueError):
+        requests.inc(wrong="label")
+
+
+def test_deploy_timer_records_each_stage_and_the_failure():
+    timer = metrics.DeployTimer("test_pipeline")
+    with pytest.raises(RuntimeError):
+        with timer.run():
+            with timer.span("fast"):
+                pass
+            with timer.span("broken"):
+                raise RuntimeError("boom")
+
+    assert [(s["stage"], s["outcome"]) for s in timer.spans] == [("fast", "ok"), ("broken", "error")]
+    assert metrics.DEPLOY_STAGE_SECONDS.count(pipeline="test_pipeline", stage="broken", outcome="error") == 1
+    assert metrics.DEPLOY_SECONDS.count(pipeline="test_pipeline", outcome="error") == 1
+
+
+def test_win32_upload_times_all_ten_stages(monkeypatch, tmp_path):
+    package = tmp_path / "app.intunewin"
+    package.write_bytes(b"")
+    monkeypatch.setattr(uploader, "_parse_detection_xml", lambda path: ({"file_name": "setup.exe"}, object()))
+    fakes = {
+        "create_app": lambda self, body: "app-1",
+        "create_content_version": lambda self, app_id: "1",
+        "create_file_placeholder": lambda self, *args: {"id": "file-1"},
+        "wait_for_storage_uri": lambda self, *args: {"id": "file-1", "azureStorageUri": "https://blob"},
+        "upload_blob": lambda self, *args: None,
+        "commit_file": lambda self, *args: None,
+        "wait_for_commit": lambda self, *args: None,
+        "commit_content_version": lambda self, *args: None,
+        "wait_for_published": lambda self, *args: None,
+    }
+    for name, fake in fakes.items():
+        monkeypatch.setattr(deploy_pipeline.DeploySteps, name, fake)
+    monkeypatch.setattr(deploy_pipeline, "get_checkpoint_store", lambda: None)
+    before = {s: metrics.DEPLOY_STAGE_SECONDS.count(pipeline="win32", stage=s, outcome="ok")
+              for s in WIN32_STAGES}
+
+    assert uploader.upload_intunewin(str(package), "App", "Vendor.App") == "app-1"
+
+    for stage in WIN32_STAGES:
+        assert metrics.DEPLOY_STAGE_SECONDS.count(pipeline="win32", stage=stage, outcome="ok") == before[stage] + 1
+    assert 'intune_deploy_stage_duration_seconds_bucket{pipeline="win32",stage="wait_published"' \
+        in metrics.render_metrics()
+
+
+def test_blob_upload_counts_bytes_and_requests():
+    uploaded = metrics.BLOB_UPLOAD_BYTES.value()
+    puts = metrics.BLOB_REQUESTS.value(operation="block", status="201")
+
+    with FakeBlobServer() as server:
+        upload_blocks(iter([b"a" * 100, b"b" * 50]), server.sas_uri("metrics"), max_workers=2)
+
+    assert metrics.BLOB_UPLOAD_BYTES.value() == uploaded + 150
+    assert metrics.BLOB_REQUESTS.value(operation="block", status="201") == puts + 2
+    assert metrics.BLOB_REQUEST_SECONDS.count(operation="blocklist") >= 1
@@ -0,0 +1,67 @@
+import hashlib
+import os
+import threading
+import time
+
+import pytest
+
+from api.functions.package_cache import CacheValidationError, PackageCache, cache_key
+
+
+def _downloader(data: bytes, calls: list, delay: float = 0.0):
+    def _download(fh):
+        calls.append(1)
+        time.sleep(delay)
+        fh.write(data)
+    return _download
+
+
+def test_concurrent_fills_share_one_download(tmp_path):
+    cache = PackageCache(tmp_path, max_bytes=10_000)
+    data = b"package" * 100
+    calls, paths = [], []
+
+    def _deploy():
+        with cache.package("sha1-x", _downloader(data, calls, delay=0.2),
+                           expected_size=len(data),
+                           expected_sha1=hashlib.sha1(data).hexdigest()) as path:
+            paths.append(path.read_bytes())
+
+    threads = [threading.Thread(target=_deploy) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1
+    assert paths == [data] * 5
+    assert cache.stats()["hits"] == 4 and cache.stats()["misses"] == 1
+
+
+def test_lru_eviction_keeps_recently_used(tmp_path):
+    cache = PackageCache(tmp_path, max_bytes=250)
+    calls = []
+    for key in ("a", "b"):
+        with cache.package(key, _downloader(b"x" * 100, calls)):
+            pass
+    # Make "a" the most recently used entry
+    os.utime(cache.path_for("b"), (1, 1))
+    with cache.package("c", _downloader(b"y" * 100, calls)):
+        pass
+
+    assert cache.path_for("a").exists()
+    assert not cache.path_for("b").exists()
+    assert cache.path_for("c").exists()
+
+
+def test_corrupt_download_is_not_cached(tmp_path):
+    cache = PackageCache(tmp_path)
+    with pytest.raises(CacheValidationError):
+        with cache.package("k", _downloader(b"short", []), expected_size=100):
+            pass
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_cache_key_prefers_content_sha1():
+    assert cache_key("4_z123", "ABCDEF") == "sha1-abcdef"
+    assert cache_key("4_z123/../x", None) == "id-4_z123_.._x"
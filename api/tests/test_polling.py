@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+from api.functions.graph_client import GraphRequestError
+from api.functions.polling import Poller, get_poll_stats
+
+
+class _FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def __call__(self):
+        return self.now
+
+
+def _poller(clock, **kwargs):
+    kwargs.setdefault("jitter", 0)
+    return Poller(sleep=clock.sleep, clock=clock, **kwargs)
+
+
+def test_backs_off_exponentially_up_to_ceiling():
+    clock = _FakeClock()
+    results = iter([{}] * 5 + [{"done": True}])
+
+    data = _poller(clock, initial=1, max_interval=4, factor=2, deadline=100).poll(
+        lambda: next(results), lambda d: d.get("done"), stage="test-backoff",
+    )
+
+    assert data == {"done": True}
+    assert clock.sleeps == [1, 2, 4, 4, 4]
+    assert get_poll_stats()["test-backoff"]["last_polls"] == 6
+
+
+def test_returns_immediately_when_already_done():
+    clock = _FakeClock()
+    _poller(clock).poll(lambda: {"ok": 1}, lambda d: True, stage="test-fast")
+    assert clock.sleeps == []
+
+
+def test_honours_retry_after_on_throttling():
+    clock = _FakeClock()
+    calls = iter([GraphRequestError("throttled", status_code=429, retry_after=30), {"ok": 1}])
+
+    def _fetch():
+        item = next(calls)
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    _poller(clock, initial=1, deadline=100).poll(_fetch, lambda d: True, stage="test-throttle")
+    assert clock.sleeps == [30]
+
+
+def test_deadline_raises_timeout():
+    clock = _FakeClock()
+    with pytest.raises(TimeoutError, match="nope"):
+        _poller(clock, initial=5, max_interval=5, deadline=12).poll(
+            lambda: {}, lambda d: False, stage="test-timeout", timeout_message="nope",
+        )
+    assert sum(clock.sleeps) == 12
+    assert get_poll_stats()["test-timeout"]["timeouts"] == 1
+
+
+def test_poll_async_backs_off_and_honours_throttling():
+    clock = _FakeClock()
+
+    async def _sleep(seconds):
+        clock.sleep(seconds)
+
+    calls = iter([{}, GraphRequestError("throttled", status_code=429, retry_after=30), {"done": True}])
+
+    async def _fetch():
+        item = next(calls)
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    poller = Poller(initial=1, factor=2, jitter=0, deadline=100, clock=clock, async_sleep=_sleep)
+    data = asyncio.run(poller.poll_async(_fetch, lambda d: d.get("done"), stage="test-async"))
+    assert data == {"done": True}
+    assert clock.sleeps == [1, 30]
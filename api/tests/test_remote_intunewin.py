@@ -0,0 +1,115 @@
+import io
+import re
+import threading
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from api.benchmarks.fake_blob_server import FakeBlobServer
+from api.functions import remote_intunewin
+from api.functions.blob_uploader import upload_blocks
+from api.functions.intunewin import CONTENTS_DIR, DETECTION_XML
+from api.functions.metrics import PACKAGE_DOWNLOAD_BYTES
+from api.functions.remote_intunewin import RangeNotSupportedError, read_remote_intunewin
+
+from .test_intunewin import SAMPLE
+
+
+def _serve(data: bytes, honour_range: bool = True, cut_after: int = 0):
+    """Serve *data*; with *cut_after*, the first large response drops its connection early."""
+    cuts = [cut_after] if cut_after else []
+
+    class _Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+            if honour_range and match:
+                start, end = int(match.group(1)), min(int(match.group(2) or len(data)), len(data) - 1)
+                body = data[start:end + 1]
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+            else:
+                body = data
+                self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            if cuts and len(body) > cuts[0]:
+                body = body[:cuts.pop()]
+                self.close_connection = True
+            self.end_headers()
+            self.wfile.write(body)
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd, f"http://127.0.0.1:{httpd.server_address[1]}/file/bucket/app.intunewin?Authorization=x"
+
+
+def _package(payload: bytes, compression: int) -> bytes:
+    with zipfile.ZipFile(SAMPLE) as src:
+        detection = src.read(DETECTION_XML)
+        file_name = src.namelist()[0][len(CONTENTS_DIR):]
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        zf.writestr(zipfile.ZipInfo(CONTENTS_DIR + file_name), payload, compress_type=compression)
+        zf.writestr(DETECTION_XML, detection)
+    return buf.getvalue()
+
+
+@pytest.mark.parametrize("compression", [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED])
+def test_remote_payload_streams_into_blob(compression):
+    payload = bytes(range(256)) * 4096  # 1 MiB
+    httpd, url = _serve(_package(payload, compression))
+    try:
+        meta, member = read_remote_intunewin(url)
+        assert meta["file_name"] == "IntunePackage.intunewin"
+        assert member.size == len(payload)
+
+        with FakeBlobServer() as blob:
+            total = upload_blocks(member.iter_blocks(100_000), blob.sas_uri(), max_workers=4)
+            ids = blob.committed["/container/payload"]
+            assert total == len(payload)
+            assert [blob.staged["/container/payload"][b] for b in ids][:-1] == [100_000] * (len(ids) - 1)
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_origin_without_range_support_is_rejected():
+    httpd, url = _serve(SAMPLE.read_bytes(), honour_range=False)
+    before = PACKAGE_DOWNLOAD_BYTES.value(mode="ranged")
+    try:
+        with pytest.raises(RangeNotSupportedError):
+            read_remote_intunewin(url)
+        # the full-object response is closed unread, not counted as ranged bytes
+        assert PACKAGE_DOWNLOAD_BYTES.value(mode="ranged") == before
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_broken_payload_stream_resumes_from_last_byte(monkeypatch):
+    monkeypatch.setattr(remote_intunewin, "REMOTE_RETRY_BACKOFF", 0)
+    payload = bytes(range(256)) * 4096
+    httpd, url = _serve(_package(payload, zipfile.ZIP_STORED), cut_after=300_000)
+    try:
+        meta, member = read_remote_intunewin(url)
+        assert b"".join(member.iter_blocks(100_000)) == payload
+        assert member.bytes_downloaded == len(payload)
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_unsupported_compression_is_a_value_error():
+    httpd, url = _serve(_package(b"payload", zipfile.ZIP_BZIP2))
+    try:
+        _, member = read_remote_intunewin(url)
+        with pytest.raises(ValueError):
+            next(member.iter_blocks(100_000))
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+
+from api.functions.search_cache import AsyncTTLCache, normalize_search_term
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_concurrent_misses_share_one_lookup():
+    cache = AsyncTTLCache(max_entries=10, ttl=60)
+    calls = []
+
+    async def _lookup():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return ["chrome"]
+
+    async def _run():
+        return await asyncio.gather(*(cache.get_or_load("chrome", _lookup) for _ in range(20)))
+
+    results = asyncio.run(_run())
+
+    assert results == [["chrome"]] * 20
+    assert len(calls) == 1
+    stats = cache.stats()
+    assert (stats["misses"], stats["coalesced"], stats["hits"]) == (1, 19, 0)
+
+
+def test_entries_expire_and_are_evicted_lru():
+    clock = _Clock()
+    cache = AsyncTTLCache(max_entries=2, ttl=10, clock=clock)
+    calls = []
+
+    def _loader(value):
+        async def _load():
+            calls.append(value)
+            return value
+        return _load
+
+    async def _run():
+        await cache.get_or_load("a", _loader("a"))
+        await cache.get_or_load("b", _loader("b"))
+        await cache.get_or_load("a", _loader("a"))   # hit, "a" becomes most recent
+        await cache.get_or_load("c", _loader("c"))   # evicts "b"
+        await cache.get_or_load("b", _loader("b"))   # miss again
+        clock.now = 11
+        await cache.get_or_load("c", _loader("c"))   # expired
+
+    asyncio.run(_run())
+
+    assert calls == ["a", "b", "c", "b", "c"]
+    assert cache.stats()["hits"] == 1
+
+
+def test_failed_lookups_are_not_cached():
+    cache = AsyncTTLCache()
+    attempts = []
+
+    async def _flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("winget failed")
+        return []
+
+    async def _run():
+        with pytest.raises(RuntimeError):
+            await cache.get_or_load("x", _flaky)
+        return await cache.get_or_load("x", _flaky)
+
+    assert asyncio.run(_run()) == []
+    assert len(attempts) == 2
+
+
+def test_cancelled_caller_does_not_fail_coalesced_waiters():
+    cache = AsyncTTLCache()
+
+    async def _lookup():
+        await asyncio.sleep(0.05)
+        return ["chrome"]
+
+    async def _run():
+        leader = asyncio.ensure_future(cache.get_or_load("chrome", _lookup))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(cache.get_or_load("chrome", _lookup))
+        await asyncio.sleep(0)
+        leader.cancel()  # e.g. the first /search client disconnected
+        return await waiter
+
+    assert asyncio.run(_run()) == ["chrome"]
+    assert cache.peek("chrome") == ["chrome"]
+
+
+def test_empty_results_expire_quickly():
+    clock = _Clock()
+    cache = AsyncTTLCache(ttl=300, empty_ttl=10, clock=clock)
+    calls = []
+
+    async def _lookup():
+        calls.append(1)
+        return []
+
+    async def _run():
+        await cache.get_or_load("nothing", _lookup)
+        clock.now = 5
+        await cache.get_or_load("nothing", _lookup)   # still fresh
+        clock.now = 11
+        await cache.get_or_load("nothing", _lookup)   # an empty result is retried soon
+
+    asyncio.run(_run())
+    assert len(calls) == 2
+
+
+def test_normalize_search_term():
+    assert normalize_search_term('  "Google   Chrome" ') == "google chrome"
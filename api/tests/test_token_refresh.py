@@ -0,0 +1,134 @@
+import asyncio
+import threading
+import time
+from collections import Counter
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from api.functions import auth, backblaze_utils
+
+
+class _FakeTokenEndpoint:
+    """Stands in for msal.ConfidentialClientApplication; counts token requests."""
+
+    instances = 0
+
+    def __init__(self, client_id, client_credential, authority, expires_in=3600, delay=0.2):
+        type(self).instances += 1
+        self.calls = 0
+        self.expires_in = expires_in
+        self.delay = delay
+        self._lock = threading.Lock()
+
+    def acquire_token_for_client(self, scopes):
+        with self._lock:
+            self.calls += 1
+            n = self.calls
+        time.sleep(self.delay)
+        return {"access_token": f"token-{n}", "expires_in": self.expires_in}
+
+
+@pytest.fixture
+def graph_env(monkeypatch):
+    monkeypatch.setenv("GRAPH_CLIENT_ID", "client")
+    monkeypatch.setenv("GRAPH_CLIENT_SECRET", "secret")
+    monkeypatch.setenv("GRAPH_TENANT_ID", "tenant")
+    monkeypatch.setattr(auth, "_token_cache", {})
+    monkeypatch.setattr(auth, "_msal_apps", {})
+    monkeypatch.setattr(_FakeTokenEndpoint, "instances", 0)
+    monkeypatch.setattr(auth.msal, "ConfidentialClientApplication", _FakeTokenEndpoint)
+
+
+def _only_app():
+    (app,) = auth._msal_apps.values()
+    return app
+
+
+def test_concurrent_graph_callers_share_one_refresh(graph_env):
+    tokens = []
+    threads = [threading.Thread(target=lambda: tokens.append(auth.get_access_token())) for _ in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert tokens == ["token-1"] * 10
+    assert _only_app().calls == 1
+    # The MSAL app (and its internal cache) is reused on the next refresh
+    auth._token_cache.clear()
+    assert auth.get_access_token() == "token-2"
+    assert _FakeTokenEndpoint.instances == 1
+
+
+def test_graph_token_is_refreshed_in_background_before_expiry(graph_env, monkeypatch):
+    assert auth.get_access_token() == "token-1"
+    # Pretend the token only has two minutes left: still served, refreshed behind the scenes
+    auth._token_cache[("default", ("https://graph.microsoft.com/.default",))]["expires_at"] = time.time() + 120
+
+    assert auth.get_access_token() == "token-1"
+    assert auth.get_access_token() == "token-1"
+    deadline = time.time() + 5
+    while auth.get_access_token() != "token-2" and time.time() < deadline:
+        time.sleep(0.05)
+
+    assert auth.get_access_token() == "token-2"
+    assert _only_app().calls == 2
+
+
+@pytest.fixture
+def b2_auth(monkeypatch):
+    monkeypatch.setattr(backblaze_utils, "auth_cache", {
+        "authorization_token": None, "api_url": None, "download_url": None, "expires_at": 0})
+    calls = Counter()
+
+    async def authorize(request):
+        calls["authorize"] += 1
+        await asyncio.sleep(0.1)
+        base = str(request.url.origin())
+        return web.json_response({
+            "authorizationToken": f"acct-{calls['authorize']}", "apiUrl": base, "downloadUrl": base})
+
+    app = web.Application()
+    app.router.add_get("/b2api/v2/b2_authorize_account", authorize)
+    return app, calls
+
+
+def test_concurrent_b2_callers_share_one_authorization(b2_auth, monkeypatch):
+    app, calls = b2_auth
+
+    async def _run():
+        async with TestServer(app) as server:
+            monkeypatch.setattr(backblaze_utils, "BACKBLAZE_ENDPOINT", str(server.make_url("")).rstrip("/"))
+            try:
+                return await asyncio.gather(*(backblaze_utils.get_auth_token() for _ in range(10)))
+            finally:
+                await backblaze_utils.close_session()
+
+    results = asyncio.run(_run())
+
+    assert {r["authorization_token"] for r in results} == {"acct-1"}
+    assert calls["authorize"] == 1
+
+
+def test_b2_token_is_refreshed_in_background_before_expiry(b2_auth, monkeypatch):
+    app, calls = b2_auth
+
+    async def _run():
+        async with TestServer(app) as server:
+            monkeypatch.setattr(backblaze_utils, "BACKBLAZE_ENDPOINT", str(server.make_url("")).rstrip("/"))
+            try:
+                await backblaze_utils.get_auth_token()
+                backblaze_utils.auth_cache["expires_at"] = time.time() + 60
+                stale = await asyncio.gather(*(backblaze_utils.get_auth_token() for _ in range(5)))
+                await backblaze_utils._background_refresh
+                return stale, await backblaze_utils.get_auth_token()
+            finally:
+                await backblaze_utils.close_session()
+
+    stale, fresh = asyncio.run(_run())
+
+    assert {r["authorization_token"] for r in stale} == {"acct-1"}
+    assert fresh["authorization_token"] == "acct-2"
+    assert calls["authorize"] == 2
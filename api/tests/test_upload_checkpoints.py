@@ -0,0 +1,137 @@
+import pytest
+
+from api.benchmarks.fake_blob_server import FakeBlobServer
+from api.functions import deploy_pipeline, upload_checkpoints
+from api.functions import intune_win32_uploader as uploader
+from api.functions.blob_uploader import block_id
+from api.functions.deploy_jobs import STAGE_COMMITTING
+from api.functions.graph_client import GraphRequestError
+from api.functions.upload_checkpoints import UploadCheckpoint, UploadCheckpointStore
+
+
+def test_store_round_trip_and_ttl(tmp_path):
+    now = [1000.0]
+    store = UploadCheckpointStore(str(tmp_path / "cp.sqlite"), ttl=60, clock=lambda: now[0])
+    key = upload_checkpoints.checkpoint_key("win32", "tenant-a", "Vendor.App", "digest", 10)
+    assert key != upload_checkpoints.checkpoint_key("win32", "tenant-b", "Vendor.App", "digest", 10)
+
+    store.save(UploadCheckpoint(key, "app-1", "1", "file-1", "https://blob?sig", sas_issued_at=990.0))
+    store.add_block(key, block_id(0), 4)
+    store.add_block(key, block_id(1), 4)
+
+    checkpoint = store.get(key)
+    assert (checkpoint.app_id, checkpoint.version_id, checkpoint.file_id) == ("app-1", "1", "file-1")
+    assert checkpoint.blocks == {block_id(0): 4, block_id(1): 4}
+    assert checkpoint.to_dict()["bytes"] == 8
+
+    now[0] += 61
+    assert store.get(key) is None
+    assert store.list() == []
+    store.close()
+
+
+class _Payload:
+    """Encrypted payload that can be told to break off after a number of blocks."""
+
+    def __init__(self, blocks, fail_after=None):
+        self.blocks = blocks
+        self.fail_after = fail_after
+        self.size = sum(len(b) for b in blocks)
+
+    def iter_blocks(self, block_size):
+        for idx, block in enumerate(self.blocks):
+            if idx == self.fail_after:
+                raise ConnectionError("download interrupted")
+            yield block
+
+
+@pytest.fixture
+def fake_intune(monkeypatch, tmp_path):
+    """Fake the Graph side of a win32 upload; the Azure side is a FakeBlobServer."""
+    store = UploadCheckpointStore(str(tmp_path / "cp.sqlite"))
+    monkeypatch.setattr(deploy_pipeline, "get_checkpoint_store", lambda: store)
+    calls = {"create_app": 0}
+
+    with FakeBlobServer() as server:
+        def _create_app(self, body):
+            calls["create_app"] += 1
+            return f"app-{calls['create_app']}"
+
+        fakes = {
+            "create_app": _create_app,
+            "create_content_version": lambda self, app_id: "1",
+            "create_file_placeholder": lambda self, *args: {"id": "file-1"},
+            "wait_for_storage_uri": lambda self, *args: {"id": "file-1", "azureStorageUri": server.sas_uri()},
+            "get_file": lambda self, *args: {},
+            "commit_file": lambda self, *args: None,
+            "wait_for_commit": lambda self, *args: None,
+            "commit_content_version": lambda self, *args: None,
+            "wait_for_published": lambda self, *args: None,
+        }
+        for name, fake in fakes.items():
+            monkeypatch.setattr(deploy_pipeline.DeploySteps, name, fake)
+        yield server, store, calls
+    store.close()
+
+
+def _deploy(monkeypatch, tmp_path, payload):
+    package = tmp_path / "app.intunewin"
+    package.write_bytes(b"")
+    meta = {"file_name": "setup.exe", "file_digest": "digest"}
+    monkeypatch.setattr(uploader, "_parse_detection_xml", lambda path: (meta, payload))
+    return uploader.upload_intunewin(str(package), "App", "Vendor.App")
+
+
+def test_interrupted_upload_resumes_with_the_missing_blocks(fake_intune, tmp_path, monkeypatch):
+    server, store, calls = fake_intune
+    blocks = [bytes([i]) * 8 for i in range(5)]
+
+    with pytest.raises(ConnectionError):
+        _deploy(monkeypatch, tmp_path, _Payload(blocks, fail_after=3))
+    [checkpoint] = store.list()
+    assert checkpoint.blocks == {block_id(i): 8 for i in range(3)}
+
+    requests_before = server.requests
+    assert _deploy(monkeypatch, tmp_path, _Payload(blocks)) == "app-1"
+
+    assert calls["create_app"] == 1
+    # the block list lookup, the two missing blocks and the commit
+    assert server.requests - requests_before == 4
+    assert server.committed["/container/payload"] == [block_id(i) for i in range(5)]
+    assert store.list() == []
+
+
+def test_resume_after_the_file_commit_skips_the_upload(fake_intune, tmp_path, monkeypatch):
+    server, store, calls = fake_intune
+    monkeypatch.setattr(deploy_pipeline.DeploySteps, "upload_blob", lambda *args: pytest.fail("re-uploaded"))
+    key = upload_checkpoints.checkpoint_key("win32", None, "Vendor.App", "App", "digest", 8)
+    store.save(UploadCheckpoint(key, "app-7", "1", "file-1", server.sas_uri(), 0.0, stage=STAGE_COMMITTING))
+
+    assert _deploy(monkeypatch, tmp_path, _Payload([b"x" * 8])) == "app-7"
+    assert calls["create_app"] == 0
+    assert store.get(key) is None
+
+
+def test_stale_sas_uri_is_renewed_before_resuming(fake_intune, tmp_path, monkeypatch):
+    server, store, calls = fake_intune
+    monkeypatch.setattr(deploy_pipeline.DeploySteps, "renew_storage_uri",
+                        lambda *args: {"azureStorageUri": server.sas_uri("renewed")})
+    key = upload_checkpoints.checkpoint_key("win32", None, "Vendor.App", "App", "digest", 8)
+    store.save(UploadCheckpoint(key, "app-7", "1", "file-1", server.sas_uri(), sas_issued_at=0.0))
+
+    assert _deploy(monkeypatch, tmp_path, _Payload([b"x" * 8])) == "app-7"
+    assert server.committed["/container/renewed"] == [block_id(0)]
+
+
+def test_deleted_app_starts_a_fresh_upload(fake_intune, tmp_path, monkeypatch):
+    server, store, calls = fake_intune
+
+    def _gone(self, *args):
+        raise GraphRequestError("Not found", 404)
+
+    monkeypatch.setattr(deploy_pipeline.DeploySteps, "get_file", _gone)
+    key = upload_checkpoints.checkpoint_key("win32", None, "Vendor.App", "App", "digest", 8)
+    store.save(UploadCheckpoint(key, "app-deleted", "1", "file-1", server.sas_uri(), 0.0))
+
+    assert _deploy(monkeypatch, tmp_path, _Payload([b"x" * 8])) == "app-1"
+    assert calls["create_app"] == 1
@@ -0,0 +1,124 @@
+import asyncio
+import sys
+import time
+
+import pytest
+
+from api.functions import winget
+from api.functions.winget import parse_winget_show, parse_winget_table
+
+OUTPUT = [
+    "   - \r   \\ \r",
+    "Name              Id                    Version   Source\r\n",
+    "--------------------------------------------------------\n",
+    "Google Chrome     Google.Chrome         120.0.1   winget\n",
+    "\n",
+    "Chrome Remote     Google.ChromeRemote   1.0       winget\n",
+]
+
+
+def test_parser_yields_rows_lazily():
+    consumed = []
+
+    def _lines():
+        for line in OUTPUT:
+            consumed.append(line)
+            yield line
+
+    rows = parse_winget_table(_lines())
+    first = next(rows)
+
+    assert first == {"Name": "Google Chrome", "Id": "Google.Chrome", "Version": "120.0.1", "Source": "winget"}
+    # Nothing past the first data row has been read yet
+    assert len(consumed) == 4
+    assert [r["Id"] for r in rows] == ["Google.ChromeRemote"]
+
+
+def test_parser_without_header_yields_nothing():
+    assert list(parse_winget_table(["No package found matching input criteria."])) == []
+
+
+def _fake_winget(monkeypatch, exit_code):
+    # Prints the table while flooding stderr well past a pipe buffer
+    script = (
+        "import sys\n"
+        "sys.stderr.write('warning ' * 100_000)\n"
+        f"sys.stdout.write({''.join(OUTPUT)!r})\n"
+        f"sys.exit({exit_code})\n"
+    )
+    monkeypatch.setattr(winget, "get_winget_index", lambda: None)
+    monkeypatch.setattr(winget, "_winget_command", lambda term: [sys.executable, "-c", script])
+
+
+def test_search_with_noisy_stderr_does_not_block(monkeypatch):
+    _fake_winget(monkeypatch, 0)
+    rows = winget.search_winget_packages("chrome")
+    assert [r["Id"] for r in rows] == ["Google.Chrome", "Google.ChromeRemote"]
+
+
+def test_failed_search_returns_nothing_but_streaming_reports_the_error(monkeypatch):
+    _fake_winget(monkeypatch, 1)
+    assert winget.search_winget_packages("chrome") == []
+
+    rows = winget.iter_winget_packages("chrome")
+    assert next(rows)["Id"] == "Google.Chrome"
+    with pytest.raises(winget.WingetSearchError):
+        list(rows)
+
+
+SHOW_OUTPUT = """\
+Found Google Chrome [Google.Chrome]
+Version: 120.0.6099.130
+Publisher: Google LLC
+Description: A fast, secure, and free web browser.
+Tags:
+  browser
+Installer:
+  Installer Type: wix
+  Installer Url: https://dl.google.com/chrome/install/googlechromestandaloneenterprise64.msi
+  Installer SHA256: 0123abcd
+""".splitlines()
+
+
+def test_parse_winget_show():
+    package = parse_winget_show(SHOW_OUTPUT)
+
+    assert package == {
+        "id": "Google.Chrome",
+        "name": "Google Chrome",
+        "version": "120.0.6099.130",
+        "publisher": "Google LLC",
+        "installers": [{
+            "type": "wix",
+            "url": "https://dl.google.com/chrome/install/googlechromestandaloneenterprise64.msi",
+            "sha256": "0123abcd",
+        }],
+    }
+    assert parse_winget_show(["No package found matching input criteria."]) is None
+
+
+def test_resolve_reports_partial_failures_and_limits_concurrency(monkeypatch):
+    running, peak = [], []
+
+    def _show(package_id):
+        running.append(package_id)
+        peak.append(len(running))
+        time.sleep(0.05)
+        running.remove(package_id)
+        if package_id == "Missing.App":
+            raise LookupError(f"Package not found: {package_id}")
+        return {"id": package_id, "version": "1.0"}
+
+    monkeypatch.setattr(winget, "show_winget_package", _show)
+    ids = ["A.One", "Missing.App", "B.Two", "A.One", "C.Three"]
+
+    result = asyncio.run(winget.resolve_winget_packages(ids, max_concurrency=2))
+
+    assert list(result["resolved"]) == ["A.One", "B.Two", "C.Three"]
+    assert result["failed"] == {"Missing.App": "Package not found: Missing.App"}
+    assert max(peak) <= 2
+
+
+def test_show_rejects_ids_that_are_not_winget_identifiers():
+    with pytest.raises(ValueError):
+        winget.show_winget_package("x'; Remove-Item -Recurse C:\\ ;'")
@@ -0,0 +1,110 @@
+import os
+import textwrap
+import time
+
+import pytest
+
+from api.functions.winget_index import IndexNotConfiguredError, WingetIndex, version_key
+
+
+def _write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(textwrap.dedent(text), encoding="utf-8")
+
+
+def _multi_file(root, package_id, version, name, moniker=None, tags=()):
+    publisher, package = package_id.split(".", 1)
+    base = root / package_id[0].lower() / publisher / package / version
+    _write(base / f"{package_id}.yaml", f"""\
+        PackageIdentifier: {package_id}
+        PackageVersion: {version}
+        DefaultLocale: en-US
+        ManifestType: version
+        """)
+    locale = [f"PackageIdentifier: {package_id}", f"PackageVersion: {version}",
+              f"PackageName: {name}", f"Publisher: {publisher}", "ManifestType: defaultLocale"]
+    if moniker:
+        locale.append(f"Moniker: {moniker}")
+    if tags:
+        locale += ["Tags:", *(f"- {t}" for t in tags)]
+    _write(base / f"{package_id}.locale.en-US.yaml", "\n".join(locale) + "\n")
+    _write(base / f"{package_id}.installer.yaml", f"""\
+        PackageIdentifier: {package_id}
+        PackageVersion: {version}
+        InstallerType: msi
+        Installers:
+        - Architecture: x64
+          InstallerUrl: https://example.com/{package_id}-{version}.msi
+          InstallerSha256: ABCDEF
+        ManifestType: installer
+        """)
+    return base
+
+
+@pytest.fixture
+def manifests(tmp_path):
+    root = tmp_path / "manifests"
+    _multi_file(root, "Google.Chrome", "120.0.1", "Google Chrome", moniker="chrome", tags=["browser", "web"])
+    _multi_file(root, "Google.Chrome", "99.0", "Google Chrome", moniker="chrome")
+    _multi_file(root, "Mozilla.Firefox", "121.0", "Mozilla Firefox", moniker="firefox", tags=["browser"])
+    _multi_file(root, "Microsoft.VisualStudioCode", "1.10", "Microsoft Visual Studio Code", moniker="vscode")
+    _write(root / "n" / "Notepad++" / "Notepad++" / "8.6" / "Notepad++.Notepad++.yaml", """\
+        PackageIdentifier: Notepad++.Notepad++
+        PackageVersion: 8.6
+        PackageName: Notepad++
+        Publisher: Notepad++ Team
+        Moniker: notepad++
+        InstallerType: nullsoft
+        Installers:
+        - Architecture: x64
+          InstallerUrl: https://example.com/npp.exe
+        ManifestType: singleton
+        """)
+    return root
+
+
+def test_search_returns_winget_shaped_latest_versions(manifests):
+    index = WingetIndex(str(manifests))
+    assert index.refresh()["packages"] == 4
+
+    assert index.search("chrome") == [
+        {"Name": "Google Chrome", "Id": "Google.Chrome", "Version": "120.0.1", "Source": "winget"}]
+    # Scalars are kept as strings, so 1.10 is not turned into 1.1
+    assert index.search("vscode")[0]["Version"] == "1.10"
+    assert [r["Id"] for r in index.search("browser")] == ["Google.Chrome", "Mozilla.Firefox"]
+    assert [r["Id"] for r in index.search("fire")] == ["Mozilla.Firefox"]
+    assert [r["Id"] for r in index.search("studio")] == ["Microsoft.VisualStudioCode"]
+    # Typo-tolerant fallback
+    assert [r["Id"] for r in index.search("firefx")] == ["Mozilla.Firefox"]
+    assert index.get("notepad++.notepad++")["installers"][0]["type"] == "nullsoft"
+
+
+def test_snapshot_round_trip_and_incremental_refresh(manifests, tmp_path):
+    snapshot = str(tmp_path / "index.json.gz")
+    index = WingetIndex(str(manifests))
+    index.refresh()
+    index.save(snapshot)
+
+    loaded = WingetIndex.load(snapshot)
+    assert loaded.search("firefox") == index.search("firefox")
+    assert loaded.refresh() == {"parsed": 0, "removed": 0, "failed": 0, "packages": 4}
+
+    new_dir = _multi_file(manifests, "Mozilla.Firefox", "122.0", "Mozilla Firefox", moniker="firefox")
+    later = time.time() + 5
+    for f in new_dir.iterdir():
+        os.utime(f, (later, later))
+    stats = loaded.refresh()
+
+    assert stats["parsed"] == 1
+    assert loaded.search("firefox")[0]["Version"] == "122.0"
+
+
+def test_version_key_orders_numerically():
+    assert version_key("10.0") > version_key("9.9")
+    assert version_key("1.10") > version_key("1.9")
+
+
+def test_refresh_without_manifest_dir_is_not_configured():
+    # A snapshot-only deployment has nothing to refresh from
+    with pytest.raises(IndexNotConfiguredError):
+        WingetIndex().refresh()
@@ -22,6 +22,7 @@ import {
   RefreshCw,
 } from "lucide-react"
 import { useState, useEffect } from "react"
+import { waitForDeploymentJob } from "@/lib/deployment-jobs"
 
 import { Button } from "@/components/ui/button"
 import { Card, CardContent, CardDescription, CardFooter, CardHeader, CardTitle } from "@/components/ui/card"
@@ -119,7 +120,7 @@ interface AppLibraryUploadRequest {
  * Interface for the API response
  */
 interface UploadResponse {
-  app_id: string // ID of the deployed application
+  job_id: string // ID of the background deployment job
 }
 
 /**
@@ -477,6 +478,9 @@ export function AppLibraryDeploymentPage() {
 
       const data: UploadResponse = await response.json()
 
+      // The API deploys in the background; wait for the job to finish
+      const appId = await waitForDeploymentJob(API_BASE_URL, data.job_id)
+
       // Record the deployment in the database
       if (app.version_id) {
         const { data: versionData } = await supabase
@@ -489,7 +493,7 @@ export function AppLibraryDeploymentPage() {
           await supabase.from("deployments").insert({
             app_version_id: versionData.id,
             status: "success",
-            intune_app_id: data.app_id,
+            intune_app_id: appId,
           })
         }
       }
@@ -498,7 +502,7 @@ export function AppLibraryDeploymentPage() {
       return {
         ...app,
         deploymentStatus: "success",
-        appId: data.app_id,
+        appId,
       }
     } catch (error) {
       // Record the failed deployment in the database
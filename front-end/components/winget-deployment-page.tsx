@@ -29,6 +29,7 @@ import { vscDarkPlus, vs } from "react-syntax-highlighter/dist/esm/styles/prism"
 import { Tooltip, TooltipProvider, TooltipTrigger, TooltipContent } from "@/components/ui/tooltip";
 import { useTheme } from "next-themes";
 import { useState, useEffect } from "react"
+import { waitForDeploymentJob } from "@/lib/deployment-jobs"
 
 import { Button } from "@/components/ui/button"
 import {
@@ -107,7 +108,7 @@ interface UploadRequest {
  * Interface for the API response
  */
 interface UploadResponse {
-  app_id: string // ID of the deployed application
+  job_id: string // ID of the background deployment job
 }
 
 /**
@@ -443,11 +444,14 @@ export function WingetDeploymentPage() {
 
       const data: UploadResponse = await response.json()
 
+      // The API deploys in the background; wait for the job to finish
+      const appId = await waitForDeploymentJob(apiUrlBase, data.job_id)
+
       // Return updated app with success status
       return {
         ...app,
         deploymentStatus: "success",
-        appId: data.app_id,
+        appId,
       }
     } catch (error) {
       // Return updated app with failure status
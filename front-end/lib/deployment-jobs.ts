@@ -0,0 +1,52 @@
+/**
+ * Helpers for the API's background deployment jobs.
+ *
+ * `POST /apps` and `POST /app-library/deploy` return a job immediately; the
+ * Intune app ID becomes available once the job has succeeded.
+ */
+
+export interface DeploymentJob {
+  job_id: string
+  kind: string
+  label: string | null
+  status: "queued" | "running" | "succeeded" | "failed"
+  stage: string
+  result: string | null // Intune app ID once the job has succeeded
+  error: string | null
+}
+
+/**
+ * Polls `GET /jobs/{jobId}` until the job finishes.
+ *
+ * @param apiBase - Base URL of the deployment API
+ * @param jobId - The job ID returned by the deploy endpoint
+ * @param onUpdate - Optional callback invoked with every job snapshot
+ * @param intervalMs - Delay between polls in milliseconds
+ * @returns The Intune app ID of the deployed application
+ */
+export async function waitForDeploymentJob(
+  apiBase: string,
+  jobId: string,
+  onUpdate?: (job: DeploymentJob) => void,
+  intervalMs = 3000,
+): Promise<string> {
+  while (true) {
+    const response = await fetch(`${apiBase}/jobs/${jobId}`)
+    if (!response.ok) {
+      const errorData = await response.text()
+      throw new Error(errorData || "Failed to fetch deployment status")
+    }
+
+    const job: DeploymentJob = await response.json()
+    onUpdate?.(job)
+
+    if (job.status === "succeeded") {
+      return job.result as string
+    }
+    if (job.status === "failed") {
+      throw new Error(job.error || `Deployment failed during stage: ${job.stage}`)
+    }
+
+    await new Promise((resolve) => setTimeout(resolve, intervalMs))
+  }
+}